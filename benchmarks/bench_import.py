@@ -0,0 +1,55 @@
+"""Startup latency of pixpy_app.
+
+Imports pixpy.app in fresh interpreters and reports the median import time
+and any heavy module that got loaded on the way. Exits non-zero if the
+median is above --max_seconds or a heavy module was imported, so it can
+guard startup latency.
+
+    python benchmarks/bench_import.py --max_seconds 1
+"""
+from argparse import ArgumentParser
+import json
+import subprocess
+import sys
+import numpy as np
+
+HEAVY_MODULES = ('pandas', 'xarray', 'netCDF4', 'h5py', 'gpiozero')
+
+PROBE = f"""
+import json, sys, time
+start = time.perf_counter()
+import {{module}}
+elapsed = time.perf_counter() - start
+print(json.dumps({{{{
+    'seconds': elapsed,
+    'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}}}))
+"""
+
+
+def import_time(module):
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE.format(module=module)],
+        check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--module', type=str, default='pixpy.app')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--max_seconds', type=float, default=1.0)
+    args = parser.parse_args()
+    results = [import_time(args.module) for _ in range(args.repeats)]
+    seconds = np.median([r['seconds'] for r in results])
+    heavy = sorted({m for r in results for m in r['heavy']})
+    print(f'import {args.module}: median {seconds * 1000:.1f} ms '
+          f'over {args.repeats} runs')
+    if heavy:
+        print(f'heavy modules imported: {", ".join(heavy)}')
+    if seconds > args.max_seconds or heavy:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Quicklook cost per image: lookup table colouring and PNG/JPEG encoding.
+
+Colours synthetic (height, width) raw images (0.1 K + 1000, with a few
+pixels not computed) with pixpy.quicklook.colourise at each downsampling
+factor and encodes them, reporting ms per image for contrast + colouring
+and for encoding, and the encoded size. JPEG is only timed if Pillow is
+installed.
+
+    python benchmarks/bench_quicklook.py --height 288 --width 382
+"""
+from argparse import ArgumentParser
+from importlib.util import find_spec
+import time
+import numpy as np
+from pixpy.quicklook import colourise, encode_quicklook, make_lut
+
+
+def synthetic_images(n_images, height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    images = []
+    for k in range(n_images):
+        scene = 1200 + 80 * np.sin(xx / 25 + k / 10) * np.cos(yy / 40) + \
+            rng.normal(0, 3, (height, width))
+        image = scene.astype(np.uint16)
+        image[rng.random((height, width)) < 0.001] = 0
+        images.append(image)
+    return images
+
+
+def time_per_image(function, items, repeats):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = [function(item) for item in items]
+        best = min(best, time.perf_counter() - start)
+    return best / len(items) * 1000, results
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--n_images', type=int, default=50)
+    parser.add_argument('--height', type=int, default=120)
+    parser.add_argument('--width', type=int, default=160)
+    parser.add_argument('--palette', default='iron')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    images = synthetic_images(args.n_images, args.height, args.width)
+    lut = make_lut(args.palette)
+    formats = ['png']
+    if find_spec('PIL') is not None:
+        formats.append('jpeg')
+    print(f"{'downsample':>10} {'format':>6} {'colour_ms':>9} "
+          f"{'encode_ms':>9} {'total_ms':>8} {'kB':>6}")
+    for downsample in (1, 2, 4):
+        colour_ms, rgbs = time_per_image(
+            lambda raw: colourise(raw, lut, downsample=downsample),
+            images, args.repeats)
+        for fmt in formats:
+            encode_ms, encoded = time_per_image(
+                lambda rgb: encode_quicklook(rgb, fmt), rgbs, args.repeats)
+            kb = np.mean([len(e) for e in encoded]) / 1000
+            print(f'{downsample:10d} {fmt:>6} {colour_ms:9.2f} '
+                  f'{encode_ms:9.2f} {colour_ms + encode_ms:8.2f} {kb:6.1f}')
+
+
+if __name__ == '__main__':
+    main()
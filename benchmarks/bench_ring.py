@@ -0,0 +1,89 @@
+"""Frame ring throughput with 0..N reader processes attached.
+
+The producer publishes 160x120 frames into a pixpy.FrameRing at --fps (or
+as fast as it can with --fps 0) for --seconds while each reader process
+follows the ring with RingReader and copies out every frame. Reports the
+producer's publish rate and what the readers received, so the producer
+rate with readers attached can be compared with none.
+
+    python benchmarks/bench_ring.py --readers 0 1 4
+"""
+from argparse import ArgumentParser
+import multiprocessing
+import time
+import numpy as np
+from pixpy.pixpy import FRAME_METADATA_DTYPE
+from pixpy.ring import FrameRing, RingReader
+
+RING_NAME = 'pixpy_bench_ring'
+
+
+def reader(name, results):
+    ring = RingReader(name)
+    n_frames = 0
+    for n, frame, meta in ring.frames_from(ring.published(), timeout=1.0):
+        n_frames += 1
+    results.put((n_frames, ring.overruns))
+    ring.close()
+
+
+def produce(ring, seconds, fps):
+    frames = np.random.default_rng(0).integers(
+        1100, 1300, (32, ring.height, ring.width), dtype=np.uint16)
+    meta = np.zeros(1, dtype=FRAME_METADATA_DTYPE)[0]
+    n = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        meta['counterHW'] = n
+        ring.publish(frames[n % frames.shape[0]], meta)
+        n += 1
+        if fps:
+            time.sleep(max(start + n / fps - time.perf_counter(), 0))
+    return n / (time.perf_counter() - start)
+
+
+def run_case(n_readers, seconds, fps, n_slots):
+    ring = FrameRing(RING_NAME, 120, 160, n_slots)
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    readers = [context.Process(target=reader,
+                               args=(RING_NAME, results))
+               for _ in range(n_readers)]
+    for process in readers:
+        process.start()
+    time.sleep(1.0)  # let the readers attach
+    published_fps = produce(ring, seconds, fps)
+    received = [results.get() for _ in readers]
+    for process in readers:
+        process.join()
+    ring.close()
+    return published_fps, received
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--readers', type=int, nargs='+', default=[0, 1, 4])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--fps', type=float, default=32.0,
+                        help='Pace the producer like a camera (0 = as fast '
+                             'as possible)')
+    parser.add_argument('--n_slots', type=int, default=64)
+    args = parser.parse_args()
+    print(f"{'readers':>7} {'publish_fps':>12} {'read_fps (min)':>15} "
+          f"{'overruns (max)':>15}")
+    for n_readers in args.readers:
+        published_fps, received = run_case(
+            n_readers, args.seconds, args.fps, args.n_slots)
+        if received:
+            read_fps = min(r[0] for r in received) / args.seconds
+            overruns = max(r[1] for r in received)
+            print(f'{n_readers:7d} {published_fps:12.0f} {read_fps:15.0f} '
+                  f'{overruns:15d}')
+        else:
+            print(f'{n_readers:7d} {published_fps:12.0f} {"-":>15} '
+                  f'{"-":>15}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Per-sample statistics: StreamingAggregator vs the NumPy calls on a cube.
+
+For each set of statistics, times the NumPy reference on an (n_images,
+120, 160) uint16 stack (np.median / np.percentile, which work in float64,
+plus min, max, std and a sorted trimmed mean) against folding the same
+frames into a StreamingAggregator and computing every statistic from its
+one shared histogram. Also checks that both give the same values.
+
+    python benchmarks/bench_statistics.py --n_images 160
+"""
+from argparse import ArgumentParser
+import time
+import numpy as np
+from pixpy.aggregate import StreamingAggregator, compute_statistics
+
+CASES = [
+    ('snapshot', 'median', 'min', 'max', 'std'),
+    ('snapshot', 'median', 'min', 'max', 'std', 'p05', 'p95'),
+    ('snapshot', 'median', 'min', 'max', 'std', 'p05', 'p95', 'mean', 'iqr',
+     'trimmed_mean10'),
+]
+
+
+def synthetic_frames(n_images, height=120, width=160, seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    scene = 1200 + 50 * np.sin(xx / 20) * np.cos(yy / 30)
+    return (scene + rng.normal(0, 5, (n_images, height, width))).astype(
+        np.uint16)
+
+
+def numpy_statistics(frames, names):
+    values = {}
+    for name in names:
+        if name == 'snapshot':
+            values[name] = frames[-1]
+        elif name == 'median':
+            values[name] = np.median(frames, axis=0)
+        elif name == 'min':
+            values[name] = frames.min(axis=0)
+        elif name == 'max':
+            values[name] = frames.max(axis=0)
+        elif name == 'mean':
+            values[name] = frames.mean(axis=0)
+        elif name == 'std':
+            values[name] = frames.std(axis=0) + 1000
+        elif name == 'iqr':
+            q75, q25 = np.percentile(frames, [75, 25], axis=0)
+            values[name] = q75 - q25 + 1000
+        elif name.startswith('trimmed_mean'):
+            cut = int(float(name[12:]) / 100 * frames.shape[0])
+            values[name] = np.sort(frames, axis=0)[
+                cut:frames.shape[0] - cut].mean(axis=0)
+        else:
+            values[name] = np.percentile(frames, float(name[1:]), axis=0)
+    return values
+
+
+def aggregator_statistics(aggregator, frames, names):
+    aggregator.reset()
+    for frame in frames:
+        aggregator.update(frame)
+    return compute_statistics(aggregator, names)
+
+
+def best_of(repeats, function, *args):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--n_images', type=int, default=160)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    frames = synthetic_frames(args.n_images)
+    n_images, height, width = frames.shape
+    aggregator = StreamingAggregator(height, width)
+    print(f"{'statistics':62} {'numpy_s':>8} {'pixpy_s':>8} {'max_diff':>8}")
+    for names in CASES:
+        numpy_s, expected = best_of(
+            args.repeats, numpy_statistics, frames, names)
+        pixpy_s, result = best_of(
+            args.repeats, aggregator_statistics, aggregator, frames, names)
+        max_diff = max(float(np.abs(result[name] - expected[name]).max())
+                       for name in names)
+        print(f"{' '.join(names):62} {numpy_s:8.3f} {pixpy_s:8.3f} "
+              f"{max_diff:8.2g}")
+
+
+if __name__ == '__main__':
+    main()
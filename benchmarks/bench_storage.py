@@ -0,0 +1,96 @@
+"""Write throughput of the pixpy storage backends.
+
+Writes realistic 160x120 uint16 sample stacks through each backend / codec
+and reports MB/s, CPU seconds and compression ratio.
+
+    python benchmarks/bench_storage.py --n_samples 60
+"""
+from argparse import ArgumentParser
+from datetime import datetime
+from pathlib import Path
+import os
+import tempfile
+import time
+import numpy as np
+from pixpy.writer import IMAGE_VARIABLES, META_VARIABLES, open_writer
+
+CASES = [
+    ('netcdf', 'none', 0),
+    ('netcdf', 'zlib', 1),
+    ('netcdf', 'zlib', 5),
+    ('h5py', 'none', 0),
+    ('h5py', 'lzf', 0),
+    ('h5py', 'zlib', 1),
+    ('h5py', 'zlib', 5),
+    ('npy', 'none', 0),
+]
+
+
+def synthetic_samples(n_samples, height=120, width=160, seed=0):
+    # smooth scene around 20 degC with sensor noise, in the raw
+    # brightness_temperature * 10 + 1000 encoding
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    scene = 1200 + 50 * np.sin(xx / 20) * np.cos(yy / 30)
+    image_dtype = np.dtype(
+        [(field, np.uint16) for field, _ in IMAGE_VARIABLES.values()])
+    meta_dtype = np.dtype(
+        [('time', float)] +
+        [(field, float) for field, _ in META_VARIABLES.values()])
+    images = np.empty((n_samples, height, width), dtype=image_dtype)
+    for field in image_dtype.names:
+        images[field] = scene + rng.normal(0, 3, (n_samples, height, width))
+    images['std'] = 1000 + rng.integers(0, 20, (n_samples, height, width))
+    meta = np.zeros(n_samples, dtype=meta_dtype)
+    meta['time'] = np.arange(n_samples) * 60000.0
+    return images, meta
+
+
+def directory_size(file_path):
+    if os.path.isdir(file_path):
+        return sum(p.stat().st_size for p in Path(file_path).rglob('*'))
+    return os.path.getsize(file_path)
+
+
+def run_case(directory, storage_backend, compression, level, images, meta):
+    n_samples, height, width = images.shape
+    base_path = os.path.join(
+        directory, f'{storage_backend}_{compression}_{level}')
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    writer = open_writer(
+        storage_backend, base_path, height, width, n_samples,
+        datetime(2022, 7, 1), meta.dtype, {'description': 'pixpy'},
+        compression=compression, compression_level=level)
+    for j in range(n_samples):
+        writer.append(images[j], meta[j])
+    writer.close()
+    wall_s = time.perf_counter() - wall_start
+    cpu_s = time.process_time() - cpu_start
+    raw_bytes = images.nbytes + meta.nbytes
+    return {
+        'backend': storage_backend,
+        'codec': f'{compression}:{level}',
+        'MB/s': raw_bytes / wall_s / 1e6,
+        'cpu_s': cpu_s,
+        'ratio': raw_bytes / directory_size(writer.file_path),
+    }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--n_samples', type=int, default=60)
+    parser.add_argument('--directory', type=str, default=None)
+    args = parser.parse_args()
+    images, meta = synthetic_samples(args.n_samples)
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        print(f"{'backend':8} {'codec':8} {'MB/s':>8} {'cpu_s':>8} "
+              f"{'ratio':>6}")
+        for case in CASES:
+            r = run_case(directory, *case, images, meta)
+            print(f"{r['backend']:8} {r['codec']:8} {r['MB/s']:8.1f} "
+                  f"{r['cpu_s']:8.3f} {r['ratio']:6.2f}")
+
+
+if __name__ == '__main__':
+    main()
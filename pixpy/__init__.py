@@ -1,5 +1,79 @@
-from . import config
-from pixpy.pixpy import (
-    Shutter, SnapshotSchedule, usb_init_retry, set_shutter_mode, 
-    get_thermal_image_size, get_serial, get_thermal_image_metadata, terminate,
-    )
+from importlib import import_module
+
+# public names are imported from their submodule on first use, so that
+# `import pixpy` stays cheap and optional heavy dependencies (netCDF4, h5py,
+# the vendor SDK) are only loaded by the code paths that need them
+_LAZY_ATTRIBUTES = {
+    'pixpy.pixpy': (
+        'Shutter', 'SnapshotSchedule', 'usb_init_retry', 'set_shutter_mode',
+        'get_thermal_image_size', 'get_serial', 'get_thermal_image_metadata',
+        'terminate', 'capture_burst', 'FrameGrabber', 'FRAME_METADATA_DTYPE',
+        'FlagState', 'CameraBackend', 'SDKBackend', 'set_backend',
+        'get_backend', 'FlagGate',
+    ),
+    'pixpy.backends': (
+        'SyntheticBackend', 'ReplayBackend', 'CAMERA_BACKENDS', 'make_backend',
+    ),
+    'pixpy.aggregate': (
+        'StreamingAggregator', 'summarise_frame_metadata', 'STATISTICS',
+        'DEFAULT_STATISTICS', 'parse_statistics', 'compute_statistics',
+    ),
+    'pixpy.pipeline': ('CapturePipeline', 'StageQueue', 'QUEUE_POLICIES'),
+    'pixpy.writer': (
+        'NetCDFWriter', 'H5pyWriter', 'NpySpoolWriter', 'STORAGE_BACKENDS',
+        'open_writer', 'RoiWriter',
+    ),
+    'pixpy.archive': (
+        'ArchiveIndex', 'ArchiveSelection', 'ArchiveArray', 'open_archive',
+    ),
+    'pixpy.metrics': (
+        'MetricsRegistry', 'MetricsServer', 'MetricsFile', 'METRICS',
+        'CombinedMetrics', 'MetricsPush',
+    ),
+    'pixpy.profiling': ('ProfileControl', 'StackSampler'),
+    'pixpy.rawarchive': (
+        'RawArchiveWriter', 'read_raw_archive', 'RAW_CODECS',
+    ),
+    'pixpy.quicklook': (
+        'QuicklookWorker', 'colourise', 'make_lut', 'encode_png', 'PALETTES',
+    ),
+    'pixpy.compact': ('compact_day', 'find_days', 'check_samples'),
+    'pixpy.ring': ('FrameRing', 'RingReader', 'ring_name'),
+    'pixpy.roi': (
+        'Roi', 'RoiSeries', 'make_roi', 'parse_roi_statistics',
+        'ROI_STATISTICS',
+    ),
+    'pixpy.spool': (
+        'convert_spool', 'recover_spools', 'mark_deferred',
+        'finalise_part_files', 'file_time_end', 'SpoolConverter',
+    ),
+    'pixpy.scheduler': (
+        'SampleTimeline', 'LatencyHistogram', 'sleep_until',
+        'ScheduleWatcher', 'snapshot_schedule',
+    ),
+    'pixpy.recovery': (
+        'FrameRecovery', 'classify_return_code', 'backoff_delay',
+    ),
+    'pixpy.shutter_events': ('ShutterEvents', 'SHUTTER_OPEN', 'BURST_DONE'),
+    'pixpy.supervisor': ('Supervisor',),
+    'pixpy.qos': (
+        'QosController', 'QOS_ACTIONS', 'QOS_DESCRIPTION', 'parse_qos_levels',
+        'shed_actions',
+    ),
+}
+_LAZY = {name: module for module, names in _LAZY_ATTRIBUTES.items()
+         for name in names}
+
+
+def __getattr__(name):
+    try:
+        module = _LAZY[name]
+    except KeyError:
+        raise AttributeError(f"module 'pixpy' has no attribute '{name}'")
+    value = getattr(import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
@@ -0,0 +1,334 @@
+import re
+import numpy as np
+from pixpy.pixpy import TIMESTAMP_TICKS_PER_SECOND
+
+
+class StreamingAggregator:
+    """Per-pixel statistics of a burst of frames, folded in a frame at a time.
+
+    min, max, mean and std (Welford) are exact. The median, percentiles and
+    trimmed means come from one per-pixel histogram centred on the first
+    frame of the burst, cumulated once per burst and shared by all of them,
+    which is exact for bin_width 1. Values further than
+    +/- median_bins * bin_width / 2 from that frame are kept aside as they
+    are, and the pixels that had any (clamped_pixels) get their statistics
+    from a sort of all their values instead. Once more values than pixels
+    are kept aside (e.g. the first frame was taken with the flag closing),
+    the window of those pixels is re-centred on their median so that only
+    the outliers stay aside. The median histogram and the snapshot copy can
+    be switched off per burst in reset() to save time.
+    """
+
+    def __init__(self, height: int, width: int, median_bins: int = 256,
+                 median_bin_width: int = 1):
+        self.height = height
+        self.width = width
+        self.median_bins = median_bins
+        self.median_bin_width = median_bin_width
+        n_pixels = height * width
+        self._pixel_index = np.arange(n_pixels, dtype=np.int64)
+        # the last row counts the values outside the histogram window
+        self._hist = np.zeros((median_bins + 1, n_pixels), dtype=np.uint16)
+        self._cumulative = np.empty((median_bins, n_pixels), dtype=np.uint32)
+        self._bin_index = np.empty(n_pixels, dtype=np.int64)
+        self._offset = np.empty(n_pixels, dtype=np.int64)
+        self._outside = np.empty(n_pixels, dtype=bool)
+        self._outside_pixels = []
+        self._outside_values = []
+        self.outside_count = 0
+        self._outside_limit = n_pixels
+        self._exact = None
+        self._min = np.empty(n_pixels, dtype=np.uint16)
+        self._max = np.empty(n_pixels, dtype=np.uint16)
+        self._mean = np.empty(n_pixels, dtype=float)
+        self._m2 = np.empty(n_pixels, dtype=float)
+        self._delta = np.empty(n_pixels, dtype=float)
+        self._work = np.empty(n_pixels, dtype=float)
+        self._snapshot = np.empty(n_pixels, dtype=np.uint16)
+        self.n = 0
+        self.median_enabled = True
+        self.snapshot_enabled = True
+        self._cumulated = False
+
+    def reset(self, median: bool = True, snapshot: bool = True):
+        if median:
+            self._hist.fill(0)
+        self.median_enabled = median
+        self.snapshot_enabled = snapshot
+        self._cumulated = False
+        self._outside_pixels = []
+        self._outside_values = []
+        self.outside_count = 0
+        self._outside_limit = self._pixel_index.size
+        self.n = 0
+
+    def update(self, frame: np.ndarray):
+        if self.n == np.iinfo(self._hist.dtype).max:
+            raise ValueError('Too many frames for one aggregate')
+        x = frame.reshape(-1)
+        if self.n == 0:
+            np.copyto(self._offset, x)
+            self._offset -= (self.median_bins // 2) * self.median_bin_width
+            np.copyto(self._min, x)
+            np.copyto(self._max, x)
+            self._mean.fill(0)
+            self._m2.fill(0)
+        else:
+            np.minimum(self._min, x, out=self._min)
+            np.maximum(self._max, x, out=self._max)
+        self.n += 1
+        self._cumulated = False
+        # welford running mean / sum of squared differences
+        np.subtract(x, self._mean, out=self._delta)
+        np.divide(self._delta, self.n, out=self._work)
+        self._mean += self._work
+        np.subtract(x, self._mean, out=self._work)
+        self._work *= self._delta
+        self._m2 += self._work
+        if self.snapshot_enabled:
+            np.copyto(self._snapshot, x)
+        if not self.median_enabled:
+            return
+        # median histogram: each pixel gets exactly one count per frame, so
+        # the flat indices are unique and fancy-index increment is safe
+        np.subtract(x, self._offset, out=self._bin_index)
+        if self.median_bin_width != 1:
+            self._bin_index //= self.median_bin_width
+        # negative bins are huge as unsigned, so one comparison finds both
+        # ends
+        np.greater_equal(self._bin_index.view(np.uint64), self.median_bins,
+                         out=self._outside)
+        if self._outside.any():
+            pixels = np.flatnonzero(self._outside)
+            self._outside_pixels.append(pixels.astype(np.uint32))
+            self._outside_values.append(x[pixels].astype(np.uint16))
+            self.outside_count += pixels.size
+            self._bin_index[pixels] = self.median_bins
+        self._bin_index *= self._pixel_index.size
+        self._bin_index += self._pixel_index
+        self._hist.reshape(-1)[self._bin_index] += 1
+        if self.outside_count > self._outside_limit:
+            self._recentre()
+
+    def _recentre(self):
+        # move the window of the pixels with values kept aside to their
+        # median and bin their values again
+        pixels, values = self._sorted_outside_pixels()
+        half = (self.median_bins // 2) * self.median_bin_width
+        self._offset[pixels] = np.floor(
+            np.median(values, axis=1)).astype(np.int64) - half
+        values = np.floor(values).astype(np.int64)
+        bins = (values - self._offset[pixels, np.newaxis]) // \
+            self.median_bin_width
+        outside = (bins < 0) | (bins >= self.median_bins)
+        columns = np.broadcast_to(pixels[:, np.newaxis], bins.shape)
+        self._hist[:, pixels] = 0
+        np.add.at(self._hist, (bins[~outside], columns[~outside]), 1)
+        self._hist[self.median_bins, pixels] = outside.sum(axis=1)
+        self.outside_count = int(outside.sum())
+        self._outside_pixels = [columns[outside].astype(np.uint32)] \
+            if self.outside_count else []
+        self._outside_values = [values[outside].astype(np.uint16)] \
+            if self.outside_count else []
+        # pixels whose values are too spread for any window stay aside, so
+        # do not re-centre them again until there are twice as many
+        self._outside_limit = max(self._outside_limit,
+                                  2 * self.outside_count)
+
+    def _reshape(self, a: np.ndarray) -> np.ndarray:
+        return a.reshape(self.height, self.width)
+
+    def _cumulate(self):
+        if self.n == 0:
+            raise ValueError('No frames to aggregate')
+        if not self.median_enabled:
+            raise ValueError('Median was not enabled for this burst')
+        if not self._cumulated:
+            # only the bins between the burst min and max hold counts
+            lo = (int((self._min - self._offset).min()) //
+                  self.median_bin_width)
+            hi = (int((self._max - self._offset).max()) //
+                  self.median_bin_width) + 1
+            self._rows = slice(max(lo, 0), min(max(hi, 1), self.median_bins))
+            np.cumsum(self._hist[self._rows], axis=0,
+                      out=self._cumulative[self._rows])
+            self._exact = self._sorted_outside_pixels()
+            self._cumulated = True
+
+    @property
+    def clamped_pixels(self) -> int:
+        """Pixels with values outside the histogram window this burst."""
+        return int(np.count_nonzero(self._hist[self.median_bins]))
+
+    def _sorted_outside_pixels(self):
+        # (pixels, (n_pixels, n) sorted values) of the pixels with values
+        # outside the window: their histogram values plus the ones kept aside
+        if not self._outside_pixels:
+            return None
+        pixels = np.flatnonzero(self._hist[self.median_bins])
+        counts = self._hist[:self.median_bins, pixels]
+        bins, k = np.nonzero(counts)
+        repeats = counts[bins, k]
+        local = np.concatenate([
+            np.repeat(k, repeats),
+            np.searchsorted(pixels, np.concatenate(self._outside_pixels))])
+        bin_values = self._offset[pixels[k]] + bins * self.median_bin_width + \
+            (self.median_bin_width - 1) / 2
+        values = np.concatenate([np.repeat(bin_values, repeats),
+                                 np.concatenate(self._outside_values)])
+        order = np.lexsort((values, local))
+        return pixels, values[order].reshape(pixels.size, self.n)
+
+    def _rank_bin(self, rank: int) -> np.ndarray:
+        # histogram bin of the rank-th (0-based) sorted sample of every pixel
+        return self._rows.start + \
+            np.argmax(self._cumulative[self._rows] > rank, axis=0)
+
+    def _bin_value(self, bin_index: np.ndarray) -> np.ndarray:
+        return self._offset + bin_index * self.median_bin_width + \
+            (self.median_bin_width - 1) / 2
+
+    def percentile(self, q: float) -> np.ndarray:
+        """Like np.percentile(frames, q, axis=0) (linear interpolation)."""
+        self._cumulate()
+        position = q / 100 * (self.n - 1)
+        lower_rank = int(position)
+        fraction = position - lower_rank
+        lower = self._bin_value(self._rank_bin(lower_rank))
+        if fraction == 0:
+            result = lower.astype(float)
+        else:
+            upper = self._bin_value(self._rank_bin(lower_rank + 1))
+            result = lower + fraction * (upper - lower)
+        if self._exact is not None:
+            pixels, values = self._exact
+            result[pixels] = np.percentile(values, q, axis=1)
+        return self._reshape(result)
+
+    def median(self) -> np.ndarray:
+        return self.percentile(50)
+
+    def trimmed_mean(self, proportion: float) -> np.ndarray:
+        """Like scipy.stats.trim_mean: int(proportion * n) samples are cut
+        from each end of every pixel's sorted values."""
+        self._cumulate()
+        cut = int(proportion * self.n)
+        if 2 * cut >= self.n:
+            raise ValueError('Nothing left to average')
+        # samples of each bin that fall within ranks [cut, n - cut)
+        kept = np.clip(self._cumulative[self._rows], cut,
+                       self.n - cut).astype(np.int64)
+        kept[1:] -= kept[:-1].copy()
+        kept[0] -= cut
+        bins = np.arange(self._rows.start, self._rows.stop,
+                         dtype=np.int64)[:, np.newaxis]
+        bin_sum = (kept * bins).sum(axis=0)
+        result = self._bin_value(bin_sum / (self.n - 2 * cut))
+        if self._exact is not None:
+            pixels, values = self._exact
+            result[pixels] = values[:, cut:self.n - cut].mean(axis=1)
+        return self._reshape(result)
+
+    def min(self) -> np.ndarray:
+        return self._reshape(self._min)
+
+    def max(self) -> np.ndarray:
+        return self._reshape(self._max)
+
+    def mean(self) -> np.ndarray:
+        return self._reshape(self._mean)
+
+    def std(self) -> np.ndarray:
+        return self._reshape(np.sqrt(self._m2 / self.n))
+
+    def snapshot(self) -> np.ndarray:
+        return self._reshape(self._snapshot)
+
+
+# statistic name: (function of a StreamingAggregator returning the statistic
+# in the stored raw encoding (spreads are offset by 1000 like std), whether
+# it needs the histogram). pNN (percentile NN) and trimmed_meanNN (NN % cut
+# from each end) are made on demand by statistic().
+STATISTICS = {
+    'snapshot': (StreamingAggregator.snapshot, False),
+    'min': (StreamingAggregator.min, False),
+    'max': (StreamingAggregator.max, False),
+    'mean': (StreamingAggregator.mean, False),
+    'std': (lambda aggregator: aggregator.std() + 1000, False),
+    'median': (StreamingAggregator.median, True),
+    'iqr': (lambda aggregator: aggregator.percentile(75) -
+            aggregator.percentile(25) + 1000, True),
+}
+DEFAULT_STATISTICS = ('snapshot', 'median', 'min', 'max', 'std')
+_PERCENTILE = re.compile(r'p(\d+(?:\.\d+)?)$')
+_TRIMMED_MEAN = re.compile(r'trimmed_mean(\d+(?:\.\d+)?)$')
+
+
+def statistic(name: str) -> tuple:
+    if name in STATISTICS:
+        return STATISTICS[name]
+    match = _PERCENTILE.match(name)
+    if match and float(match[1]) <= 100:
+        q = float(match[1])
+        return (lambda aggregator: aggregator.percentile(q), True)
+    match = _TRIMMED_MEAN.match(name)
+    if match and float(match[1]) < 50:
+        proportion = float(match[1]) / 100
+        return (lambda aggregator: aggregator.trimmed_mean(proportion), True)
+    raise ValueError(f'Unknown statistic {name}')
+
+
+def parse_statistics(text: str) -> tuple:
+    names = tuple((text or '').replace(',', ' ').split())
+    if not names:
+        raise ValueError('No statistics')
+    if len(set(names)) != len(names):
+        raise ValueError('Repeated statistic')
+    for name in names:
+        statistic(name)
+    return names
+
+
+def compute_statistics(aggregator: StreamingAggregator,
+                       names: tuple) -> dict:
+    """Every statistic in names from one aggregated burst.
+
+    Statistics that need the histogram are 0 (never a valid raw value) if
+    it was switched off for the burst, as is an unkept snapshot.
+    """
+    values = {}
+    for name in names:
+        function, needs_histogram = statistic(name)
+        if (needs_histogram and not aggregator.median_enabled) or \
+                (name == 'snapshot' and not aggregator.snapshot_enabled):
+            values[name] = 0
+        else:
+            values[name] = function(aggregator)
+    return values
+
+
+def summarise_frame_metadata(frame_meta: np.ndarray) -> dict:
+    """Per-sample summary of FRAME_METADATA_DTYPE records, one per frame.
+
+    fps_hw is the delivered frame rate from the camera timestamps. Steps of
+    more than one in counterHW are counted as dropped frames, steps of zero
+    as duplicates; a backwards step (counter reset) counts as neither.
+    """
+    summary = {}
+    for field, name in (('tempChip', 'tchip'), ('tempBox', 'tbox'),
+                        ('tempFlag', 'tflag')):
+        values = frame_meta[field]
+        summary[f'{name}_min'] = values.min()
+        summary[f'{name}_mean'] = values.mean()
+        summary[f'{name}_max'] = values.max()
+    counter_step = np.diff(frame_meta['counterHW'].astype(np.int64))
+    gaps = counter_step[counter_step > 1]
+    summary['dropped_frames'] = gaps.sum() - gaps.size
+    summary['duplicate_frames'] = np.count_nonzero(counter_step == 0)
+    summary['flag_frames'] = np.count_nonzero(frame_meta['flagState'])
+    duration_s = (int(frame_meta['timestamp'][-1]) -
+                  int(frame_meta['timestamp'][0])) / \
+        TIMESTAMP_TICKS_PER_SECOND
+    summary['fps_hw'] = \
+        (frame_meta.size - 1) / duration_s if duration_s > 0 else np.nan
+    return summary
@@ -1,43 +1,285 @@
 from datetime import datetime as dt, timedelta
-from time import sleep
-import xarray as xr
+from time import sleep, monotonic
 import pixpy
+from pixpy import config, metrics
+from pixpy.profiling import ProfileControl
 import numpy as np
 import xml.etree.ElementTree as ET
 from os import path
+import signal
+from glob import glob
 from pathlib import Path
-from gpiozero import CPUTemperature
 from argparse import ArgumentParser
+from dataclasses import dataclass
 
-parser = ArgumentParser()
 
-parser.add_argument(
-    '--imager_config_file',
-    type=str,
-    help='The libirimager configuration file (.xml)',
-    required=True,
-    )
-parser.add_argument(
-    '--schedule_config_file',
-    type=str,
-    help='The image capture schedule file (.xml)',
-    required=True,
-    )
-parser.add_argument(
-    '--internal_shutter_delay',
-    type=int,
-    help='The specified time for the internal shutter to cycle (s)',
-    required=False,
-    default=0.3
-    )
-args = parser.parse_args()
+def parse_args(argv=None):
+    parser = ArgumentParser()
+
+    parser.add_argument(
+        '--imager_config_file',
+        type=str,
+        help='The libirimager configuration file (.xml)',
+        required=True,
+        )
+    parser.add_argument(
+        '--schedule_config_file',
+        type=str,
+        help='The image capture schedule file (.xml)',
+        required=True,
+        )
+    parser.add_argument(
+        '--internal_shutter_delay',
+        type=int,
+        help='The time allowed for the internal shutter to cycle (s), until '
+             'the actual cycle time has been measured',
+        required=False,
+        default=0.3
+        )
+    parser.add_argument(
+        '--settle_frames',
+        type=int,
+        help='Frames the flag must read open in a row before frames are '
+             'used, after it has cycled',
+        default=2,
+        )
+    parser.add_argument(
+        '--flag_timeout',
+        type=float,
+        help='Give up waiting for the flag to cycle this long after a '
+             'trigger (s)',
+        default=2.0,
+        )
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        help='Aggregate and write on worker threads, off the capture thread',
+        )
+    parser.add_argument(
+        '--frame_queue_size',
+        type=int,
+        help='Frames buffered between capture and aggregation (pipeline mode)',
+        default=256,
+        )
+    parser.add_argument(
+        '--frame_queue_policy',
+        type=str,
+        choices=pixpy.QUEUE_POLICIES,
+        help='What to do with a new frame when the frame queue is full',
+        default='drop_newest',
+        )
+    parser.add_argument(
+        '--write_queue_size',
+        type=int,
+        help='Finished samples buffered between aggregation and writing '
+             '(pipeline mode)',
+        default=4,
+        )
+    parser.add_argument(
+        '--write_queue_policy',
+        type=str,
+        choices=pixpy.QUEUE_POLICIES,
+        help='What to do with a finished sample when the write queue is '
+             'full. block (default) holds up aggregation, so frames are '
+             'dropped at the frame queue instead of finished samples',
+        default='block',
+        )
+    parser.add_argument(
+        '--camera_backend',
+        type=str,
+        choices=list(pixpy.CAMERA_BACKENDS),
+        help='Where frames come from: the Optris SDK, a synthetic camera or a '
+             'replay of existing pixpy files',
+        default='sdk',
+        )
+    parser.add_argument(
+        '--replay_files',
+        type=str,
+        nargs='+',
+        help='pixpy NetCDF files (or glob) for --camera_backend replay',
+        default=None,
+        )
+    parser.add_argument(
+        '--replay_speed',
+        type=float,
+        help='Replay speed relative to the recorded frame rate '
+             '(0 = no pacing)',
+        default=1.0,
+        )
+    parser.add_argument(
+        '--synthetic_glitch_interval',
+        type=float,
+        help='Make the synthetic camera fail reads this often, to exercise '
+             'recovery (s, 0 = never)',
+        default=0.0,
+        )
+    parser.add_argument(
+        '--synthetic_glitch_code',
+        type=int,
+        help='What the failed synthetic reads return: -1 (retried in place) '
+             'or -2 (camera lost, reinitialised)',
+        default=-1,
+        )
+    parser.add_argument(
+        '--read_retries',
+        type=int,
+        help='Times a failed frame read is retried before the camera is '
+             'reinitialised',
+        default=3,
+        )
+    parser.add_argument(
+        '--reinit_attempts',
+        type=int,
+        help='Times the camera is reinitialised after a failed read before '
+             'the capture restarts',
+        default=6,
+        )
+    parser.add_argument(
+        '--live_frames',
+        type=int,
+        help='Publish every frame read to a shared-memory ring of this many '
+             'frames (pixpy_<serial>) for pixpy.RingReader, e.g. 64; frames '
+             'are then also read between bursts. 0 (default) to disable',
+        default=0,
+        )
+    parser.add_argument(
+        '--metrics_port',
+        type=int,
+        help='Serve metrics on http://localhost:<port>/metrics (Prometheus) '
+             'and /metrics.json, or the next free port after it; 0 to '
+             'disable',
+        default=9464,
+        )
+    parser.add_argument(
+        '--metrics_file',
+        type=str,
+        help='Append a JSON line of all metrics to this file every '
+             '--metrics_interval (default pixpy_metrics_<serial>.jsonl in '
+             'the output directory)',
+        default=None,
+        )
+    parser.add_argument(
+        '--metrics_interval',
+        type=float,
+        help='Seconds between lines of --metrics_file; 0 to disable',
+        default=60.0,
+        )
+    parser.add_argument(
+        '--profile_samples',
+        type=int,
+        help='Samples profiled after SIGUSR1 or when the control file '
+             'pixpy_profile_<serial> appears in the output directory',
+        default=10,
+        )
+    parser.add_argument(
+        '--profile_interval',
+        type=float,
+        help='Stack sampling period while profiling (s)',
+        default=0.005,
+        )
+    parser.add_argument(
+        '--servo_socket',
+        type=str,
+        help='Base path of the event sockets shared with the external servo '
+             'shutter (shutter_routine_testing.py --socket), e.g. '
+             '/tmp/pixpy_shutter; each burst waits for the shutter to be '
+             'open and signals when it is done',
+        default=None,
+        )
+    parser.add_argument(
+        '--servo_timeout',
+        type=float,
+        help='Longest wait for the servo shutter to report open after the '
+             'scheduled sample start (s)',
+        default=1.0,
+        )
+    parser.add_argument(
+        '--schedule_spin',
+        type=float,
+        help='Busy-wait for the last part of each wait for a sample '
+             'deadline, for tighter timing at the cost of CPU (s)',
+        default=0.0,
+        )
+    return parser.parse_args(argv)
+
 
 # todos / limitations:
-# async image capture, processing and file i/o
 # proper logging
-# statistics for meta data (not just end of interval)
 
-shutter_delay = args.internal_shutter_delay
+# set from the command line by app()
+args = None
+shutter_delay = None
+
+FRAME_LATENCY = metrics.histogram(
+    'pixpy_frame_latency_seconds', 'Time to read one frame from the camera')
+AGGREGATE_TIME = metrics.histogram(
+    'pixpy_aggregate_seconds', 'Aggregation time per sample')
+WRITE_TIME = metrics.histogram(
+    'pixpy_write_seconds', 'Time to write one sample')
+WRITE_BYTES = metrics.counter(
+    'pixpy_write_bytes_total', 'Uncompressed bytes of samples written')
+FILE_BYTES = metrics.counter(
+    'pixpy_file_bytes_total', 'Bytes of finished output files')
+START_LATENESS = metrics.histogram(
+    'pixpy_sample_start_lateness_seconds',
+    'Sample start minus scheduled start')
+END_LATENESS = metrics.histogram(
+    'pixpy_sample_end_lateness_seconds', 'Sample end minus scheduled end')
+MISSED_STARTS = metrics.counter(
+    'pixpy_missed_sample_starts_total',
+    'Samples started more than the shutter delay late')
+SAMPLES = metrics.counter('pixpy_samples_total', 'Samples captured')
+DROPPED_FRAMES = metrics.counter(
+    'pixpy_dropped_frames_total', 'Frames skipped in counterHW')
+DUPLICATE_FRAMES = metrics.counter(
+    'pixpy_duplicate_frames_total', 'Repeated counterHW frames')
+CPU_TEMPERATURE = metrics.gauge(
+    'pixpy_cpu_temperature_celsius', 'Raspberry Pi CPU temperature')
+QOS_LEVEL = metrics.gauge('pixpy_qos_level', 'Current qos level')
+FLAG_DROPPED_FRAMES = metrics.counter(
+    'pixpy_flag_dropped_frames_total',
+    'Burst frames not used because the flag was not open and settled')
+FLAG_WAIT = metrics.histogram(
+    'pixpy_flag_wait_seconds', 'Shutter trigger to flag open and settled')
+FLAG_TIMEOUTS = metrics.counter(
+    'pixpy_flag_timeouts_total', 'Triggers after which the flag was not '
+    'seen to cycle within --flag_timeout')
+SHUTTER_CYCLE = metrics.gauge(
+    'pixpy_shutter_cycle_seconds', 'Typical trigger to flag settled time')
+SERVO_WAIT = metrics.histogram(
+    'pixpy_servo_wait_seconds',
+    'Scheduled sample start to servo shutter open and settled')
+SERVO_TIMEOUTS = metrics.counter(
+    'pixpy_servo_timeouts_total', 'Samples captured without the servo '
+    'shutter reporting open within --servo_timeout')
+RESTART_TIME = metrics.histogram(
+    'pixpy_restart_seconds', 'Capture failure to capture running again',
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+RAW_ARCHIVE_TIME = metrics.histogram(
+    'pixpy_raw_archive_seconds', 'Time to encode and write one raw burst')
+RAW_ARCHIVE_BYTES = metrics.counter(
+    'pixpy_raw_archive_bytes_total', 'Bytes written to raw archives')
+
+
+def cpu_temperature():
+    # nan off the Pi (no thermal zone), e.g. with a synthetic camera
+    try:
+        from gpiozero import CPUTemperature
+        return CPUTemperature().temperature
+    except Exception:
+        return np.nan
+
+
+def make_camera_backend():
+    if args.camera_backend == 'replay':
+        files = [f for pattern in args.replay_files for f in glob(pattern)]
+        return pixpy.make_backend(
+            'replay', files=files, speed=args.replay_speed)
+    if args.camera_backend == 'synthetic':
+        return pixpy.make_backend(
+            'synthetic', glitch_interval=args.synthetic_glitch_interval,
+            glitch_code=args.synthetic_glitch_code)
+    return pixpy.make_backend(args.camera_backend)
 
 
 def imager_config_vars(config_file):
@@ -54,22 +296,17 @@ def imager_config_vars(config_file):
     }
 
 
-def get_file_name(ssched, sn):
-    file_end_raw = ssched.current_file_time_end()
+def get_file_name(file_end_raw, sn):
     return str(sn) + '_' + \
         str(file_end_raw).replace("-", "").replace(":", "").replace(" ", "")
 
 
-def preallocate_image_timeseries(x, y, t):
+def preallocate_image_timeseries(x, y, t, statistics=None):
+    if statistics is None:
+        statistics = pixpy.DEFAULT_STATISTICS
     return np.empty(
         [t, x, y],
-        dtype=[
-            ('snapshot', np.uint16),
-            ('median', np.uint16),
-            ('min', np.uint16),
-            ('max', np.uint16),
-            ('std', np.uint16),
-        ]
+        dtype=[(name, np.uint16) for name in statistics]
     )
 
 
@@ -86,6 +323,26 @@ def preallocate_meta_timeseries(t):
             ('counterHW', np.uint32),
             ('fps', float),
             ('n_images', np.uint16),
+            ('tchip_min', float),
+            ('tchip_mean', float),
+            ('tchip_max', float),
+            ('tbox_min', float),
+            ('tbox_mean', float),
+            ('tbox_max', float),
+            ('tflag_min', float),
+            ('tflag_mean', float),
+            ('tflag_max', float),
+            ('fps_hw', float),
+            ('dropped_frames', np.uint32),
+            ('duplicate_frames', np.uint32),
+            ('flag_frames', np.uint32),
+            ('flag_dropped_frames', np.uint32),
+            ('flag_wait', float),
+            ('servo_wait', float),
+            ('read_errors', np.uint32),
+            ('start_lateness', float),
+            ('end_lateness', float),
+            ('qos_level', np.uint8),
         ]
     )
 
@@ -106,210 +363,737 @@ def app_setup():
     return config_vars, shutter
 
 
-def image_capture(config_vars, shutter):
-    schedule_config = pixpy.config.read_schedule_config(
-        args.schedule_config_file)
+@dataclass
+class FileInterval:
+    base_path: str
+    config_vars: dict
+    height: int
+    width: int
+    n_samples: int
+    dt_epoch: dt
+    storage_backend: str = 'netcdf'
+    compression: str = 'zlib'
+    compression_level: int = 5
+    spool: bool = False
+    qos_levels: tuple = ()
+    statistics: tuple = None
+    raw_archive: bool = False
+    raw_archive_codec: str = 'auto'
+    quicklook: bool = False
+    quicklook_statistic: str = 'median'
+    quicklook_format: str = 'png'
+    quicklook_downsample: int = 1
+
+
+class SampleProcessor:
+    """Folds capture messages into aggregated samples.
+
+    Called inline by image_capture, or from the aggregation worker of a
+    pixpy.CapturePipeline. Returns ('append', interval, image_row, meta_row)
+    for each finished sample and ('close', interval) at the end of a file.
+    """
+
+    def __init__(self, qos=None):
+        self.aggregator = None
+        self.interval = None
+        self.qos = qos
+        self.busy_s = 0.0
+
+    def __call__(self, message):
+        start = monotonic()
+        kind = message[0]
+        if kind == 'frame':
+            self.aggregator.update(message[1])
+        elif kind == 'sample_start':
+            shed = message[2]
+            self.aggregator.reset(median='median' not in shed,
+                                  snapshot='snapshot' not in shed)
+            self.busy_s = 0.0
+        elif kind == 'sample_end':
+            result = ('append', self.interval,
+                      *self.store_sample(*message[1:]))
+            busy_s = self.busy_s + monotonic() - start
+            AGGREGATE_TIME.observe(busy_s)
+            if self.qos is not None:
+                self.qos.record('aggregate', busy_s)
+            return result
+        elif kind == 'file_start':
+            self.interval = message[1]
+            height, width = self.interval.height, self.interval.width
+            if self.aggregator is None or \
+                    (self.aggregator.height, self.aggregator.width) != \
+                    (height, width):
+                self.aggregator = pixpy.StreamingAggregator(height, width)
+        elif kind == 'file_end':
+            return ('close', self.interval)
+        else:
+            raise ValueError(f'Unknown message {kind}')
+        self.busy_s += monotonic() - start
+
+    def store_sample(self, j, interval_start_time, interval_end_time,
+                     frame_meta, sample_meta):
+        meta = frame_meta[-1]
+        aggregator = self.aggregator
+        image_row = preallocate_image_timeseries(
+            aggregator.height, aggregator.width, 1,
+            self.interval.statistics)[0]
+        meta_row = preallocate_meta_timeseries(1)[0]
+        dtime = interval_end_time - interval_start_time
+        fps = aggregator.n / dtime.total_seconds()
+        if aggregator.n:
+            statistics = pixpy.compute_statistics(
+                aggregator, image_row.dtype.names)
+        else:
+            # every frame was left out by the flag gate: 0 = not computed
+            statistics = {name: 0 for name in image_row.dtype.names}
+        for name, value in statistics.items():
+            image_row[name] = value
+        meta_row['time'] = (interval_end_time.timestamp() -
+                            self.interval.dt_epoch.timestamp()) * 1000
+        meta_row['tbox'] = meta['tempBox']
+        meta_row['tchip'] = meta['tempChip']
+        meta_row['flag_state'] = meta['flagState']
+        meta_row['counter'] = meta['counter']
+        meta_row['counterHW'] = meta['counterHW']
+        meta_row['fps'] = fps
+        meta_row['n_images'] = aggregator.n
+        for name, value in sample_meta.items():
+            meta_row[name] = value
+        summary = pixpy.summarise_frame_metadata(frame_meta)
+        for name, value in summary.items():
+            meta_row[name] = value
+        DROPPED_FRAMES.inc(summary['dropped_frames'])
+        DUPLICATE_FRAMES.inc(summary['duplicate_frames'])
+        if summary['dropped_frames'] or summary['duplicate_frames']:
+            print(f"dropped {summary['dropped_frames']} and duplicated "
+                  f"{summary['duplicate_frames']} frames")
+        return image_row, meta_row
+
+
+def file_attrs(config_vars, qos_levels=()):
+    # todo: add contents of config files to netcdf.
+    return dict(
+        description="pixpy",
+        serial=config_vars['sn'],
+        brightness_temperature_scaling="10",
+        brightness_temperature_offset="1000",
+        imager_config_file_contents=config_vars["imager_config_file_contents"],
+        qos_levels=' '.join(qos_levels),
+        qos_description=pixpy.QOS_DESCRIPTION,
+    )
+
+
+class SampleWriter:
+    """Writes SampleProcessor output, one open file per file interval.
+
+    An interval that was never closed (capture restarted part way) is
+    appended to if it comes round again and closed once a new one starts.
+    A file whose first sample was taken with compression shed is written
+    as an uncompressed spool and only converted once a later file closes
+    with compression no longer shed. Spools are converted on a background
+    thread, so closing a file never holds up the caller.
+    """
+
+    def __init__(self, qos=None):
+        self.writers = {}
+        self.roi_writers = {}
+        self.raw_writers = {}
+        self.quicklook = None
+        self.converter = None
+        self.deferred = []
+        self.qos = qos
+        self.compression_shed = False
+
+    def __call__(self, item):
+        kind, interval = item[:2]
+        if kind == 'append':
+            start = monotonic()
+            meta_row = item[3]
+            self.compression_shed = 'compression' in pixpy.shed_actions(
+                interval.qos_levels, meta_row['qos_level'])
+            writer, _, _ = self.writers.get(
+                interval.base_path, (None, None, None))
+            if writer is None:
+                self.close_sample_writers()
+                # npy output is never compressed, so nothing to defer
+                defer = self.compression_shed and \
+                    interval.storage_backend != 'npy'
+                spooled = interval.spool or defer
+                options = {'convert_to': interval.storage_backend} \
+                    if spooled else {}
+                writer = pixpy.open_writer(
+                    'npy' if spooled else interval.storage_backend,
+                    interval.base_path, interval.height, interval.width,
+                    interval.n_samples, interval.dt_epoch,
+                    preallocate_meta_timeseries(1).dtype,
+                    file_attrs(interval.config_vars, interval.qos_levels),
+                    compression=interval.compression,
+                    compression_level=interval.compression_level,
+                    image_dtype=item[2].dtype, **options)
+                self.writers[interval.base_path] = (writer, interval, defer)
+            writer.append(*item[2:])
+            write_s = monotonic() - start
+            WRITE_TIME.observe(write_s)
+            WRITE_BYTES.inc(item[2].nbytes + item[3].nbytes)
+            if self.qos is not None:
+                self.qos.record('write', write_s)
+            if interval.quicklook:
+                self.submit_quicklook(interval, *item[2:])
+        elif kind == 'roi':
+            # blocks arrive in time order, so other intervals are finished
+            self.close_roi_writers(keep=interval.base_path)
+            for name, rows in item[2].items():
+                writer = self.roi_writers.get((interval.base_path, name))
+                if writer is None:
+                    writer = pixpy.RoiWriter(
+                        interval.base_path, name, rows.dtype,
+                        interval.dt_epoch,
+                        file_attrs(interval.config_vars),
+                        compression=interval.compression,
+                        compression_level=interval.compression_level)
+                    self.roi_writers[(interval.base_path, name)] = writer
+                writer.append(rows)
+        elif kind == 'raw':
+            start = monotonic()
+            self.close_raw_writers(keep=interval.base_path)
+            writer = self.raw_writers.get(interval.base_path)
+            if writer is None:
+                writer = pixpy.RawArchiveWriter(
+                    interval.base_path, interval.raw_archive_codec)
+                self.raw_writers[interval.base_path] = writer
+            nbytes = writer.nbytes
+            writer.append(*item[2:])
+            RAW_ARCHIVE_BYTES.inc(writer.nbytes - nbytes)
+            RAW_ARCHIVE_TIME.observe(monotonic() - start)
+        elif kind == 'close':
+            writer = self.writers.pop(interval.base_path, None)
+            if writer is not None:
+                self.close_writer(*writer)
+            self.close_roi_writers(base_path=interval.base_path)
+            self.close_raw_writers(base_path=interval.base_path)
+            if not self.compression_shed:
+                self.convert_deferred()
+        else:
+            raise ValueError(f'Unknown write {kind}')
+
+    def close_writer(self, writer, interval, defer=False):
+        if defer:
+            writer.close()
+            pixpy.mark_deferred(writer.file_path)
+            print(f'compression of {writer.file_path} deferred')
+            self.deferred.append((writer.file_path, interval))
+            return
+        if not interval.spool:
+            writer.close()
+            FILE_BYTES.inc(path.getsize(writer.file_path))
+            return
+        writer.close(rename=False)
+        self.convert(writer.part_path, interval)
+
+    def convert_deferred(self):
+        while self.deferred:
+            spool_path, interval = self.deferred.pop(0)
+            print(f'compressing {spool_path}')
+            self.convert(spool_path, interval)
+
+    def convert(self, spool_path, interval):
+        if self.converter is None:
+            self.converter = pixpy.SpoolConverter(
+                lambda file_path: FILE_BYTES.inc(path.getsize(file_path))
+            ).start()
+        self.converter.submit(spool_path, interval.storage_backend,
+                              interval.compression,
+                              interval.compression_level)
+
+    def submit_quicklook(self, interval, image_row, meta_row):
+        names = image_row.dtype.names
+        statistic = interval.quicklook_statistic
+        if statistic not in names:
+            statistic = 'snapshot' if 'snapshot' in names else names[0]
+        if self.quicklook is None:
+            self.quicklook = pixpy.QuicklookWorker(
+                path.join(path.dirname(interval.base_path), 'quicklook'),
+                interval.quicklook_format,
+                interval.quicklook_downsample).start()
+        sample_time = interval.dt_epoch + \
+            timedelta(milliseconds=float(meta_row['time']))
+        self.quicklook.submit(interval.config_vars['sn'], sample_time,
+                              image_row[statistic])
+
+    def close_roi_writers(self, keep=None, base_path=None, now=None):
+        for key in list(self.roi_writers):
+            if key[0] != keep and base_path in (None, key[0]):
+                self.roi_writers.pop(key).close(
+                    rename=not interval_open(key[0], now))
+
+    def close_raw_writers(self, keep=None, base_path=None, now=None):
+        for key in list(self.raw_writers):
+            if key != keep and base_path in (None, key):
+                self.raw_writers.pop(key).close(
+                    rename=not interval_open(key, now))
+
+    def close_sample_writers(self, now=None):
+        for writer, interval, defer in self.writers.values():
+            if interval_open(interval.base_path, now) and not defer:
+                # left as .part for a restart to resume
+                writer.close(rename=False)
+            else:
+                self.close_writer(writer, interval, defer)
+        self.writers = {}
+
+    def close_all(self, now=None):
+        """Close every open file, e.g. when capture stops.
+
+        With now, files of intervals that end after it keep their .part
+        names so that a restart in the same interval appends to them;
+        recover() finalises them once the interval is over.
+        """
+        self.close_sample_writers(now)
+        self.close_roi_writers(now=now)
+        self.close_raw_writers(now=now)
+        if self.quicklook is not None:
+            self.quicklook.stop()
+            self.quicklook = None
+        if self.converter is not None:
+            self.converter.stop()
+            self.converter = None
+
+
+def interval_open(base_path, now):
+    return now is not None and pixpy.file_time_end(base_path) > now
+
+
+def reuse_buffer(buffers, name, shape, dtype):
+    # kept across file intervals while the shape stays the same
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+        buffer = np.empty(shape, dtype=dtype)
+        buffers[name] = buffer
+    return buffer
+
+
+def image_capture(config_vars, shutter, pipeline=None, writer=None,
+                  qos=None, ring=None, profile=None, servo=None,
+                  schedule=None, buffers=None):
+    if schedule is None:
+        schedule = pixpy.ScheduleWatcher(args.schedule_config_file,
+                                         pixpy.get_thermal_image_size)
+    if buffers is None:
+        buffers = {}
+    schedule_config, ssched = schedule.get()
     Path(schedule_config['output_directory']).mkdir(parents=True,
                                                     exist_ok=True)
-    ssched = pixpy.SnapshotSchedule(
-        file_interval=timedelta(seconds=schedule_config['file_interval']),
-        sample_interval=timedelta(seconds=schedule_config['sample_interval']),
-        sample_repetition=timedelta(
-            seconds=schedule_config['sample_repetition']),
-    )
+    if qos is None:
+        qos = pixpy.QosController()
+    qos.configure(
+        pixpy.parse_qos_levels(schedule_config['qos_levels']),
+        ssched.sample_repetition.total_seconds(),
+        schedule_config['qos_n_images_factor'])
     width, height = pixpy.get_thermal_image_size()
-    sample_timesteps_remaining = ssched.sample_timesteps_remaining()
+    timeline = pixpy.SampleTimeline(
+        ssched, lead=timedelta(seconds=shutter_delay))
+    n_samples = len(timeline)
     print(dt.utcnow())
-    print(sample_timesteps_remaining)
+    print(n_samples)
     print(f'shutter_delay {shutter_delay}')
     sample_interval_s = ssched.sample_interval.total_seconds()
     print(f'sample_interval_s {sample_interval_s}')
-    file_name = get_file_name(ssched, config_vars['sn'])
-    image_timeseries = preallocate_image_timeseries(
-        height, width, sample_timesteps_remaining)
-    meta_timeseries = preallocate_meta_timeseries(sample_timesteps_remaining)
+    file_name = get_file_name(timeline.file_end, config_vars['sn'])
+    interval = FileInterval(
+        base_path=path.join(schedule_config['output_directory'], file_name),
+        config_vars=config_vars,
+        height=height,
+        width=width,
+        n_samples=n_samples,
+        dt_epoch=timeline.deadlines[0].start.replace(
+            day=1, minute=0, hour=0, second=0, microsecond=0),
+        storage_backend=schedule_config['storage_backend'],
+        compression=schedule_config['compression'],
+        compression_level=schedule_config['compression_level'],
+        spool=schedule_config['spool'],
+        qos_levels=qos.levels,
+        statistics=pixpy.parse_statistics(schedule_config['statistics']),
+        raw_archive=schedule_config['raw_archive'],
+        raw_archive_codec=schedule_config['raw_archive_codec'],
+        quicklook=schedule_config['quicklook'],
+        quicklook_statistic=schedule_config['quicklook_statistic'],
+        quicklook_format=schedule_config['quicklook_format'],
+        quicklook_downsample=schedule_config['quicklook_downsample'],
+    )
     n_images = int((sample_interval_s * config_vars['fps']) + 0.5)
     print(f'n_images {n_images}')
     print(f"fps {config_vars['fps']}")
-    time_until_next_interval = ssched.current_sample_start() - \
-        dt.utcnow() - timedelta(seconds=shutter_delay)
-    print(f'time_until_next_interval {time_until_next_interval}')
-    while (time_until_next_interval.total_seconds() - shutter_delay) < 0:
-        time_until_next_interval = ssched.current_sample_start() - \
-            dt.utcnow() - timedelta(seconds=shutter_delay)
-    print(f"sleeping for {time_until_next_interval.total_seconds()}")
-    sleep(time_until_next_interval.total_seconds())
-    for j in range(0, sample_timesteps_remaining):
-        dt_epoch = ssched.current_sample_start().replace(
-            day=1, minute=0, hour=0, second=0, microsecond=0)
-        dt_epoch_s = dt_epoch.timestamp()
+    recovery = pixpy.FrameRecovery(
+        args.imager_config_file, config_vars['sn'],
+        n_retries=args.read_retries, n_reinits=args.reinit_attempts)
+    grabber = pixpy.FrameGrabber(width, height, recovery)
+    frame_meta = reuse_buffer(buffers, 'frame_meta', (n_images,),
+                              pixpy.FRAME_METADATA_DTYPE)
+    frame_latency = reuse_buffer(buffers, 'frame_latency', (n_images,),
+                                 np.int64)
+    if pipeline is None:
+        processor = SampleProcessor(qos)
+        if writer is None:
+            writer = SampleWriter(qos)
+        submit_frame = processor
+        submit_write = writer
+
+        def submit_control(message):
+            result = processor(message)
+            if result is not None:
+                writer(result)
+
+        # frames are folded in before the next read, so one slot is enough
+        # unless the whole burst is archived
+        frames = reuse_buffer(
+            buffers, 'frames',
+            (n_images if interval.raw_archive else 1, height, width),
+            np.uint16)
+    else:
+        submit_frame = pipeline.submit_frame
+        submit_control = pipeline.submit_control
+        submit_write = pipeline.submit_write
+    roi_series = None
+    if schedule_config['rois']:
+        roi_series = pixpy.RoiSeries(
+            [pixpy.make_roi(spec, height, width)
+             for spec in schedule_config['rois']],
+            pixpy.parse_roi_statistics(schedule_config['roi_statistics']),
+            dt_epoch_timestamp=interval.dt_epoch.timestamp())
+    # frames read between bursts, about a second at a time, for the ROIs and
+    # live frame readers
+    idle_frames = max(1, int(config_vars['fps']))
+    idle_frame = reuse_buffer(buffers, 'idle_frame', (1, height, width),
+                              np.uint16)
+    idle_meta = reuse_buffer(buffers, 'idle_meta', (idle_frames,),
+                             pixpy.FRAME_METADATA_DTYPE)
+
+    gate = pixpy.FlagGate(args.settle_frames)
+
+    def on_frame(i, frame):
+        if not gate.update(frame_meta[i]['flagState']):
+            return
+        submit_frame(('frame', frame))
+        if roi_series is not None:
+            roi_series.add(frame, frame_meta[i], dt.utcnow().timestamp())
+        if ring is not None:
+            ring.publish(frame, frame_meta[i])
+
+    def on_idle_frame(i, frame):
+        if roi_series is not None:
+            roi_series.add(frame, idle_meta[i], dt.utcnow().timestamp())
+        if ring is not None:
+            ring.publish(frame, idle_meta[i])
+
+    def submit_rois():
+        if roi_series is None:
+            return
+        rows = roi_series.flush()
+        if rows is not None:
+            submit_write(('roi', interval, rows))
+
+    def wait_until(deadline):
+        # keep reading frames between bursts if anything uses them
+        if roi_series is not None or ring is not None:
+            while True:
+                n = min(idle_frames,
+                        int((deadline - monotonic()) * config_vars['fps']) - 1)
+                if n < 1:
+                    break
+                pixpy.capture_burst(n, idle_frame, idle_meta,
+                                    on_frame=on_idle_frame, grabber=grabber)
+                submit_rois()
+        return pixpy.sleep_until(deadline, args.schedule_spin)
+
+    def wait_for_flag(triggered_at):
+        # read frames until the flag has closed and is open and settled
+        # again, instead of sleeping for a fixed shutter delay
+        while not gate.settled:
+            if monotonic() - triggered_at > args.flag_timeout:
+                print('flag did not cycle after the trigger, waiting '
+                      '--internal_shutter_delay after triggers from now on')
+                FLAG_TIMEOUTS.inc()
+                shutter.flag_visible = False
+                gate.force_settled()
+                return None
+            pixpy.capture_burst(1, idle_frame, idle_meta,
+                                on_frame=on_idle_frame, grabber=grabber)
+            gate.update(idle_meta[0]['flagState'])
+        wait = monotonic() - triggered_at
+        shutter.record_cycle(timedelta(seconds=wait))
+        FLAG_WAIT.observe(wait)
+        SHUTTER_CYCLE.set(shutter.cycle_time().total_seconds())
+        return wait
+
+    submit_control(('file_start', interval))
+    start_latency = pixpy.LatencyHistogram()
+    end_latency = pixpy.LatencyHistogram()
+    # until a cycle has been timed: the shutter delay and settling frames
+    default_cycle = timedelta(
+        seconds=shutter_delay + args.settle_frames / config_vars['fps'])
+    for j, deadline in enumerate(timeline):
+        # trigger the typical trigger -> flag settled time before the start
+        cycle_s = shutter.cycle_time(default_cycle).total_seconds()
+        wait_until(deadline.start_monotonic - cycle_s)
         print(
             f'started n_interval_timestep {j + 1} / '
-            f'{sample_timesteps_remaining} at {dt.utcnow()}'
+            f'{n_samples} at {dt.utcnow()}'
         )
-        shutter.trigger()
+        flag_wait = np.nan
+        if shutter.trigger() == 0 and shutter.flag_visible:
+            gate.expect_cycle()
+            flag_wait = wait_for_flag(shutter._trigger_monotonic)
+            flag_wait = np.nan if flag_wait is None else flag_wait * 1000
         print(f'shutter triggered {shutter._triggers} times')
-        sleep(shutter_delay)
+        start_lateness = wait_until(deadline.start_monotonic)
         print(f'waited for shutter until {dt.utcnow()}')
+        servo_wait = np.nan
+        if servo is not None:
+            if servo.wait(pixpy.SHUTTER_OPEN, deadline.start,
+                          args.servo_timeout):
+                wait = monotonic() - deadline.start_monotonic
+                SERVO_WAIT.observe(max(wait, 0.0))
+                servo_wait = wait * 1000
+            else:
+                print('servo shutter did not report open')
+                SERVO_TIMEOUTS.inc()
+        if start_lateness > shutter_delay:
+            # todo: send to log file
+            print("Next interval missed. Slow the sampling rate/fps.")
+            MISSED_STARTS.inc()
+        qos_level = qos.update(start_lateness)
+        QOS_LEVEL.set(qos_level)
+        n_sample_images = qos.n_images(n_images)
+        if pipeline is not None:
+            # queued frames still reference their burst, so no reuse here
+            frames = np.empty((n_sample_images, height, width),
+                              dtype=np.uint16)
+            frame_meta = np.empty(n_images, dtype=pixpy.FRAME_METADATA_DTYPE)
+        submit_control(('sample_start', j,
+                        pixpy.shed_actions(qos.levels, qos_level)))
+        gate.dropped = 0
+        recovery.n_errors = 0
         interval_start_time = dt.utcnow()
-        images_raw = np.empty((n_images, height, width), dtype=np.uint16)
-        for i in range(0, n_images):
-            image, meta = pixpy.get_thermal_image_metadata(width, height)
-            images_raw[i, :, :] = image
-            # print(f'got image {i} / {n_images} at {dt.utcnow()}')
+        pixpy.capture_burst(n_sample_images, frames, frame_meta,
+                            frame_latency, on_frame=on_frame, grabber=grabber)
+        burst_end = monotonic()
+        if servo is not None:
+            servo.send(pixpy.BURST_DONE, deadline.start)
         interval_end_time = dt.utcnow()
+        end_lateness = monotonic() - deadline.end_monotonic
+        start_latency.add(start_lateness)
+        end_latency.add(end_lateness)
+        START_LATENESS.observe(start_lateness)
+        END_LATENESS.observe(end_lateness)
         print(f'interval has timestamp {interval_end_time}')
-        dtime = interval_end_time - interval_start_time
-        fps = n_images / dtime.total_seconds()
-        image_timeseries['snapshot'][j, :, :] = image
-        image_timeseries['median'][j, :, :] = np.median(images_raw, axis=0)
-        image_timeseries['min'][j, :, :] = np.min(images_raw, axis=0)
-        image_timeseries['max'][j, :, :] = np.max(images_raw, axis=0)
-        image_timeseries['std'][j, :, :] = \
-            (np.std((images_raw - 1000) / 10, axis=0) * 10) + 1000
-        meta_timeseries['time'][j] = \
-            (interval_end_time.timestamp() - dt_epoch_s) * 1000
-        meta_timeseries['tbox'][j] = meta.tempBox
-        meta_timeseries['tchip'][j] = meta.tempChip
-        meta_timeseries['flag_state'][j] = meta.flagState
-        meta_timeseries['counter'][j] = meta.counter
-        meta_timeseries['counterHW'][j] = meta.counterHW
-        meta_timeseries['fps'][j] = fps
-        meta_timeseries['n_images'][j] = n_images
-        meta_timeseries['tpi'][j] = CPUTemperature().temperature
-        if j != (sample_timesteps_remaining - 1):
-            next_interval_time = interval_start_time + ssched.sample_repetition
-            current_time = dt.utcnow()
-            wait_time_until_next_interval_s = (
-                next_interval_time - current_time
-            ).total_seconds() - shutter_delay
-            print(f'Next interval in: {wait_time_until_next_interval_s} s')
-            if wait_time_until_next_interval_s < 0:
-                # todo: send to log file
-                print("Next interval missed. Slow the sampling rate/fps.")
-                wait_time_until_next_interval_s = 0
-            sleep(wait_time_until_next_interval_s)
+        latency = frame_latency[:n_sample_images]
+        FRAME_LATENCY.observe_many(latency / 1e9)
+        print(f'frame latency mean {latency.mean() / 1e6:.2f} ms, '
+              f'max {latency.max() / 1e6:.2f} ms')
+        if gate.dropped:
+            print(f'dropped {gate.dropped} frames with the flag not open')
+        FLAG_DROPPED_FRAMES.inc(gate.dropped)
+        tpi = cpu_temperature()
+        CPU_TEMPERATURE.set(tpi)
+        SAMPLES.inc()
+        submit_control(('sample_end', j, interval_start_time,
+                        interval_end_time, frame_meta[:n_sample_images], {
+                            'tpi': tpi,
+                            'flag_dropped_frames': gate.dropped,
+                            'flag_wait': flag_wait,
+                            'servo_wait': servo_wait,
+                            'read_errors': recovery.n_errors,
+                            'start_lateness': start_lateness * 1000,
+                            'end_lateness': end_lateness * 1000,
+                            'qos_level': qos_level,
+                        }))
+        if interval.raw_archive:
+            submit_write(('raw', interval, j, frames[:n_sample_images],
+                          frame_meta[:n_sample_images]))
+        # the burst is the sample itself; what is shed for is the work after
+        # it (inline aggregation and writing in serial mode), which has to
+        # fit in the gap before the next burst
+        qos.record('capture', monotonic() - burst_end,
+                   ssched.sample_repetition.total_seconds() -
+                   sample_interval_s)
+        if profile is not None:
+            profile.tick()
+    next_trigger = deadline.trigger_monotonic + \
+        ssched.sample_repetition.total_seconds()
+    submit_rois()
+    submit_control(('file_end',))
+    print(f'sample start lateness {start_latency}')
+    print(f'sample end lateness {end_latency}')
+    if pipeline is not None:
+        for stats in pipeline.stats():
+            print(stats)
+    elif monotonic() > next_trigger:
+        print("missed sample: i/o blocking")
+
+
+def recover(schedule_config_file):
+    schedule_config = config.read_schedule_config(schedule_config_file)
+    if not path.isdir(schedule_config['output_directory']):
+        return
+    recovered = pixpy.recover_spools(
+        schedule_config['output_directory'],
+        schedule_config['storage_backend'],
+        schedule_config['compression'],
+        schedule_config['compression_level'])
+    for file_path in recovered:
+        print(f'recovered {file_path}')
+    for file_path in pixpy.finalise_part_files(
+            schedule_config['output_directory']):
+        print(f'finalised {file_path}')
+
+
+def configure(argv=None):
+    global args, shutter_delay
+    args = parse_args(argv)
+    shutter_delay = args.internal_shutter_delay
+    pixpy.set_backend(make_camera_backend())
+
+
+def output_directory():
+    schedule_config = config.read_schedule_config(args.schedule_config_file)
+    Path(schedule_config['output_directory']).mkdir(parents=True,
+                                                    exist_ok=True)
+    return schedule_config['output_directory']
+
+
+def start_profile_control(serial):
+    profile = ProfileControl(output_directory(), serial,
+                             args.profile_samples, args.profile_interval)
+    try:
+        profile.install_signal_handler()
+    except ValueError:
+        # not the main thread, the control file still works
+        pass
+    print(f'profile with kill -USR1 or by creating {profile.control_path}')
+    return profile
+
+
+def start_metrics(serial):
+    """Start the metrics server and file of this capture process.
+
+    Returns what was started, for stop_metrics().
+    """
+    metrics.METRICS.labels['serial'] = serial
+    started = []
+    if args.metrics_port:
+        # several cameras on one host take consecutive ports
+        for port in range(args.metrics_port, args.metrics_port + 16):
+            try:
+                started.append(metrics.MetricsServer(port).start())
+            except OSError:
+                continue
+            print(f'serving metrics on http://localhost:{port}/metrics')
+            break
         else:
-            next_sample_start_check = ssched.current_sample_start()
-            x = np.arange(0, 160)
-            y = np.flip(np.arange(0, 120))
-            ds = xr.Dataset(
-                data_vars=dict(
-                    t_b_median=(
-                        ["time", "y", "x"],
-                        image_timeseries['median'],
-                        {"units": "celsius",
-                         "long_name": "brightness_temperature_median"}),
-                    t_b_min=(
-                        ["time", "y", "x"],
-                        image_timeseries['min'],
-                        {"units": "celsius",
-                         "long_name": "brightness_temperature_min"}),
-                    t_b_max=(
-                        ["time", "y", "x"],
-                        image_timeseries['max'],
-                        {"units": "celsius",
-                         "long_name": "brightness_temperature_max"}),
-                    t_b_std=(
-                        ["time", "y", "x"],
-                        image_timeseries['std'],
-                        {"units": "celsius",
-                         "long_name":
-                             "brightness_temperature_standard_deviation"}),
-                    t_b_snapshot=(
-                        ["time", "y", "x"],
-                        image_timeseries['snapshot'],
-                        {"units": "celsius",
-                         "long_name": "brightness_temperature_snapshot"}),
-                    t_box=(
-                        ["time"],
-                        meta_timeseries['tbox'],
-                        {"units": "celsius",
-                         "long_name": "temperature_camera_body"}),
-                    t_chip=(
-                        ["time"],
-                        meta_timeseries['tchip'],
-                        {"units": "celsius",
-                         "long_name": "temperature_focal_plane_array_chip"}),
-                    flag_state=(
-                        ["time"],
-                        meta_timeseries['flag_state'],
-                        {"long_name": "flag_status"}),
-                    counter=(
-                        ["time"],
-                        meta_timeseries['counter'],
-                        {"long_name": "image_counter_from_software"}),
-                    counterHW=(
-                        ["time"],
-                        meta_timeseries['counterHW'],
-                        {"long_name": "image_counter_from_hardware"}),
-                    frames=(
-                        ["time"],
-                        meta_timeseries['fps'],
-                        {"units": "s-1", "long_name": "frames_per_second"}),
-                    n_images=(
-                        ["time"],
-                        meta_timeseries['n_images'],
-                        {"long_name": "number_of_images_in_interval"}),
-                    t_cpu=(
-                        ["time"],
-                        meta_timeseries['tpi'],
-                        {"long_name": "temperature_raspberry_pi_cpu"}),
-                ),
-                coords=dict(
-                    x=x,
-                    y=y,
-                    time=meta_timeseries['time'],
-                ),
-                # todo: add contents of config files to netcdf.
-                attrs=dict(
-                    description="pixpy",
-                    serial=config_vars['sn'],
-                    brightness_temperature_scaling="10",
-                    brightness_temperature_offset="1000",
-                    imager_config_file_contents=config_vars["imager_config_file_contents"],
-                ),
-            )
-            ds.x.attrs['long_name'] = 'pixels_along_x_axis'
-            ds.y.attrs['long_name'] = 'pixels_along_y_axis'
-            ds.time.attrs['units'] = dt_epoch.strftime(
-                'milliseconds since %Y-%m-%d')
-            ds.time.attrs['long_name'] = 'time'
-            ds.time.attrs['standard_name'] = 'time'
-
-            ds.to_netcdf(path.join(schedule_config['output_directory'],
-                                   f'{file_name}.nc'),
-                         encoding={
-                'time': {'zlib': True, "complevel": 5, '_FillValue': -999},
-                't_b_median': {'zlib': True, "complevel": 5},
-                't_b_min': {'zlib': True, "complevel": 5},
-                't_b_max': {'zlib': True, "complevel": 5},
-                't_b_std': {'zlib': True, "complevel": 5},
-                't_b_snapshot': {'zlib': True, "complevel": 5},
-                'n_images': {'zlib': True, "complevel": 5},
-            },
-                unlimited_dims=["time"])
-            if (next_sample_start_check < dt.utcnow()):
-                print("missed sample: i/o blocking")
-
-
-def app():
-    while True:
-        try:
-            config_vars, shutter = app_setup()
-        except (RuntimeError, ValueError) as e:
-            print(e)
-            sleep(5)
+            print(f'no free metrics port from {args.metrics_port}')
+    if args.metrics_interval > 0:
+        metrics_file = args.metrics_file
+        if metrics_file is None:
+            metrics_file = path.join(output_directory(),
+                                     f'pixpy_metrics_{serial}.jsonl')
+        started.append(
+            metrics.MetricsFile(metrics_file, args.metrics_interval).start())
+    return started
+
+
+def stop_metrics(started):
+    for item in started:
+        item.stop()
+
+
+def capture_loop(writer, qos=None):
+    if qos is None:
+        qos = pixpy.QosController()
+    pipeline = None
+    if args.pipeline:
+        pipeline = pixpy.CapturePipeline(
+            SampleProcessor(qos), writer,
+            frame_queue_size=args.frame_queue_size,
+            frame_queue_policy=args.frame_queue_policy,
+            write_queue_size=args.write_queue_size,
+            write_queue_policy=args.write_queue_policy,
+        ).start()
+    ring = None
+    started_metrics = None
+    profile = None
+    servo = None
+    schedule = pixpy.ScheduleWatcher(args.schedule_config_file,
+                                     pixpy.get_thermal_image_size)
+    buffers = {}
+    # consecutive failed restarts, for the backoff between them
+    failures = 0
+    failed_at = None
+    if args.servo_socket:
+        servo = pixpy.ShutterEvents(args.servo_socket, 'capture')
+        print(f'servo shutter events on {servo.path}')
+    try:
         while True:
             try:
-                image_capture(config_vars, shutter)
+                config_vars, shutter = app_setup()
             except (RuntimeError, ValueError) as e:
                 print(e)
-                sleep(1)
+                sleep(pixpy.backoff_delay(failures, 0.5, 30.0))
+                failures += 1
+                continue
+            if failed_at is not None:
+                RESTART_TIME.observe(monotonic() - failed_at)
+                failed_at = None
+            if ring is None and args.live_frames > 0:
+                width, height = pixpy.get_thermal_image_size()
+                ring = pixpy.FrameRing(
+                    pixpy.ring_name(config_vars['sn']), height, width,
+                    args.live_frames)
+                print(f'publishing live frames to shared memory {ring.name}')
+            if started_metrics is None:
+                started_metrics = start_metrics(config_vars['sn'])
+            if profile is None:
+                profile = start_profile_control(config_vars['sn'])
+            while True:
                 try:
-                    pixpy.terminate()
+                    image_capture(config_vars, shutter, pipeline, writer, qos,
+                                  ring, profile, servo, schedule, buffers)
+                    failures = 0
                 except (RuntimeError, ValueError) as e:
+                    # in-place recovery (pixpy.FrameRecovery) did not work
                     print(e)
-                sleep(1)
-                break
+                    failed_at = monotonic()
+                    try:
+                        pixpy.terminate()
+                    except (RuntimeError, ValueError) as e:
+                        print(e)
+                    sleep(pixpy.backoff_delay(failures, 0.1, 30.0))
+                    failures += 1
+                    break
+    finally:
+        # write what is still queued and close the files, so that nothing
+        # is lost when capture is stopped
+        if pipeline is not None:
+            pipeline.stop()
+        writer.close_all(dt.utcnow())
+        if servo is not None:
+            servo.close()
+        if ring is not None:
+            ring.close()
+        if started_metrics is not None:
+            stop_metrics(started_metrics)
+
+
+def exit_on_sigterm():
+    # so that capture_loop cleans up when stopped by systemd or the
+    # supervisor, as it does for Ctrl-C
+    def handler(signum, frame):
+        raise SystemExit(128 + signum)
+    signal.signal(signal.SIGTERM, handler)
+
 
+def app(argv=None):
+    configure(argv)
+    exit_on_sigterm()
+    recover(args.schedule_config_file)
+    qos = pixpy.QosController()
+    capture_loop(SampleWriter(qos), qos)
@@ -0,0 +1,330 @@
+import importlib.util
+import json
+import os
+import re
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta
+from glob import glob
+import numpy as np
+
+# {serial}_{file end time}.nc (see app.get_file_name) or {serial}_{day}.nc
+# (see compact.daily_file_name)
+ARCHIVE_FILE_NAME = re.compile(r'(\d+)_(\d{14}|\d{8})\.nc$')
+INDEX_FILE_NAME = '.pixpy_index.json'
+INDEX_VERSION = 2
+_EPOCH = datetime(1970, 1, 1)
+
+
+def parse_file_name(file_path: str):
+    """(serial, file end time) of a pixpy output file name, or None."""
+    match = ARCHIVE_FILE_NAME.match(os.path.basename(file_path))
+    if match is None:
+        return None
+    if len(match[2]) == 8:
+        # a whole day, ending at midnight
+        return int(match[1]), \
+            datetime.strptime(match[2], '%Y%m%d') + timedelta(days=1)
+    return int(match[1]), datetime.strptime(match[2], '%Y%m%d%H%M%S')
+
+
+def _epoch_ms(t: datetime) -> int:
+    return (t - _EPOCH) // timedelta(milliseconds=1)
+
+
+@dataclass
+class ArchiveFile:
+    path: str
+    serial: int
+    file_end: str
+    height: int
+    width: int
+    # sample times as ms since 1970-01-01
+    times: list
+    mtime: float
+    size: int
+    # names of the files a compacted file was merged from
+    compacted_from: list = ()
+
+    @property
+    def time_start(self) -> int:
+        return self.times[0] if self.times else None
+
+    @property
+    def time_end(self) -> int:
+        return self.times[-1] if self.times else None
+
+
+def read_archive_file(file_path: str) -> ArchiveFile:
+    import netCDF4
+    serial, file_end = parse_file_name(file_path)
+    stat = os.stat(file_path)
+    with netCDF4.Dataset(file_path) as ds:
+        time = ds['time']
+        units = time.units
+        values = np.ma.filled(time[:].astype(float), np.nan)
+        height = len(ds.dimensions['y'])
+        width = len(ds.dimensions['x'])
+        # '<file name> <size>' lines, see compact.compact_day
+        compacted_from = [line.split()[0] for line in getattr(
+            ds, 'compacted_from', '').splitlines() if line.strip()]
+    unit, _, since = units.partition(' since ')
+    if unit != 'milliseconds':
+        raise ValueError(f'{file_path}: unexpected time units {units}')
+    epoch_ms = _epoch_ms(datetime.fromisoformat(since.strip()))
+    values = values[np.isfinite(values)]
+    return ArchiveFile(
+        path=file_path, serial=serial, file_end=file_end.isoformat(),
+        height=height, width=width,
+        times=[int(epoch_ms + round(v)) for v in values],
+        mtime=stat.st_mtime, size=stat.st_size,
+        compacted_from=compacted_from)
+
+
+class ArchiveIndex:
+    """Index of the pixpy files under a directory by serial and time.
+
+    Serial and file interval come from the file names and sample times from
+    the file headers; they are cached in .pixpy_index.json so only new or
+    changed files are opened by refresh(). ROI time series and unfinished
+    (.part) files are not indexed. Files that a daily file was compacted
+    from (pixpy_compact) are left out of queries in favour of it.
+    """
+
+    def __init__(self, directory: str, cache_path: str = None,
+                 refresh: bool = True):
+        self.directory = directory
+        self.cache_path = cache_path or os.path.join(
+            directory, INDEX_FILE_NAME)
+        self.files = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path) as file:
+                cache = json.load(file)
+            if cache.get('version') == INDEX_VERSION:
+                self.files = {f['path']: ArchiveFile(**f)
+                              for f in cache['files']}
+        if refresh:
+            self.refresh()
+
+    def refresh(self) -> int:
+        """Re-scan the directory; returns the number of files (re)read."""
+        paths = [p for p in glob(os.path.join(self.directory, '**', '*.nc'),
+                                 recursive=True)
+                 if parse_file_name(p) is not None]
+        n_read = 0
+        files = {}
+        for file_path in paths:
+            entry = self.files.get(file_path)
+            stat = os.stat(file_path)
+            if entry is None or entry.mtime != stat.st_mtime or \
+                    entry.size != stat.st_size:
+                try:
+                    entry = read_archive_file(file_path)
+                except (OSError, KeyError, ValueError) as e:
+                    print(f'skipping {file_path}: {e}')
+                    continue
+                n_read += 1
+            files[file_path] = entry
+        changed = n_read or files.keys() != self.files.keys()
+        self.files = files
+        if changed:
+            self.save()
+        return n_read
+
+    def save(self):
+        with open(f'{self.cache_path}.part', 'w') as file:
+            json.dump({'version': INDEX_VERSION,
+                       'files': [asdict(f) for f in self.files.values()]},
+                      file)
+        os.replace(f'{self.cache_path}.part', self.cache_path)
+
+    def serials(self) -> list:
+        return sorted({f.serial for f in self.files.values()})
+
+    def query(self, serial: int = None, start: datetime = None,
+              end: datetime = None) -> list:
+        """Files of serial with samples in [start, end], in time order."""
+        start_ms = -np.inf if start is None else _epoch_ms(start)
+        end_ms = np.inf if end is None else _epoch_ms(end)
+        compacted = {(f.serial, name) for f in self.files.values()
+                     for name in f.compacted_from}
+        files = [f for f in self.files.values()
+                 if f.times and (serial is None or f.serial == serial)
+                 and f.time_start <= end_ms and f.time_end >= start_ms
+                 and (f.serial, os.path.basename(f.path)) not in compacted]
+        return sorted(files, key=lambda f: (f.time_start, f.serial))
+
+    def select(self, serial: int, start: datetime = None,
+               end: datetime = None, variables=('t_b_median',),
+               x: tuple = None, y: tuple = None, decode: bool = True):
+        """An ArchiveSelection of samples of one camera in [start, end].
+
+        x and y are inclusive coordinate ranges (x0, x1) / (y0, y1) of the
+        pixel window, as in the files (y = 0 is the bottom row).
+        """
+        files = self.query(serial, start, end)
+        if not files:
+            raise ValueError(f'No files of {serial} in {start} - {end}')
+        return ArchiveSelection(files, start, end, variables, x, y, decode)
+
+
+def _window(coordinate_range, n: int, flip: bool) -> slice:
+    if coordinate_range is None:
+        return slice(0, n)
+    first, last = coordinate_range
+    if not 0 <= first <= last < n:
+        raise ValueError(f'{coordinate_range} is outside 0:{n - 1}')
+    if flip:
+        first, last = n - 1 - last, n - 1 - first
+    return slice(first, last + 1)
+
+
+class ArchiveSelection:
+    """Samples of one camera over many files, read lazily.
+
+    time, x and y are the coordinates of the selection. Each variable is
+    an ArchiveArray that only opens the files and reads the time steps and
+    pixel window that are indexed; nothing is read until then.
+    to_xarray() loads everything into an xarray.Dataset (lazily, with dask
+    arrays, if dask is installed).
+    """
+
+    def __init__(self, files: list, start: datetime, end: datetime,
+                 variables: tuple, x: tuple, y: tuple, decode: bool):
+        height, width = files[0].height, files[0].width
+        if any((f.height, f.width) != (height, width) for f in files):
+            raise ValueError('Files have different image sizes')
+        start_ms = -np.inf if start is None else _epoch_ms(start)
+        end_ms = np.inf if end is None else _epoch_ms(end)
+        self.rows = _window(y, height, flip=True)
+        self.columns = _window(x, width, flip=False)
+        self.x = np.arange(width)[self.columns]
+        self.y = np.flip(np.arange(height))[self.rows]
+        times, file_of, row_of = [], [], []
+        for k, f in enumerate(files):
+            file_times = np.asarray(f.times)
+            index = np.flatnonzero((file_times >= start_ms) &
+                                   (file_times <= end_ms))
+            times.append(file_times[index])
+            file_of.append(np.full(index.size, k))
+            row_of.append(index)
+        times = np.concatenate(times)
+        # in time order, a time stored in more than one file (overlapping
+        # or resumed files) only once
+        order = np.argsort(times, kind='stable')
+        order = order[np.r_[True, np.diff(times[order]) != 0]] \
+            if order.size else order
+        file_of = np.concatenate(file_of)[order]
+        row_of = np.concatenate(row_of)[order]
+        # (file path, time indices within the file) of runs of samples
+        # from the same file
+        self.parts = [
+            (files[file_of[run[0]]].path, row_of[run]) for run in np.split(
+                np.arange(order.size),
+                np.flatnonzero(np.diff(file_of)) + 1) if run.size]
+        self.time = times[order].astype('datetime64[ms]')
+        self.variables = {
+            name: ArchiveArray(self, name, decode) for name in variables}
+
+    def __getitem__(self, name: str):
+        return self.variables[name]
+
+    def to_xarray(self):
+        import xarray as xr
+        data_vars = {}
+        for name, array in self.variables.items():
+            dims = ('time', 'y', 'x')[:len(array.shape)]
+            data_vars[name] = (dims, array.to_dask() if _has_dask()
+                               else np.asarray(array))
+        return xr.Dataset(
+            data_vars, coords={'time': self.time, 'y': self.y, 'x': self.x})
+
+
+def _has_dask() -> bool:
+    return importlib.util.find_spec('dask') is not None
+
+
+class ArchiveArray:
+    """One variable of an ArchiveSelection, indexed like a numpy array.
+
+    Brightness temperatures (t_b_*) are decoded from the stored
+    raw = celsius * 10 + 1000 to float32 celsius, with 0 (not computed)
+    as NaN, unless decode is False.
+    """
+
+    def __init__(self, selection: ArchiveSelection, name: str,
+                 decode: bool = True):
+        import netCDF4
+        self._netCDF4 = netCDF4
+        self.selection = selection
+        self.name = name
+        self.decode = decode and name.startswith('t_b_')
+        with netCDF4.Dataset(selection.parts[0][0]) as ds:
+            variable = ds[name]
+            self.image = variable.ndim == 3
+            dtype = variable.dtype
+        self.dtype = np.dtype(np.float32) if self.decode else np.dtype(dtype)
+        self.shape = (selection.time.size,) + \
+            ((selection.y.size, selection.x.size) if self.image else ())
+        self.ndim = len(self.shape)
+        self._offsets = np.cumsum(
+            [0] + [index.size for _, index in selection.parts])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read(self, part: int, index: np.ndarray) -> np.ndarray:
+        file_path, file_index = self.selection.parts[part]
+        with self._netCDF4.Dataset(file_path) as ds:
+            ds.set_auto_maskandscale(False)
+            variable = ds[self.name]
+            # netCDF4 wants increasing indices
+            rows, inverse = np.unique(file_index[index], return_inverse=True)
+            if self.image:
+                values = variable[
+                    rows, self.selection.rows, self.selection.columns]
+            else:
+                values = variable[rows]
+            values = values[inverse]
+            if not self.decode:
+                return values
+            scaling = float(getattr(ds, 'brightness_temperature_scaling', 10))
+            offset = float(
+                getattr(ds, 'brightness_temperature_offset', 1000))
+        decoded = (values.astype(np.float32) - offset) / scaling
+        # 0: not computed (see qos_description), 65535: never written
+        decoded[(values == 0) | (values == np.iinfo(np.uint16).max)] = np.nan
+        return decoded
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        time_index = np.arange(self.shape[0])[key[0]]
+        scalar = time_index.ndim == 0
+        time_index = np.atleast_1d(time_index)
+        out = np.empty((time_index.size,) + self.shape[1:], dtype=self.dtype)
+        part_of = np.searchsorted(self._offsets, time_index, side='right') - 1
+        for part in np.unique(part_of):
+            wanted = np.flatnonzero(part_of == part)
+            out[wanted] = self._read(
+                part, time_index[wanted] - self._offsets[part])
+        if scalar:
+            return out[0][key[1:]]
+        return out[(slice(None),) + key[1:]]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+    def to_dask(self):
+        import dask.array as da
+        chunks = (tuple(np.diff(self._offsets)),) + \
+            tuple((n,) for n in self.shape[1:])
+        return da.from_array(self, chunks=chunks, asarray=False)
+
+
+def open_archive(directory: str, serial: int, start: datetime = None,
+                 end: datetime = None, variables=('t_b_median',),
+                 x: tuple = None, y: tuple = None, decode: bool = True):
+    """ArchiveIndex(directory).select(...) in one call."""
+    return ArchiveIndex(directory).select(
+        serial, start, end, variables, x, y, decode)
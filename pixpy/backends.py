@@ -0,0 +1,361 @@
+import ctypes
+from glob import glob
+from time import monotonic, sleep
+import xml.etree.ElementTree as ET
+import numpy as np
+from pixpy.pixpy import (
+    CameraBackend, SDKBackend, FlagState, ShutterMode, FRAME_METADATA_DTYPE,
+    TIMESTAMP_TICKS_PER_SECOND,
+)
+
+
+def _imager_config_value(xml_config, tag, default):
+    try:
+        element = ET.parse(xml_config).getroot().find(tag)
+    except (OSError, ET.ParseError):
+        return default
+    return default if element is None else float(element.text)
+
+
+def flag_cycle_state(elapsed: float, duration: float) -> FlagState:
+    # flag state elapsed seconds into a cycle of duration seconds
+    t = elapsed / duration
+    if t < 0.2:
+        return FlagState.CLOSING
+    if t < 0.8:
+        return FlagState.CLOSED
+    if t < 1:
+        return FlagState.OPENING
+    return FlagState.OPEN
+
+
+def palette_image(raw: np.ndarray, width: int, height: int) -> np.ndarray:
+    # what the SDK's palette image shows: the thermal image in colour
+    from pixpy.quicklook import colourise, make_lut
+    if (width, height) != (raw.shape[1], raw.shape[0]):
+        raise ValueError('Palette image size does not match the camera')
+    return colourise(raw, make_lut())
+
+
+class _FrameClock:
+    # frame k of a free-running camera is ready at start + k / fps
+    def __init__(self, fps: float):
+        self.fps = fps
+        self.start = monotonic()
+        self.last_frame = -1
+
+    def next_frame(self) -> int:
+        if self.fps <= 0:
+            self.last_frame += 1
+            return self.last_frame
+        frame = int((monotonic() - self.start) * self.fps)
+        if frame <= self.last_frame:
+            frame = self.last_frame + 1
+            sleep(max(self.start + frame / self.fps - monotonic(), 0))
+        self.last_frame = frame
+        return frame
+
+
+class SyntheticBackend(CameraBackend):
+    """Generated frames at a fixed rate with realistic metadata.
+
+    The scene is a smooth field around scene_temperature with sensor noise,
+    in the raw brightness_temperature * 10 + 1000 encoding. Frames are
+    produced by a free-running clock, so a slow reader sees counterHW gaps
+    like on the real camera. The flag cycles for flag_duration seconds when
+    trigger_shutter_flag() is called and, in ShutterMode.AUTO, every
+    flag_interval seconds; frames taken then show the flag temperature.
+    serial and fps default to <serial> and <framerate> of the imager config
+    passed to usb_init. Every glitch_interval seconds (0 for never) the next
+    glitch_frames reads fail with glitch_code, like a USB glitch (-1) or a
+    lost camera (-2, until usb_init is called again).
+    """
+    name = 'synthetic'
+
+    def __init__(self, width: int = 160, height: int = 120,
+                 fps: float = None, serial: int = None,
+                 flag_interval: float = 15.0, flag_duration: float = 0.3,
+                 scene_temperature: float = 20.0, noise: float = 0.3,
+                 seed: int = 0, glitch_interval: float = 0.0,
+                 glitch_frames: int = 2, glitch_code: int = -1):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.serial = serial
+        self.flag_interval = flag_interval
+        self.flag_duration = flag_duration
+        self.shutter_mode = ShutterMode.MANUAL
+        self.glitch_interval = glitch_interval
+        self.glitch_frames = glitch_frames
+        self.glitch_code = glitch_code
+        self._next_glitch = None
+        self._glitch_left = 0
+        rng = np.random.default_rng(seed)
+        yy, xx = np.mgrid[0:height, 0:width]
+        self._scene = (1000 + 10 * scene_temperature +
+                       50 * np.sin(xx / 20) * np.cos(yy / 30)).astype(np.int32)
+        self._noise = rng.normal(0, 10 * noise, (32, height, width)).astype(
+            np.int32)
+        self._frame = self._scene.astype(np.uint16)
+        self._meta = np.zeros(1, dtype=FRAME_METADATA_DTYPE)
+        self._clock = None
+        self._flag_start = None
+        self._counter = 0
+
+    def usb_init(self, xml_config: str, formats_def: str = None,
+                 log_file: str = None) -> int:
+        if self.serial is None:
+            self.serial = int(_imager_config_value(xml_config, 'serial', 0))
+        if self.fps is None:
+            self.fps = _imager_config_value(xml_config, 'framerate', 32.0)
+        self._clock = _FrameClock(self.fps)
+        self._flag_start = None
+        self._glitch_left = 0
+        if self.glitch_interval > 0:
+            self._next_glitch = monotonic() + self.glitch_interval
+        return 0
+
+    def terminate(self) -> int:
+        self._clock = None
+        return 0
+
+    def get_serial(self) -> int:
+        return 0 if self._clock is None else self.serial
+
+    def get_thermal_image_size(self) -> (int, int):
+        return self.width, self.height
+
+    def get_palette_image_size(self) -> (int, int):
+        return self.width, self.height
+
+    def get_palette_image(self, width: int, height: int) -> np.ndarray:
+        # of the latest frame read
+        return palette_image(self._frame, width, height)
+
+    def set_shutter_mode(self, shutterMode: int) -> int:
+        self.shutter_mode = ShutterMode(shutterMode)
+        return 0
+
+    def trigger_shutter_flag(self) -> int:
+        self._flag_start = monotonic()
+        return 0
+
+    def set_temperature_range(self, min: int, max: int) -> int:
+        return 0
+
+    def flag_state(self, now: float) -> FlagState:
+        if self.shutter_mode == ShutterMode.AUTO and self.flag_interval > 0 \
+                and (self._flag_start is None or
+                     now - self._flag_start > self.flag_interval):
+            self._flag_start = now
+        if self._flag_start is None:
+            return FlagState.OPEN
+        return flag_cycle_state(now - self._flag_start, self.flag_duration)
+
+    def _glitch(self) -> int:
+        if self._glitch_left == 0 and self._next_glitch is not None and \
+                monotonic() >= self._next_glitch:
+            self._next_glitch += self.glitch_interval
+            self._glitch_left = self.glitch_frames
+        if self._glitch_left == 0:
+            return 0
+        if self.glitch_code != -2:
+            # a lost camera stays lost until usb_init
+            self._glitch_left -= 1
+        return self.glitch_code
+
+    def frame_reader(self, width: int, height: int):
+        if (width, height) != (self.width, self.height):
+            raise ValueError('Frame size does not match the synthetic camera')
+
+        def read(frame_address: int, meta_address: int) -> int:
+            if self._clock is None:
+                return -1
+            glitch = self._glitch()
+            if glitch:
+                return glitch
+            k = self._clock.next_frame()
+            # without a frame rate, frames are as old as they are
+            t = k / self._clock.fps if self._clock.fps > 0 else \
+                monotonic() - self._clock.start
+            flag_state = self.flag_state(self._clock.start + t)
+            temp_chip = 35 + 0.5 * np.sin(t / 600)
+            temp_flag = temp_chip - 2
+            if flag_state == FlagState.OPEN:
+                np.add(self._scene, self._noise[k % self._noise.shape[0]],
+                       out=self._frame, casting='unsafe')
+            else:
+                np.add(int(1000 + 10 * temp_flag),
+                       self._noise[k % self._noise.shape[0]] // 4,
+                       out=self._frame, casting='unsafe')
+            self._counter += 1
+            meta = self._meta[0]
+            meta['counter'] = self._counter
+            meta['counterHW'] = k
+            meta['timestamp'] = int(t * TIMESTAMP_TICKS_PER_SECOND)
+            meta['timestampMedia'] = meta['timestamp']
+            meta['flagState'] = flag_state.value
+            meta['tempChip'] = temp_chip
+            meta['tempFlag'] = temp_flag
+            meta['tempBox'] = 30.0
+            ctypes.memmove(frame_address, self._frame.ctypes.data,
+                           self._frame.nbytes)
+            ctypes.memmove(meta_address, self._meta.ctypes.data,
+                           self._meta.nbytes)
+            return 0
+        return read
+
+
+class ReplayBackend(CameraBackend):
+    """Frames streamed back from existing pixpy NetCDF files.
+
+    Every stored image of variable is replayed as one frame, with t_box,
+    t_chip, flag_state and counterHW from the same time step, at fps * speed
+    frames per second (speed 0 replays as fast as possible). fps and serial
+    default to those recorded in the first file. Files are replayed in name
+    order and start again from the first if loop is set. A
+    trigger_shutter_flag() cycles the flag state of the following frames
+    for flag_duration seconds, as on the camera (0 to never cycle).
+    """
+    name = 'replay'
+
+    def __init__(self, files, variable: str = 't_b_snapshot',
+                 fps: float = None, speed: float = 1.0, loop: bool = True,
+                 serial: int = None, flag_duration: float = 0.3):
+        import netCDF4
+        self._netCDF4 = netCDF4
+        if isinstance(files, str):
+            files = glob(files)
+        self.files = sorted(files)
+        if not self.files:
+            raise ValueError('No files to replay')
+        self.variable = variable
+        self.loop = loop
+        with netCDF4.Dataset(self.files[0]) as ds:
+            ds.set_auto_maskandscale(False)
+            self.height, self.width = ds[variable].shape[1:]
+            self._image = np.asarray(ds[variable][0], dtype=np.uint16)
+            self.serial = int(ds.serial) if serial is None else serial
+            if fps is None:
+                fps = 32.0
+                contents = getattr(ds, 'imager_config_file_contents', None)
+                if contents:
+                    framerate = ET.fromstring(contents).find('framerate')
+                    if framerate is not None:
+                        fps = float(framerate.text)
+        self.fps = fps
+        self.speed = speed
+        self.flag_duration = flag_duration
+        self._flag_start = None
+        self._clock = None
+        self._records = None
+        self._counter = 0
+        self._meta = np.zeros(1, dtype=FRAME_METADATA_DTYPE)
+
+    def _iter_records(self):
+        while True:
+            for file_name in self.files:
+                with self._netCDF4.Dataset(file_name) as ds:
+                    ds.set_auto_maskandscale(False)
+                    images = ds[self.variable][:]
+                    n = images.shape[0]
+                    meta = {
+                        name: ds[name][:] if name in ds.variables
+                        else np.zeros(n)
+                        for name in ('t_box', 't_chip', 'flag_state')
+                    }
+                for j in range(n):
+                    yield (np.ascontiguousarray(images[j], dtype=np.uint16),
+                           meta['t_box'][j], meta['t_chip'][j],
+                           meta['flag_state'][j])
+            if not self.loop:
+                return
+
+    def usb_init(self, xml_config: str, formats_def: str = None,
+                 log_file: str = None) -> int:
+        self._clock = _FrameClock(self.fps * self.speed)
+        self._records = self._iter_records()
+        self._flag_start = None
+        return 0
+
+    def terminate(self) -> int:
+        self._clock = None
+        self._records = None
+        return 0
+
+    def get_serial(self) -> int:
+        return 0 if self._clock is None else self.serial
+
+    def get_thermal_image_size(self) -> (int, int):
+        return self.width, self.height
+
+    def get_palette_image_size(self) -> (int, int):
+        return self.width, self.height
+
+    def get_palette_image(self, width: int, height: int) -> np.ndarray:
+        # of the latest frame read, or the first one to be replayed
+        return palette_image(self._image, width, height)
+
+    def set_shutter_mode(self, shutterMode: int) -> int:
+        return 0
+
+    def trigger_shutter_flag(self) -> int:
+        if self.flag_duration > 0:
+            self._flag_start = monotonic()
+        return 0
+
+    def set_temperature_range(self, min: int, max: int) -> int:
+        return 0
+
+    def flag_state(self, recorded: int) -> int:
+        if self._flag_start is None:
+            return recorded
+        elapsed = monotonic() - self._flag_start
+        if elapsed >= self.flag_duration:
+            self._flag_start = None
+            return recorded
+        return flag_cycle_state(elapsed, self.flag_duration).value
+
+    def frame_reader(self, width: int, height: int):
+        if (width, height) != (self.width, self.height):
+            raise ValueError('Frame size does not match the replayed files')
+
+        def read(frame_address: int, meta_address: int) -> int:
+            if self._clock is None:
+                return -1
+            k = self._clock.next_frame()
+            try:
+                image, t_box, t_chip, flag_state = next(self._records)
+            except StopIteration:
+                return -1
+            self._image = image
+            self._counter += 1
+            meta = self._meta[0]
+            meta['counter'] = self._counter
+            meta['counterHW'] = k
+            meta['timestamp'] = int(k / self.fps * TIMESTAMP_TICKS_PER_SECOND)
+            meta['timestampMedia'] = meta['timestamp']
+            meta['flagState'] = self.flag_state(flag_state)
+            meta['tempChip'] = t_chip
+            meta['tempFlag'] = t_chip
+            meta['tempBox'] = t_box
+            ctypes.memmove(frame_address, image.ctypes.data, image.nbytes)
+            ctypes.memmove(meta_address, self._meta.ctypes.data,
+                           self._meta.nbytes)
+            return 0
+        return read
+
+
+CAMERA_BACKENDS = {
+    'sdk': SDKBackend,
+    'synthetic': SyntheticBackend,
+    'replay': ReplayBackend,
+}
+
+
+def make_backend(name: str, **kwargs) -> CameraBackend:
+    try:
+        backend_class = CAMERA_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f'Unknown camera backend {name}')
+    return backend_class(**kwargs)
@@ -0,0 +1,302 @@
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from glob import glob
+import os
+import re
+import time
+import numpy as np
+from pixpy.archive import parse_file_name
+from pixpy.writer import TIME_FILL_VALUE, netcdf_compression, time_units
+
+DAILY_FILE_NAME = re.compile(r'\d+_\d{8}\.nc$')
+
+
+@dataclass
+class CompactResult:
+    serial: int
+    day: str
+    file_path: str
+    n_files: int = 0
+    n_samples: int = 0
+    n_duplicates: int = 0
+    n_gaps: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    seconds: float = 0.0
+    skipped: bool = False
+    error: str = None
+
+
+def file_day(file_end: datetime):
+    # files are named by their end time, so one ending at midnight belongs
+    # to the day before
+    return (file_end - timedelta(seconds=1)).date()
+
+
+def daily_file_name(serial: int, day) -> str:
+    return f'{serial}_{day:%Y%m%d}.nc'
+
+
+def find_days(input_directory: str) -> dict:
+    """{(serial, day): [file paths in time order]} of finished output files."""
+    days = defaultdict(list)
+    for file_path in glob(os.path.join(input_directory, '**', '*.nc'),
+                          recursive=True):
+        parsed = parse_file_name(file_path)
+        if parsed is None or \
+                DAILY_FILE_NAME.match(os.path.basename(file_path)):
+            continue
+        serial, file_end = parsed
+        days[(serial, file_day(file_end))].append((file_end, file_path))
+    return {key: [p for _, p in sorted(files)] for key, files in days.items()}
+
+
+def _source_list(file_paths: list) -> str:
+    return '\n'.join(f'{os.path.basename(p)} {os.path.getsize(p)}'
+                     for p in file_paths)
+
+
+def is_compacted(file_path: str, file_paths: list) -> bool:
+    """Whether file_path was compacted from exactly these (unchanged) files."""
+    import netCDF4
+    if not os.path.exists(file_path):
+        return False
+    try:
+        with netCDF4.Dataset(file_path) as ds:
+            return getattr(ds, 'compacted_from', None) == \
+                _source_list(file_paths)
+    except OSError:
+        return False
+
+
+def check_samples(time_ms: np.ndarray, counter: np.ndarray):
+    """(index of the samples to keep, number of duplicates, gaps).
+
+    Duplicates are samples with the same time or software counter as the
+    sample before (e.g. a file interval that was resumed and written
+    twice); the first one is kept. The counter restarts with the capture,
+    so only neighbouring samples are compared. Gaps are steps longer than
+    1.5 sampling intervals, returned as (time before the gap, gap length)
+    pairs in ms.
+    """
+    order = np.argsort(time_ms, kind='stable')
+    keep = np.ones(order.size, dtype=bool)
+    keep[1:] = (np.diff(time_ms[order]) > 0) & \
+        (counter[order][1:] != counter[order][:-1])
+    index = order[keep]
+    steps = np.diff(time_ms[index])
+    gaps = []
+    if steps.size:
+        interval = np.median(steps)
+        for j in np.flatnonzero(steps > 1.5 * interval):
+            gaps.append((float(time_ms[index][j]), float(steps[j])))
+    return index, int(order.size - index.size), gaps
+
+
+def _epoch(units: str) -> datetime:
+    unit, _, since = units.partition(' since ')
+    if unit != 'milliseconds':
+        raise ValueError(f'unexpected time units {units}')
+    return datetime.fromisoformat(since.strip())
+
+
+def compact_day(file_paths: list, output_path: str, chunk_time: int = 32,
+                compression: str = 'zlib', compression_level: int = 5,
+                force: bool = False) -> CompactResult:
+    """Merge the output files of one serial and day into one NetCDF file.
+
+    Samples are concatenated in time order with duplicates dropped, on a
+    time axis in ms since the start of the day. Image variables are stored
+    in (chunk_time, y, x) chunks and the per-sample variables in one chunk,
+    which suits reading long time series. The file is written to a .part
+    file and renamed when complete, and skipped if it already exists and was
+    compacted from the same input files, so a run can be repeated or
+    restarted at any point.
+    """
+    import netCDF4
+    serial, file_end = parse_file_name(file_paths[0])
+    day = file_day(file_end)
+    result = CompactResult(
+        serial, day.isoformat(), output_path, n_files=len(file_paths),
+        bytes_in=sum(os.path.getsize(p) for p in file_paths))
+    start = time.perf_counter()
+    if not force and is_compacted(output_path, file_paths):
+        result.skipped = True
+        result.bytes_out = os.path.getsize(output_path)
+        return result
+    dt_epoch = datetime(day.year, day.month, day.day)
+    sources = [netCDF4.Dataset(p) for p in file_paths]
+    try:
+        for ds in sources:
+            ds.set_auto_maskandscale(False)
+        first = sources[0]
+        for ds, file_path in zip(sources[1:], file_paths[1:]):
+            if any(len(ds.dimensions[d]) != len(first.dimensions[d])
+                   for d in ('y', 'x')):
+                raise ValueError(f'{file_path} image size does not match '
+                                 f'{file_paths[0]}')
+        # {name: the first file's variable} of all per-sample variables; a
+        # variable missing from some files (statistics changed during the
+        # day) is 0 there, like a statistic shed by qos
+        templates = {}
+        for ds in sources:
+            for name, var in ds.variables.items():
+                if var.dimensions[:1] == ('time',):
+                    templates.setdefault(name, var)
+        time_ms = []
+        for ds in sources:
+            values = ds['time'][:]
+            values = values[values != TIME_FILL_VALUE]
+            offset = (_epoch(ds['time'].units) - dt_epoch) / \
+                timedelta(milliseconds=1)
+            time_ms.append(values + offset)
+        n_per_file = [t.size for t in time_ms]
+        time_ms = np.concatenate(time_ms)
+        counter = np.concatenate([ds['counter'][:n] for ds, n in
+                                  zip(sources, n_per_file)])
+        index, result.n_duplicates, gaps = check_samples(time_ms, counter)
+        result.n_gaps = len(gaps)
+        result.n_samples = index.size
+        # (source file, row in the source file) of each output sample
+        file_of = np.repeat(np.arange(len(sources)), n_per_file)[index]
+        row_of = np.concatenate([np.arange(n) for n in n_per_file])[index]
+
+        part_path = f'{output_path}.part'
+        codec = netcdf_compression(compression, compression_level)
+        n = max(index.size, 1)
+        out = netCDF4.Dataset(part_path, 'w', format='NETCDF4')
+        try:
+            out.createDimension('time', index.size)
+            for dim in ('y', 'x'):
+                out.createDimension(dim, len(first.dimensions[dim]))
+                var = out.createVariable(dim, first[dim].dtype, (dim,))
+                var.setncatts(first[dim].__dict__)
+                var[:] = first[dim][:]
+            var = out.createVariable('time', 'f8', ('time',),
+                                     fill_value=TIME_FILL_VALUE,
+                                     chunksizes=(n,), **codec)
+            var.setncatts({k: v for k, v in first['time'].__dict__.items()
+                           if k != '_FillValue'})
+            var.units = time_units(dt_epoch)
+            var[:] = time_ms[index]
+            # copy runs of consecutive rows from the same file at once
+            breaks = np.flatnonzero(
+                (np.diff(file_of) != 0) | (np.diff(row_of) != 1)) + 1
+            runs = [run for run in np.split(np.arange(index.size), breaks)
+                    if run.size]
+            for name, source in templates.items():
+                if name == 'time':
+                    continue
+                if source.ndim == 3:
+                    chunks = (min(chunk_time, n),) + source.shape[1:]
+                    var = out.createVariable(
+                        name, source.dtype, source.dimensions, shuffle=True,
+                        chunksizes=chunks, **codec)
+                else:
+                    var = out.createVariable(
+                        name, source.dtype, source.dimensions,
+                        chunksizes=(n,), **codec)
+                var.setncatts({k: v for k, v in source.__dict__.items()
+                               if k != '_FillValue'})
+                for run in runs:
+                    ds = sources[file_of[run[0]]]
+                    if name not in ds.variables:
+                        var[run[0]:run[-1] + 1] = 0
+                        continue
+                    rows = slice(row_of[run[0]], row_of[run[-1]] + 1)
+                    var[run[0]:run[-1] + 1] = ds[name][rows]
+            out.setncatts(first.__dict__)
+            out.setncatts({
+                'compacted_from': _source_list(file_paths),
+                'compacted_duplicates': result.n_duplicates,
+                'compacted_gaps': '\n'.join(
+                    f'{(dt_epoch + timedelta(milliseconds=t)).isoformat()} '
+                    f'{length / 1000:.1f} s' for t, length in gaps),
+            })
+        finally:
+            out.close()
+        os.replace(part_path, output_path)
+    finally:
+        for ds in sources:
+            ds.close()
+    result.bytes_out = os.path.getsize(output_path)
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def _compact_day(args):
+    try:
+        return compact_day(*args[:2], **args[2])
+    except (OSError, KeyError, ValueError) as e:
+        serial, file_end = parse_file_name(args[0][0])
+        return CompactResult(serial, file_day(file_end).isoformat(),
+                             args[1], n_files=len(args[0]), error=str(e))
+
+
+def compact(argv=None):
+    parser = ArgumentParser(
+        description='Merge pixpy output files into one file per serial and '
+                    'day')
+    parser.add_argument('input_directory')
+    parser.add_argument('output_directory')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--serial', type=int, nargs='*')
+    parser.add_argument('--day', nargs='*',
+                        help='Days to compact (YYYY-MM-DD), default all')
+    parser.add_argument('--include_today', action='store_true',
+                        help='Also compact days that are not over yet (UTC)')
+    parser.add_argument('--chunk_time', type=int, default=32)
+    parser.add_argument('--compression', default='zlib')
+    parser.add_argument('--compression_level', type=int, default=5)
+    parser.add_argument('--force', action='store_true',
+                        help='Rewrite days that are already compacted')
+    args = parser.parse_args(argv)
+
+    today = datetime.utcnow().date()
+    os.makedirs(args.output_directory, exist_ok=True)
+    options = dict(chunk_time=args.chunk_time, compression=args.compression,
+                   compression_level=args.compression_level, force=args.force)
+    jobs = []
+    for (serial, day), file_paths in sorted(
+            find_days(args.input_directory).items()):
+        if args.serial and serial not in args.serial:
+            continue
+        if args.day and day.isoformat() not in args.day:
+            continue
+        if day >= today and not args.include_today:
+            continue
+        jobs.append((file_paths, os.path.join(
+            args.output_directory, daily_file_name(serial, day)), options))
+    print(f'compacting {len(jobs)} days with {args.workers} workers')
+
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(args.workers) as pool:
+        for future in as_completed([pool.submit(_compact_day, job)
+                                    for job in jobs]):
+            r = future.result()
+            results.append(r)
+            if r.error:
+                print(f'{r.serial} {r.day}: failed: {r.error}')
+            elif r.skipped:
+                print(f'{r.serial} {r.day}: already compacted')
+            else:
+                print(f'{r.serial} {r.day}: {r.n_files} files, '
+                      f'{r.n_samples} samples, {r.n_duplicates} duplicates, '
+                      f'{r.n_gaps} gaps, {r.bytes_in / 1e6:.1f} -> '
+                      f'{r.bytes_out / 1e6:.1f} MB in {r.seconds:.1f} s')
+    seconds = time.perf_counter() - start
+    done = [r for r in results if not r.error and not r.skipped]
+    bytes_in = sum(r.bytes_in for r in done)
+    n_files = sum(r.n_files for r in done)
+    print(f'compacted {len(done)} days ({n_files} files, '
+          f'{bytes_in / 1e6:.1f} MB) in {seconds:.1f} s: '
+          f'{n_files / max(seconds, 1e-9):.1f} files/s, '
+          f'{bytes_in / 1e6 / max(seconds, 1e-9):.1f} MB/s; '
+          f'{sum(r.skipped for r in results)} already compacted, '
+          f'{sum(bool(r.error) for r in results)} failed')
+    if any(r.error for r in results):
+        raise SystemExit(1)
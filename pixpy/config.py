@@ -1,11 +1,26 @@
 import xml.etree.cElementTree as ET
 import xml.dom.minidom
+from os import path
 
 DEFAULT_FILE_INTERVAL = "300"
 DEFAULT_SAMPLE_INTERVAL = "5"
 DEFAULT_SAMPLE_REPETITION = "60"
 DEFAULT_IMAGER_CONFIG_FILE = 'config.xml'
 DEFAULT_OUTPUT_DIRECTORY = 'OUT'
+DEFAULT_STORAGE_BACKEND = 'netcdf'
+DEFAULT_COMPRESSION = 'zlib'
+DEFAULT_COMPRESSION_LEVEL = "5"
+DEFAULT_SPOOL = "0"
+DEFAULT_QOS_LEVELS = "median n_images snapshot compression"
+DEFAULT_QOS_N_IMAGES_FACTOR = "0.5"
+DEFAULT_STATISTICS = "snapshot median min max std"
+DEFAULT_ROI_STATISTICS = "mean min max"
+DEFAULT_RAW_ARCHIVE = "0"
+DEFAULT_RAW_ARCHIVE_CODEC = "auto"
+DEFAULT_QUICKLOOK = "0"
+DEFAULT_QUICKLOOK_STATISTIC = "median"
+DEFAULT_QUICKLOOK_FORMAT = "png"
+DEFAULT_QUICKLOOK_DOWNSAMPLE = "1"
 
 
 def write_schedule_config(file_name):
@@ -18,7 +33,8 @@ def write_schedule_config(file_name):
         DEFAULT_FILE_INTERVAL
     ET.SubElement(
         root, "sample_interval",
-        description="The time interval to capture one image aggregate.").text = \
+        description="The time interval to capture one image "
+                    "aggregate.").text = \
         DEFAULT_SAMPLE_INTERVAL
     ET.SubElement(
         root, "sample_repetition",
@@ -28,6 +44,82 @@ def write_schedule_config(file_name):
         root, "output_directory",
         description="The directory where image files are saved.").text = \
         DEFAULT_OUTPUT_DIRECTORY
+    ET.SubElement(
+        root, "storage_backend",
+        description="How image files are written: netcdf, h5py or "
+                    "npy.").text = \
+        DEFAULT_STORAGE_BACKEND
+    ET.SubElement(
+        root, "compression",
+        description="The compression codec for image files.").text = \
+        DEFAULT_COMPRESSION
+    ET.SubElement(
+        root, "compression_level",
+        description="The compression level for image files.").text = \
+        DEFAULT_COMPRESSION_LEVEL
+    ET.SubElement(
+        root, "spool",
+        description="1 to keep the in-progress file in a crash-safe "
+                    "memory-mapped spool.").text = \
+        DEFAULT_SPOOL
+    ET.SubElement(
+        root, "statistics",
+        description="Per-pixel statistics saved for each sample: snapshot, "
+                    "median, min, max, mean, std, iqr, pNN (percentile NN) "
+                    "and/or trimmed_meanNN (NN % cut from each end).").text = \
+        DEFAULT_STATISTICS
+    ET.SubElement(
+        root, "qos_levels",
+        description="Work shed in turn when sampling falls behind: median, "
+                    "n_images, snapshot and/or compression. Empty to never "
+                    "shed.").text = \
+        DEFAULT_QOS_LEVELS
+    ET.SubElement(
+        root, "qos_n_images_factor",
+        description="The fraction of images kept per sample when n_images "
+                    "is shed.").text = \
+        DEFAULT_QOS_N_IMAGES_FACTOR
+    ET.SubElement(
+        root, "rois",
+        description="Regions of interest whose statistics are saved for "
+                    "every frame, one <roi> each: "
+                    "<roi name=\"wall\" x=\"10:40\" y=\"5:30\"/> (inclusive "
+                    "x/y ranges) or <roi name=\"tree\" mask=\"tree.npy\"/> "
+                    "(boolean height x width array). Empty for none.")
+    ET.SubElement(
+        root, "roi_statistics",
+        description="Statistics saved for each region of interest: mean, "
+                    "min, max and/or pNN (percentile NN).").text = \
+        DEFAULT_ROI_STATISTICS
+    ET.SubElement(
+        root, "raw_archive",
+        description="1 to also save every frame of every sample losslessly "
+                    "to <file>_raw.pxr.").text = \
+        DEFAULT_RAW_ARCHIVE
+    ET.SubElement(
+        root, "raw_archive_codec",
+        description="The codec for raw_archive: zstd, lz4, zlib or auto "
+                    "(the first of these installed).").text = \
+        DEFAULT_RAW_ARCHIVE_CODEC
+    ET.SubElement(
+        root, "quicklook",
+        description="1 to also save a colour image of each sample to "
+                    "<output_directory>/quicklook.").text = \
+        DEFAULT_QUICKLOOK
+    ET.SubElement(
+        root, "quicklook_statistic",
+        description="The statistic shown in quicklooks, e.g. median or "
+                    "snapshot.").text = \
+        DEFAULT_QUICKLOOK_STATISTIC
+    ET.SubElement(
+        root, "quicklook_format",
+        description="png, or jpeg (needs Pillow).").text = \
+        DEFAULT_QUICKLOOK_FORMAT
+    ET.SubElement(
+        root, "quicklook_downsample",
+        description="Keep every Nth pixel in each direction of "
+                    "quicklooks.").text = \
+        DEFAULT_QUICKLOOK_DOWNSAMPLE
     dom = xml.dom.minidom.parseString(ET.tostring(root))
     xml_string = dom.toprettyxml()
     part1, part2 = xml_string.split('?>')
@@ -36,11 +128,56 @@ def write_schedule_config(file_name):
         xfile.close()
 
 
+def _find_text(root, tag, default):
+    element = root.find(tag)
+    return default if element is None else element.text
+
+
+def _read_rois(root, config_file):
+    element = root.find('rois')
+    if element is None:
+        return []
+    rois = []
+    for roi in element.findall('roi'):
+        spec = dict(roi.attrib)
+        if 'mask' in spec:
+            spec['mask'] = path.join(path.dirname(config_file), spec['mask'])
+        rois.append(spec)
+    return rois
+
+
 def read_schedule_config(config_file):
     tree = ET.parse(config_file)
+    root = tree.getroot()
     return {
         'file_interval': float(tree.getroot().find('file_interval').text),
         'sample_interval': float(tree.getroot().find('sample_interval').text),
-        'sample_repetition': float(tree.getroot().find('sample_repetition').text),
+        'sample_repetition': float(
+            tree.getroot().find('sample_repetition').text),
         'output_directory': tree.getroot().find('output_directory').text,
+        'storage_backend': _find_text(
+            root, 'storage_backend', DEFAULT_STORAGE_BACKEND),
+        'compression': _find_text(root, 'compression', DEFAULT_COMPRESSION),
+        'compression_level': int(_find_text(
+            root, 'compression_level', DEFAULT_COMPRESSION_LEVEL)),
+        'spool': bool(int(_find_text(root, 'spool', DEFAULT_SPOOL))),
+        'statistics': _find_text(root, 'statistics', DEFAULT_STATISTICS),
+        'rois': _read_rois(root, config_file),
+        'roi_statistics': _find_text(
+            root, 'roi_statistics', DEFAULT_ROI_STATISTICS),
+        'qos_levels': _find_text(root, 'qos_levels', DEFAULT_QOS_LEVELS),
+        'qos_n_images_factor': float(_find_text(
+            root, 'qos_n_images_factor', DEFAULT_QOS_N_IMAGES_FACTOR)),
+        'raw_archive': bool(int(_find_text(
+            root, 'raw_archive', DEFAULT_RAW_ARCHIVE))),
+        'raw_archive_codec': _find_text(
+            root, 'raw_archive_codec', DEFAULT_RAW_ARCHIVE_CODEC),
+        'quicklook': bool(int(_find_text(
+            root, 'quicklook', DEFAULT_QUICKLOOK))),
+        'quicklook_statistic': _find_text(
+            root, 'quicklook_statistic', DEFAULT_QUICKLOOK_STATISTIC),
+        'quicklook_format': _find_text(
+            root, 'quicklook_format', DEFAULT_QUICKLOOK_FORMAT),
+        'quicklook_downsample': int(_find_text(
+            root, 'quicklook_downsample', DEFAULT_QUICKLOOK_DOWNSAMPLE)),
         }
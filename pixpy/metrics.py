@@ -0,0 +1,325 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import inf
+from threading import Event, Lock, Thread
+from time import time
+import json
+import os
+import numpy as np
+
+# seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_text(labels: dict) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.value = 0.0
+        self._lock = Lock()
+
+    def inc(self, value: float = 1.0):
+        with self._lock:
+            self.value += float(value)
+
+    def samples(self):
+        return [(self.name, {}, self.value)]
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value: float):
+        self.value = float(value)
+
+    def snapshot(self):
+        # nan (e.g. no CPU thermal zone) is not valid JSON
+        return None if self.value != self.value else self.value
+
+
+class Histogram:
+    """Prometheus-style histogram: cumulative counts of values <= each bound.
+
+    observe_many() takes a numpy array so a whole burst of per-frame values
+    costs one searchsorted.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str,
+                 buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.bounds = np.array(buckets + (inf,))
+        self.counts = np.zeros(self.bounds.size, dtype=np.int64)
+        self.sum = 0.0
+        self.max = -inf
+        self._lock = Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[np.searchsorted(self.bounds, value)] += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def observe_many(self, values: np.ndarray):
+        if values.size == 0:
+            return
+        k = np.searchsorted(self.bounds, values)
+        with self._lock:
+            self.counts += np.bincount(k, minlength=self.bounds.size)
+            self.sum += float(values.sum())
+            self.max = max(self.max, float(values.max()))
+
+    @property
+    def n(self) -> int:
+        return int(self.counts.sum())
+
+    def samples(self):
+        with self._lock:
+            cumulative = np.cumsum(self.counts)
+            total = self.sum
+        samples = [(f'{self.name}_bucket', {'le': '+Inf' if bound == inf
+                                            else f'{bound:g}'}, int(count))
+                   for bound, count in zip(self.bounds, cumulative)]
+        samples.append((f'{self.name}_sum', {}, total))
+        samples.append((f'{self.name}_count', {}, int(cumulative[-1])))
+        return samples
+
+    def snapshot(self):
+        n = self.n
+        return {'count': n, 'sum': self.sum,
+                'mean': self.sum / n if n else None,
+                'max': self.max if n else None}
+
+
+def prometheus_text(families) -> str:
+    lines = []
+    for metric_name, kind, help, samples in families:
+        lines.append(f'# HELP {metric_name} {help}')
+        lines.append(f'# TYPE {metric_name} {kind}')
+        for name, labels, value in samples:
+            lines.append(f'{name}{_label_text(labels)} {value!r}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsRegistry:
+    """Named metrics of one process, with labels (e.g. serial) on all."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.labels = {}
+        self._lock = Lock()
+
+    def _get(self, metric_class, name, help, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, help, **kwargs)
+                self.metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f'{name} is a {metric.kind}')
+            return metric
+
+    def counter(self, name: str, help: str = '') -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name: str, help: str = '') -> Gauge:
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name: str, help: str = '',
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def families(self) -> list:
+        """(name, kind, help, samples) of each metric, labels included."""
+        return [(metric.name, metric.kind, metric.help,
+                 [(name, {**self.labels, **labels}, value)
+                  for name, labels, value in metric.samples()])
+                for metric in list(self.metrics.values())]
+
+    def prometheus_text(self) -> str:
+        return prometheus_text(self.families())
+
+    def snapshot(self) -> dict:
+        return {'time': time(), **self.labels,
+                **{name: metric.snapshot()
+                   for name, metric in list(self.metrics.items())}}
+
+
+# the metrics of this process
+METRICS = MetricsRegistry()
+
+
+def counter(name: str, help: str = '') -> Counter:
+    return METRICS.counter(name, help)
+
+
+def gauge(name: str, help: str = '') -> Gauge:
+    return METRICS.gauge(name, help)
+
+
+def histogram(name: str, help: str = '',
+              buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+    return METRICS.histogram(name, help, buckets)
+
+
+class CombinedMetrics:
+    """A registry and the latest metrics pushed from other processes.
+
+    Served by MetricsServer like a registry: /metrics lists each metric
+    once with the samples of every process, told apart by their labels
+    (serial), and /metrics.json has the snapshot of each process.
+    """
+
+    def __init__(self, registry: MetricsRegistry = METRICS):
+        self.registry = registry
+        self.pushed = {}
+        self._lock = Lock()
+
+    def update(self, source, families: list, snapshot: dict):
+        with self._lock:
+            self.pushed[source] = (families, snapshot)
+
+    def prometheus_text(self) -> str:
+        with self._lock:
+            pushed = [families for families, _ in self.pushed.values()]
+        merged = {}
+        for families in [self.registry.families()] + pushed:
+            for name, kind, help, samples in families:
+                merged.setdefault(name, (name, kind, help, []))[3].extend(
+                    samples)
+        return prometheus_text(merged.values())
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            pushed = {str(source): snapshot
+                      for source, (_, snapshot) in self.pushed.items()}
+        return {**self.registry.snapshot(), 'processes': pushed}
+
+
+class MetricsPush:
+    """Calls send(families, snapshot) of a registry every interval, on a
+    daemon thread, e.g. to hand a capture process's metrics to the
+    supervisor."""
+
+    def __init__(self, send, interval: float = 5.0,
+                 registry: MetricsRegistry = METRICS):
+        self.send = send
+        self.interval = interval
+        self.registry = registry
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name='pixpy-metrics-push',
+                              daemon=True)
+
+    def push(self):
+        self.send(self.registry.families(), self.registry.snapshot())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.push()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.push()
+
+
+class MetricsServer:
+    """Serves a registry (or CombinedMetrics) over HTTP on a daemon thread.
+
+    /metrics is the Prometheus text format and /metrics.json the snapshot.
+    Binds to localhost by default.
+    """
+
+    def __init__(self, port: int, host: str = '127.0.0.1',
+                 registry: MetricsRegistry = METRICS):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = registry.prometheus_text().encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body = json.dumps(registry.snapshot()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+        self._thread = Thread(target=self._server.serve_forever,
+                              name='pixpy-metrics-http', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class MetricsFile:
+    """Appends a JSON snapshot of a registry to a file every interval.
+
+    One JSON object per line; when the file reaches max_bytes it is moved
+    to <path>.1 (replacing the previous one) and a new file is started.
+    """
+
+    def __init__(self, path: str, interval: float = 60.0,
+                 max_bytes: int = 10_000_000,
+                 registry: MetricsRegistry = METRICS):
+        self.path = path
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.registry = registry
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name='pixpy-metrics-file',
+                              daemon=True)
+
+    def write(self):
+        line = json.dumps(self.registry.snapshot()) + '\n'
+        if os.path.exists(self.path) and \
+                os.path.getsize(self.path) + len(line) > self.max_bytes:
+            os.replace(self.path, f'{self.path}.1')
+        with open(self.path, 'a') as file:
+            file.write(line)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f'could not write metrics: {e}')
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.write()
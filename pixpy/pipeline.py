@@ -0,0 +1,190 @@
+from collections import deque
+from threading import Condition, Lock, Thread
+from time import monotonic
+import traceback
+from pixpy import metrics
+
+QUEUE_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+
+class StageQueue:
+    """Bounded queue between two pipeline stages.
+
+    policy decides what happens when a droppable item is put on a full queue:
+    'block' waits for space (backpressure on the producer), 'drop_newest'
+    discards the new item and 'drop_oldest' discards the oldest droppable
+    queued item. Items put with droppable=False (control messages) are
+    always queued, even over maxsize. Depth, drops and time blocked are
+    also kept as pixpy_<name>_queue_* metrics.
+    """
+
+    def __init__(self, name: str, maxsize: int, policy: str = 'block'):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f'Unknown queue policy {policy}')
+        if maxsize < 1:
+            raise ValueError('maxsize < 1')
+        self.name = name
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = deque()
+        self._n_droppable = 0
+        self._cond = Condition(Lock())
+        self.put_count = 0
+        self.get_count = 0
+        self.drop_count = 0
+        self.max_depth = 0
+        self.blocked_s = 0.0
+        self._depth_gauge = metrics.gauge(
+            f'pixpy_{name}_queue_depth', f'Items in the {name} queue')
+        self._drop_counter = metrics.counter(
+            f'pixpy_{name}_queue_dropped_total',
+            f'Items dropped from the full {name} queue')
+        self._blocked_counter = metrics.counter(
+            f'pixpy_{name}_queue_blocked_seconds_total',
+            f'Time spent waiting for space in the {name} queue')
+
+    def put(self, item, droppable: bool = True) -> bool:
+        with self._cond:
+            if droppable and self._n_droppable >= self.maxsize:
+                if self.policy == 'drop_newest':
+                    self.drop_count += 1
+                    self._drop_counter.inc()
+                    return False
+                if self.policy == 'drop_oldest':
+                    self._drop_oldest()
+                else:
+                    block_start = monotonic()
+                    while self._n_droppable >= self.maxsize:
+                        self._cond.wait()
+                    blocked_s = monotonic() - block_start
+                    self.blocked_s += blocked_s
+                    self._blocked_counter.inc(blocked_s)
+            self._items.append((item, droppable))
+            if droppable:
+                self._n_droppable += 1
+            self.put_count += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._depth_gauge.set(len(self._items))
+            self._cond.notify_all()
+            return True
+
+    def _drop_oldest(self):
+        for k, (_, droppable) in enumerate(self._items):
+            if droppable:
+                del self._items[k]
+                self._n_droppable -= 1
+                self.drop_count += 1
+                self._drop_counter.inc()
+                return
+
+    def get(self):
+        with self._cond:
+            while not self._items:
+                self._cond.wait()
+            item, droppable = self._items.popleft()
+            if droppable:
+                self._n_droppable -= 1
+            self.get_count += 1
+            self._depth_gauge.set(len(self._items))
+            self._cond.notify_all()
+            return item
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._items)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'queue': self.name,
+                'depth': len(self._items),
+                'max_depth': self.max_depth,
+                'put': self.put_count,
+                'get': self.get_count,
+                'dropped': self.drop_count,
+                'blocked_s': round(self.blocked_s, 3),
+            }
+
+
+_STOP = object()
+
+
+class CapturePipeline:
+    """Capture -> aggregate -> write stages joined by bounded queues.
+
+    The capturing thread submits messages; an aggregation worker passes each
+    message to aggregate_handler and anything it returns is queued for the
+    writer worker, which passes it to write_handler. Neither handler ever
+    runs on the capturing thread. Returned tuples whose first element is in
+    write_control are never dropped from the write queue.
+    """
+
+    def __init__(self, aggregate_handler, write_handler,
+                 frame_queue_size: int = 256,
+                 frame_queue_policy: str = 'drop_newest',
+                 write_queue_size: int = 4,
+                 write_queue_policy: str = 'block',
+                 write_control: tuple = ('close',)):
+        self.aggregate_handler = aggregate_handler
+        self.write_handler = write_handler
+        self.write_control = write_control
+        self.frames = StageQueue('frames', frame_queue_size,
+                                 frame_queue_policy)
+        self.writes = StageQueue('writes', write_queue_size,
+                                 write_queue_policy)
+        self._threads = []
+
+    def start(self):
+        self._threads = [
+            Thread(target=self._aggregate_worker, name='pixpy-aggregate',
+                   daemon=True),
+            Thread(target=self._write_worker, name='pixpy-write',
+                   daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.frames.put(_STOP, droppable=False)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit_frame(self, message) -> bool:
+        return self.frames.put(message)
+
+    def submit_control(self, message):
+        self.frames.put(message, droppable=False)
+
+    def submit_write(self, item):
+        # straight to the writer, e.g. data already reduced on capture
+        self.writes.put(item, droppable=False)
+
+    def stats(self) -> list:
+        return [self.frames.stats(), self.writes.stats()]
+
+    def _aggregate_worker(self):
+        while True:
+            message = self.frames.get()
+            if message is _STOP:
+                self.writes.put(_STOP, droppable=False)
+                return
+            try:
+                result = self.aggregate_handler(message)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if result is not None:
+                self.writes.put(
+                    result, droppable=result[0] not in self.write_control)
+
+    def _write_worker(self):
+        while True:
+            item = self.writes.get()
+            if item is _STOP:
+                return
+            try:
+                self.write_handler(item)
+            except Exception:
+                traceback.print_exc()
@@ -1,20 +1,54 @@
+from collections import deque
 from datetime import datetime, timedelta
-from dataclasses import dataclass
-from pandas import to_datetime, Timestamp
+from dataclasses import dataclass, field
 import ctypes
 from ctypes import util as ctypes_util
-from os import name as os_name
-from time import sleep
+from os import name as os_name, environ
+from time import sleep, perf_counter_ns, monotonic
 import numpy as np
 from enum import Enum
+from pixpy import metrics
 # todo: reference original repo that some of these functions came from
 
-if os_name == 'nt':
-    # windows
-    lib = ctypes.CDLL('x64/libirimager.dll')
-else:
-    # linux
-    lib = ctypes.cdll.LoadLibrary(ctypes_util.find_library('irdirectsdk'))
+_c_int_p = ctypes.POINTER(ctypes.c_int)
+_PROTOTYPES = {
+    'evo_irimager_usb_init': (
+        ctypes.c_int, [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p]),
+    'evo_irimager_get_thermal_image_size': (
+        ctypes.c_int, [_c_int_p, _c_int_p]),
+    'evo_irimager_get_palette_image_size': (
+        ctypes.c_int, [_c_int_p, _c_int_p]),
+    'evo_irimager_get_thermal_image': (
+        ctypes.c_int, [_c_int_p, _c_int_p, ctypes.c_void_p]),
+    'evo_irimager_get_palette_image': (
+        ctypes.c_int, [_c_int_p, _c_int_p, ctypes.c_void_p]),
+    'evo_irimager_get_thermal_image_metadata': (
+        ctypes.c_int,
+        [_c_int_p, _c_int_p, ctypes.c_void_p, ctypes.c_void_p]),
+    'evo_irimager_terminate': (ctypes.c_int, []),
+    'evo_irimager_get_serial': (ctypes.c_int, [_c_int_p]),
+    'evo_irimager_set_shutter_mode': (ctypes.c_int, [ctypes.c_int]),
+    'evo_irimager_trigger_shutter_flag': (ctypes.c_int, [ctypes.c_void_p]),
+    'evo_irimager_set_temperature_range': (
+        ctypes.c_int, [ctypes.c_int, ctypes.c_int]),
+}
+
+
+def load_library() -> ctypes.CDLL:
+    if os_name == 'nt':
+        # windows
+        lib = ctypes.CDLL('x64/libirimager.dll')
+    else:
+        # linux
+        lib_path = ctypes_util.find_library('irdirectsdk')
+        if lib_path is None:
+            raise RuntimeError('libirimager (irdirectsdk) not found')
+        lib = ctypes.cdll.LoadLibrary(lib_path)
+    for name, (restype, argtypes) in _PROTOTYPES.items():
+        func = getattr(lib, name)
+        func.restype = restype
+        func.argtypes = argtypes
+    return lib
 
 
 @dataclass(frozen=True)  # todo: docstr
@@ -31,20 +65,33 @@ class SnapshotScheduleParameters:
             raise ValueError("file_interval <= sample_repetition")
 
 
+_EPOCH = datetime(1970, 1, 1)
+
+
+def round_datetime(t: datetime, interval: timedelta) -> datetime:
+    # integer microseconds since the epoch, rounded half to even like
+    # pandas.Timestamp.round
+    step = interval // timedelta(microseconds=1)
+    q, r = divmod((t - _EPOCH) // timedelta(microseconds=1), step)
+    if 2 * r > step or (2 * r == step and q % 2):
+        q += 1
+    return _EPOCH + timedelta(microseconds=q * step)
+
+
 class SnapshotSchedule(SnapshotScheduleParameters):
-    def next_snapshot(self) -> Timestamp:
+    def next_snapshot(self) -> datetime:
         time_now_offset = datetime.utcnow() + (self.sample_repetition / 2)
-        return to_datetime(time_now_offset).round(self.sample_repetition)
+        return round_datetime(time_now_offset, self.sample_repetition)
 
-    def current_sample_start(self) -> Timestamp:
+    def current_sample_start(self) -> datetime:
         return self.next_snapshot() - self.sample_interval
 
     def current_sample_end(self) -> datetime:
         return self.next_snapshot()
 
-    def current_file_time_end(self) -> Timestamp:
+    def current_file_time_end(self) -> datetime:
         time_now_offset = datetime.utcnow() + (self.file_interval / 2)
-        return to_datetime(time_now_offset).round(self.file_interval)
+        return round_datetime(time_now_offset, self.file_interval)
 
     def sample_timesteps_remaining(self) -> int:
         final_snapshot = self.current_file_time_end()
@@ -53,6 +100,12 @@ class SnapshotSchedule(SnapshotScheduleParameters):
         return n_samples
 
 
+_USB_INIT_RETRIES = metrics.counter(
+    'pixpy_usb_init_retries_total', 'Failed usb_init calls that were retried')
+_SHUTTER_TRIGGERS = metrics.counter(
+    'pixpy_shutter_triggers_total', 'Shutter flag triggers')
+
+
 @dataclass()
 class Shutter:
     _last_trigger_result: int = None
@@ -60,19 +113,39 @@ class Shutter:
     min_trigger_interval: timedelta = timedelta(seconds=15)
     _cycle_time: timedelta = None
     _triggers: int = 0
+    # time.monotonic() of the last trigger
+    _trigger_monotonic: float = None
+    # recent trigger -> flag open and settled times, see record_cycle
+    _cycle_times: deque = field(default_factory=lambda: deque(maxlen=16))
+    # cleared once a trigger was not seen to cycle the flag (a camera or
+    # backend that does not report it), to wait a fixed delay from then on
+    flag_visible: bool = True
 
     def trigger(self, sleep=True):
         trigger_start_time = datetime.utcnow()
         if (trigger_start_time - self._last_trigger_time) > self.min_trigger_interval:
+            self._trigger_monotonic = monotonic()
             self._last_trigger_result = trigger_shutter_flag()
             trigger_end_time = datetime.utcnow()
             self._last_trigger_time = trigger_end_time
-            self.cycle_cycle_time_time = trigger_end_time - trigger_start_time
             self._triggers += 1
+            _SHUTTER_TRIGGERS.inc()
             return 0
         else:
             return -1
 
+    def record_cycle(self, cycle_time: timedelta):
+        """Add an observed trigger -> flag open and settled time.
+
+        cycle_time() is the median of the last 16.
+        """
+        self._cycle_times.append(cycle_time)
+        self._cycle_time = sorted(self._cycle_times)[
+            len(self._cycle_times) // 2]
+
+    def cycle_time(self, default: timedelta = None) -> timedelta:
+        return default if self._cycle_time is None else self._cycle_time
+
 
 class ShutterMode(Enum):
     MANUAL = 0
@@ -105,96 +178,342 @@ class EvoIRFrameMetadata(ctypes.Structure):
         return out
 
 
+# numpy mirror of EvoIRFrameMetadata so the SDK can write straight into rows
+# of a structured array
+FRAME_METADATA_DTYPE = np.dtype([
+    ('counter', np.uint32),
+    ('counterHW', np.uint32),
+    ('timestamp', np.int64),
+    ('timestampMedia', np.int64),
+    ('flagState', np.uint32),
+    ('tempChip', np.float32),
+    ('tempFlag', np.float32),
+    ('tempBox', np.float32),
+], align=True)
+assert FRAME_METADATA_DTYPE.itemsize == ctypes.sizeof(EvoIRFrameMetadata)
+# EvoIRFrameMetadata.timestamp units
+TIMESTAMP_TICKS_PER_SECOND = 10_000_000
+
+
+class FlagState(Enum):
+    OPEN = 0
+    CLOSED = 1
+    OPENING = 2
+    CLOSING = 3
+    ERROR = 4
+
+
+class FlagGate:
+    """Decides frame by frame whether the flag is out of the way.
+
+    A frame is usable once the flag has been OPEN for settle_frames frames
+    in a row. After expect_cycle() (a trigger), the flag must also have been
+    seen not open first, so frames from before it closes are not taken as
+    settled. Unusable frames are counted in dropped.
+    """
+
+    def __init__(self, settle_frames: int = 2):
+        self.settle_frames = settle_frames
+        self.seen_closed = True
+        self.open_run = settle_frames
+        self.dropped = 0
+
+    def expect_cycle(self):
+        self.seen_closed = False
+        self.open_run = 0
+
+    def force_settled(self):
+        self.seen_closed = True
+        self.open_run = self.settle_frames
+
+    @property
+    def settled(self) -> bool:
+        return self.seen_closed and self.open_run >= self.settle_frames
+
+    def update(self, flag_state: int) -> bool:
+        """Whether a frame with this flagState can be used."""
+        if flag_state != FlagState.OPEN.value:
+            self.seen_closed = True
+            self.open_run = 0
+            self.dropped += 1
+            return False
+        if self.settled:
+            return True
+        self.open_run += 1
+        self.dropped += 1
+        return False
+
+
+class CameraBackend:
+    """Where frames come from. Subclasses implement the libirimager calls.
+
+    frame_reader(width, height) returns a callable that reads the next frame
+    into raw frame / FRAME_METADATA_DTYPE addresses and returns the SDK
+    return code.
+    """
+    name = None
+
+    def usb_init(self, xml_config: str, formats_def: str = None,
+                 log_file: str = None) -> int:
+        raise NotImplementedError
+
+    def terminate(self) -> int:
+        raise NotImplementedError
+
+    def get_serial(self) -> int:
+        raise NotImplementedError
+
+    def get_thermal_image_size(self) -> (int, int):
+        raise NotImplementedError
+
+    def get_palette_image_size(self) -> (int, int):
+        raise NotImplementedError
+
+    def get_palette_image(self, width: int, height: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def set_shutter_mode(self, shutterMode: int) -> int:
+        raise NotImplementedError
+
+    def trigger_shutter_flag(self) -> int:
+        raise NotImplementedError
+
+    def set_temperature_range(self, min: int, max: int) -> int:
+        raise NotImplementedError
+
+    def frame_reader(self, width: int, height: int):
+        raise NotImplementedError
+
+    def get_thermal_image(self, width: int, height: int) -> np.ndarray:
+        thermalData = np.empty((height, width), dtype=np.uint16)
+        meta = np.empty(1, dtype=FRAME_METADATA_DTYPE)
+        _ = self.frame_reader(width, height)(
+            thermalData.ctypes.data, meta.ctypes.data)
+        return thermalData
+
+
+class SDKBackend(CameraBackend):
+    """The Optris libirimager SDK through ctypes, loaded on creation."""
+    name = 'sdk'
+
+    def __init__(self):
+        self.lib = load_library()
+
+    def usb_init(self, xml_config: str, formats_def: str = None,
+                 log_file: str = None) -> int:
+        return self.lib.evo_irimager_usb_init(
+            xml_config.encode(),
+            None if formats_def is None else formats_def.encode(),
+            None if log_file is None else log_file.encode())
+
+    def get_thermal_image_size(self) -> (int, int):
+        width = ctypes.c_int()
+        height = ctypes.c_int()
+        _ = self.lib.evo_irimager_get_thermal_image_size(
+            ctypes.byref(width), ctypes.byref(height))
+        return width.value, height.value
+
+    def get_palette_image_size(self) -> (int, int):
+        width = ctypes.c_int()
+        height = ctypes.c_int()
+        _ = self.lib.evo_irimager_get_palette_image_size(
+            ctypes.byref(width), ctypes.byref(height))
+        return width.value, height.value
+
+    def get_thermal_image(self, width: int, height: int) -> np.ndarray:
+        w = ctypes.byref(ctypes.c_int(width))
+        h = ctypes.byref(ctypes.c_int(height))
+        thermalData = np.empty((height, width), dtype=np.uint16)
+        thermalDataPointer = thermalData.ctypes.data_as(
+                ctypes.POINTER(ctypes.c_ushort))
+        _ = self.lib.evo_irimager_get_thermal_image(w, h, thermalDataPointer)
+        return thermalData
+
+    def get_palette_image(self, width: int, height: int,
+                          n_retries: int = 50,
+                          retry_time: float = 0.02) -> np.ndarray:
+        # the SDK fails until it has a new palette image, so retry for up
+        # to about n_retries * retry_time
+        w = ctypes.byref(ctypes.c_int(width))
+        h = ctypes.byref(ctypes.c_int(height))
+        paletteData = np.empty((height, width, 3), dtype=np.uint8)
+        paletteDataPointer = paletteData.ctypes.data_as(
+                ctypes.POINTER(ctypes.c_ubyte))
+        for _ in range(n_retries + 1):
+            if self.lib.evo_irimager_get_palette_image(
+                    w, h, paletteDataPointer) == 0:
+                return paletteData
+            sleep(retry_time)
+        raise RuntimeError('No palette image from the camera')
+
+    def terminate(self) -> int:
+        return self.lib.evo_irimager_terminate()
+
+    def get_serial(self) -> int:
+        s = ctypes.c_int()
+        _ = self.lib.evo_irimager_get_serial(ctypes.byref(s))
+        return s.value
+
+    def set_shutter_mode(self, shutterMode: int) -> int:
+        return self.lib.evo_irimager_set_shutter_mode(shutterMode)
+
+    def trigger_shutter_flag(self) -> int:
+        return self.lib.evo_irimager_trigger_shutter_flag(None)
+
+    def set_temperature_range(self, min: int, max: int) -> int:
+        return self.lib.evo_irimager_set_temperature_range(min, max)
+
+    def frame_reader(self, width: int, height: int):
+        width_pointer = ctypes.pointer(ctypes.c_int(width))
+        height_pointer = ctypes.pointer(ctypes.c_int(height))
+        func = self.lib.evo_irimager_get_thermal_image_metadata
+
+        def read(frame_address: int, meta_address: int) -> int:
+            return func(width_pointer, height_pointer,
+                        frame_address, meta_address)
+        return read
+
+
+_backend = None
+
+
+def set_backend(backend: CameraBackend):
+    global _backend
+    _backend = backend
+
+
+def get_backend() -> CameraBackend:
+    # the SDK is only loaded when a camera call is first made
+    global _backend
+    if _backend is None:
+        from pixpy.backends import make_backend
+        _backend = make_backend(environ.get('PIXPY_CAMERA_BACKEND', 'sdk'))
+    return _backend
+
+
 def usb_init(xml_config: str, formats_def: str = None,
              log_file: str = None) -> int:
-    return lib.evo_irimager_usb_init(
-        xml_config.encode(),
-        None if formats_def is None else formats_def.encode(),
-        None if log_file is None else log_file.encode())
+    return get_backend().usb_init(xml_config, formats_def, log_file)
 
 
 def get_thermal_image_size() -> (int, int):
-    width = ctypes.c_int()
-    height = ctypes.c_int()
-    _ = lib.evo_irimager_get_thermal_image_size(ctypes.byref(width),
-                                                ctypes.byref(height))
-    return width.value, height.value
+    return get_backend().get_thermal_image_size()
 
 
 def get_palette_image_size() -> (int, int):
-    width = ctypes.c_int()
-    height = ctypes.c_int()
-    _ = lib.evo_irimager_get_palette_image_size(ctypes.byref(width),
-                                                ctypes.byref(height))
-    return width.value, height.value
+    return get_backend().get_palette_image_size()
 
 
 def get_thermal_image(width: int, height: int) -> np.ndarray:
-    w = ctypes.byref(ctypes.c_int(width))
-    h = ctypes.byref(ctypes.c_int(height))
-    thermalData = np.empty((height, width), dtype=np.uint16)
-    thermalDataPointer = thermalData.ctypes.data_as(
-            ctypes.POINTER(ctypes.c_ushort))
-    _ = lib.evo_irimager_get_thermal_image(w, h, thermalDataPointer)
-    return thermalData
+    return get_backend().get_thermal_image(width, height)
 
 
 def get_palette_image(width: int, height: int) -> np.ndarray:
-    w = ctypes.byref(ctypes.c_int(width))
-    h = ctypes.byref(ctypes.c_int(height))
-    paletteData = np.empty((height, width, 3), dtype=np.uint8)
-    paletteDataPointer = paletteData.ctypes.data_as(
-            ctypes.POINTER(ctypes.c_ubyte))
-    retVal = -1
-    while retVal != 0:
-        retVal = lib.evo_irimager_get_palette_image(w, h, paletteDataPointer)
-    return paletteData
+    return get_backend().get_palette_image(width, height)
 
 
 def terminate() -> int:
-    return lib.evo_irimager_terminate()
+    return get_backend().terminate()
 
 
 def get_serial() -> int:
-    s = ctypes.c_int()
-    _ = lib.evo_irimager_get_serial(ctypes.byref(s))
-    return s.value
+    return get_backend().get_serial()
 
 
 def set_shutter_mode(shutterMode: ShutterMode) -> int:
-    return lib.evo_irimager_set_shutter_mode(shutterMode)
+    return get_backend().set_shutter_mode(ShutterMode(shutterMode).value)
 
 
 def trigger_shutter_flag() -> int:
-    return lib.evo_irimager_trigger_shutter_flag(None)
+    return get_backend().trigger_shutter_flag()
 
 
 def set_temperature_range(min: int, max: int) -> int:
-    return lib.evo_irimager_set_temperature_range(min, max)
+    return get_backend().set_temperature_range(min, max)
 
 
 def get_thermal_image_metadata(
         width: int, height: int) -> (np.ndarray, EvoIRFrameMetadata):
-    w = ctypes.byref(ctypes.c_int(width))
-    h = ctypes.byref(ctypes.c_int(height))
     data = np.empty((height, width), dtype=np.uint16)
-    data_pointer = data.ctypes.data_as(ctypes.POINTER(ctypes.c_ushort))
     meta = EvoIRFrameMetadata()
-    meta_pointer = ctypes.pointer(meta)
-    _ = lib.evo_irimager_get_thermal_image_metadata(
-            w, h, data_pointer, meta_pointer)
+    _ = FrameGrabber(width, height).grab(
+        data.ctypes.data, ctypes.addressof(meta))
     return data, meta
 
 
+class FrameGrabber:
+    """Thermal frame reads from the active backend, set up once.
+
+    grab() takes raw addresses of the frame and metadata buffers so a read
+    allocates nothing on the Python side. A read that returns an error is
+    passed to recovery (a pixpy.FrameRecovery) if given, else RuntimeError.
+    """
+
+    def __init__(self, width: int, height: int, recovery=None):
+        self.width = width
+        self.height = height
+        self.recovery = recovery
+        self.grab = get_backend().frame_reader(width, height)
+
+    def recover(self, code: int, frame_address: int, meta_address: int):
+        if self.recovery is None:
+            raise RuntimeError(f'frame read failed ({code})')
+        return self.recovery.recover(code, self.grab, frame_address,
+                                     meta_address)
+
+
+def capture_burst(n: int, out_frames: np.ndarray, out_meta: np.ndarray,
+                  out_latency: np.ndarray = None, on_frame=None,
+                  grabber: FrameGrabber = None) -> np.ndarray:
+    """Read n frames straight into caller-provided buffers.
+
+    out_frames is a C-contiguous uint16 (k, height, width) array and frame i
+    is written to out_frames[i % k], so k may be smaller than n when
+    on_frame(i, frame) consumes each frame before its slot is reused.
+    out_meta is a FRAME_METADATA_DTYPE array with at least n rows.
+    Returns the per-frame SDK call latency in ns (out_latency if given),
+    including any time spent recovering from a failed read.
+    """
+    n_slots, height, width = out_frames.shape
+    if out_frames.dtype != np.uint16 or \
+            not out_frames.flags['C_CONTIGUOUS']:
+        raise ValueError('out_frames must be C-contiguous uint16')
+    if out_meta.dtype != FRAME_METADATA_DTYPE or out_meta.shape[0] < n:
+        raise ValueError(f'out_meta must be {n} rows of FRAME_METADATA_DTYPE')
+    if out_latency is None:
+        out_latency = np.empty(n, dtype=np.int64)
+    if grabber is None:
+        grabber = FrameGrabber(width, height)
+    elif (grabber.width, grabber.height) != (width, height):
+        raise ValueError('grabber size does not match out_frames')
+    frames = list(out_frames)
+    frame_address = out_frames.ctypes.data
+    frame_nbytes = out_frames[0].nbytes
+    meta_address = out_meta.ctypes.data
+    meta_nbytes = out_meta.itemsize
+    grab = grabber.grab
+    for i in range(n):
+        slot = i % n_slots
+        start = perf_counter_ns()
+        code = grab(frame_address + slot * frame_nbytes,
+                    meta_address + i * meta_nbytes)
+        if code != 0:
+            grabber.recover(code, frame_address + slot * frame_nbytes,
+                            meta_address + i * meta_nbytes)
+        out_latency[i] = perf_counter_ns() - start
+        if on_frame is not None:
+            on_frame(i, frames[slot])
+    return out_latency
+
+
 def usb_init_retry(config_file: str, n_retries: int = 10,
-                   retry_time: float = 0.25):
-    res = -1
-    retries = 0
-    while res != 0:
+                   retry_time: float = 0.05, max_retry_time: float = 5.0):
+    # retry_time doubles after each failed attempt, up to max_retry_time
+    for retries in range(n_retries + 1):
         print('...')
-        res = usb_init(config_file)
-        if retries > n_retries:
-            raise ValueError("Could not initialise USB connection")
-            terminate()
-        retries += 1
-        sleep(retry_time)
+        if usb_init(config_file) == 0:
+            return
+        _USB_INIT_RETRIES.inc()
+        terminate()
+        sleep(min(retry_time * 2 ** retries, max_retry_time))
+    raise ValueError("Could not initialise USB connection")
@@ -0,0 +1,240 @@
+from collections import Counter
+from datetime import datetime
+from threading import Event, Thread, current_thread, enumerate as threads
+from time import monotonic
+import os
+import signal
+import sys
+import tracemalloc
+
+PROFILE_SIGNAL = signal.SIGUSR1
+PROFILE_ACTIONS = ('cpu', 'memory')
+
+# innermost frame (qualified name) that decides which stage a stack is in;
+# anything else on a profiled thread is capture
+STAGE_FRAMES = {
+    'SampleProcessor.__call__': 'aggregate',
+    'SampleWriter.__call__': 'write',
+}
+# waiting: a pipeline worker for work, the capture for the next sample
+# (time.sleep is a C call, so sleep_until or wait_until is innermost)
+IDLE_FRAMES = ('StageQueue.get', 'sleep_until',
+               'image_capture.<locals>.wait_until')
+# idle only as the innermost frame: wait_until also reads frames between
+# bursts for the ROIs and live frame ring, which is capture work
+INNERMOST_IDLE_FRAMES = ('image_capture.<locals>.wait_until',)
+PIPELINE_THREADS = ('pixpy-aggregate', 'pixpy-write')
+
+
+def _frame_name(frame) -> str:
+    qualname = getattr(frame.f_code, 'co_qualname', None)
+    return _qualname(frame) if qualname is None else qualname
+
+
+def _qualname(frame) -> str:
+    # co_qualname before python 3.11: the class of a method is found from
+    # self, the function a nested function is defined in from its caller
+    code = frame.f_code
+    if code.co_argcount and code.co_varnames[0] == 'self':
+        for cls in type(frame.f_locals.get('self')).__mro__:
+            method = cls.__dict__.get(code.co_name)
+            if getattr(method, '__code__', None) is code:
+                return f'{cls.__qualname__}.{code.co_name}'
+    caller = frame.f_back
+    if caller is not None and code in caller.f_code.co_consts:
+        return f'{_frame_name(caller)}.<locals>.{code.co_name}'
+    return code.co_name
+
+
+class StackSampler:
+    """Samples the stacks of some threads every interval seconds.
+
+    Each sampled stack is attributed to a stage by STAGE_FRAMES and counted
+    in folded form (outermost;...;innermost, as used by flame graph tools).
+    """
+
+    def __init__(self, thread_ids: set, interval: float = 0.005):
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.stacks = {}
+        self.n = 0
+        self._stop = Event()
+        self._thread = Thread(target=self._run, name='pixpy-profile',
+                              daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.n += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in self.thread_ids:
+                    self._add(frame)
+
+    def _add(self, frame):
+        names = []
+        stage = None
+        while frame is not None:
+            name = _frame_name(frame)
+            if name in IDLE_FRAMES and \
+                    (not names or name not in INNERMOST_IDLE_FRAMES):
+                return
+            if stage is None:
+                stage = STAGE_FRAMES.get(name)
+            names.append(
+                f'{os.path.basename(frame.f_code.co_filename)}:{name}')
+            frame = frame.f_back
+        stacks = self.stacks.setdefault(stage or 'capture', Counter())
+        stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def summarise_stacks(stacks: Counter, n_top: int = 20) -> list:
+    """Lines of the functions with the most samples, self and total."""
+    n = sum(stacks.values())
+    own = Counter()
+    total = Counter()
+    for stack, count in stacks.items():
+        names = stack.split(';')
+        own[names[-1]] += count
+        for name in set(names):
+            total[name] += count
+    lines = [f'{"self":>6} {"total":>6}  function']
+    for name, _ in own.most_common(n_top):
+        lines.append(f'{100 * own[name] / n:5.1f}% '
+                     f'{100 * total[name] / n:5.1f}%  {name}')
+    return lines
+
+
+class ProfileSession:
+    def __init__(self, n_samples: int, actions: tuple, thread_ids: set,
+                 interval: float):
+        self.n_samples = n_samples
+        self.samples_left = n_samples
+        self.actions = actions
+        self.started = datetime.utcnow()
+        self.start_monotonic = monotonic()
+        self.sampler = None
+        if 'memory' in actions and not tracemalloc.is_tracing():
+            tracemalloc.start(8)
+        if 'cpu' in actions:
+            self.sampler = StackSampler(thread_ids, interval).start()
+
+
+class ProfileControl:
+    """Runs a profile of the next n samples when asked to at runtime.
+
+    A profile is requested by sending PROFILE_SIGNAL (SIGUSR1) to the
+    process or by creating the control file pixpy_profile_<serial> in the
+    output directory. The control file may hold the number of samples and
+    the actions (cpu, memory), e.g. "20 cpu"; it is removed when read.
+    'cpu' samples the stacks of the capture and pipeline threads,
+    attributed to the capture, aggregate and write stages; 'memory' traces
+    allocations with tracemalloc. Results are written next to the output
+    files as pixpy_profile_<serial>_<start time>_*. When no profile runs,
+    tick() costs a flag check and one stat() of the control file per sample.
+    """
+
+    def __init__(self, output_directory: str, serial: int,
+                 n_samples: int = 10, interval: float = 0.005):
+        self.output_directory = output_directory
+        self.serial = serial
+        self.n_samples = n_samples
+        self.interval = interval
+        self.control_path = os.path.join(
+            output_directory, f'pixpy_profile_{serial}')
+        self.session = None
+        self._requested = None
+
+    def install_signal_handler(self):
+        # only possible from the main thread
+        signal.signal(PROFILE_SIGNAL, self._on_signal)
+        return self
+
+    def _on_signal(self, signum, frame):
+        self._requested = (self.n_samples, PROFILE_ACTIONS)
+
+    def request(self, n_samples: int = None, actions: tuple = PROFILE_ACTIONS):
+        self._requested = (n_samples or self.n_samples, actions)
+
+    def _read_control_file(self):
+        try:
+            with open(self.control_path) as file:
+                words = file.read().split()
+            os.remove(self.control_path)
+        except OSError:
+            return
+        n_samples = self.n_samples
+        actions = tuple(w for w in words if w in PROFILE_ACTIONS)
+        for word in words:
+            if word.isdigit():
+                n_samples = int(word)
+            elif word not in PROFILE_ACTIONS:
+                print(f'ignoring {word} in {self.control_path}')
+        self.request(n_samples, actions or PROFILE_ACTIONS)
+
+    def tick(self):
+        """Call once per sample, on the capture thread."""
+        session = self.session
+        if session is not None:
+            session.samples_left -= 1
+            if session.samples_left <= 0:
+                self.session = None
+                Thread(target=self._finish, args=(session,),
+                       name='pixpy-profile-dump', daemon=True).start()
+            return
+        if os.path.exists(self.control_path):
+            self._read_control_file()
+        if self._requested is not None:
+            n_samples, actions = self._requested
+            self._requested = None
+            self._start(n_samples, actions)
+
+    def _start(self, n_samples, actions):
+        capture = current_thread().ident
+        thread_ids = {capture} | {t.ident for t in threads()
+                                  if t.name in PIPELINE_THREADS}
+        self.session = ProfileSession(
+            n_samples, actions, thread_ids, self.interval)
+        print(f'profiling {" and ".join(actions)} for {n_samples} samples')
+
+    def _finish(self, session):
+        base = os.path.join(
+            self.output_directory,
+            f'pixpy_profile_{self.serial}_{session.started:%Y%m%d%H%M%S}')
+        seconds = monotonic() - session.start_monotonic
+        lines = [f'{session.n_samples} samples from {session.started} '
+                 f'({seconds:.1f} s)']
+        if session.sampler is not None:
+            sampler = session.sampler
+            sampler.stop()
+            lines.append(f'stacks sampled every {sampler.interval * 1000:g} '
+                         f'ms ({sampler.n} times)')
+            for stage, stacks in sorted(sampler.stacks.items()):
+                n = sum(stacks.values())
+                lines += ['', f'{stage}: {n} stack samples '
+                          f'({n * sampler.interval:.2f} s busy)']
+                lines += summarise_stacks(stacks)
+                with open(f'{base}_{stage}.folded', 'w') as file:
+                    for stack, count in stacks.most_common():
+                        file.write(f'{stack} {count}\n')
+        if 'memory' in session.actions:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(f'{base}.tracemalloc')
+            snapshot = snapshot.filter_traces([
+                tracemalloc.Filter(
+                    True, os.path.join(os.path.dirname(__file__), '*')),
+                tracemalloc.Filter(False, __file__)])
+            statistics = snapshot.statistics('lineno')
+            lines += ['', 'memory allocated by pixpy and still held '
+                      f'({sum(s.size for s in statistics) / 1e6:.1f} MB):']
+            lines += [str(s) for s in statistics[:20]]
+        with open(f'{base}_summary.txt', 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        print(f'profile written to {base}_summary.txt')
@@ -0,0 +1,104 @@
+from threading import Lock
+
+# work that can be shed, in the default order
+QOS_ACTIONS = ('median', 'n_images', 'snapshot', 'compression')
+
+QOS_DESCRIPTION = (
+    "qos_level k means the first k of qos_levels were shed for that sample. "
+    "median: t_b_median and other histogram statistics (percentiles, "
+    "iqr, trimmed means) not computed (0). "
+    "n_images: fewer images aggregated (see n_images). "
+    "snapshot: t_b_snapshot not stored (0). "
+    "compression: file written uncompressed and compressed later."
+)
+
+
+def parse_qos_levels(text: str) -> tuple:
+    levels = tuple((text or '').replace(',', ' ').split())
+    for action in levels:
+        if action not in QOS_ACTIONS:
+            raise ValueError(f'Unknown qos level {action}')
+    if len(set(levels)) != len(levels):
+        raise ValueError('Repeated qos level')
+    return levels
+
+
+def shed_actions(levels: tuple, level: int) -> tuple:
+    return tuple(levels[:level])
+
+
+class QosController:
+    """Sheds work, one level at a time, when samples take too long.
+
+    Each stage reports its time for the latest sample with record(),
+    against its own budget or the default (sample_repetition); the load is
+    the largest of these fractions, since the pipeline stages run
+    concurrently. The capture stage reports only its work after the burst,
+    which has to fit between bursts (sample_repetition - sample_interval).
+    update() is called before each sample: the level goes up when the load
+    is above high_load or the sample starts late by more than
+    late_tolerance of the budget, and back down after recover_samples
+    samples in a row below low_load.
+    """
+
+    def __init__(self, levels: tuple = QOS_ACTIONS, budget: float = 60.0,
+                 n_images_factor: float = 0.5, high_load: float = 0.9,
+                 low_load: float = 0.6, late_tolerance: float = 0.1,
+                 recover_samples: int = 3):
+        self.levels = tuple(levels)
+        self.budget = budget
+        self.n_images_factor = n_images_factor
+        self.high_load = high_load
+        self.low_load = low_load
+        self.late_tolerance = late_tolerance
+        self.recover_samples = recover_samples
+        self.level = 0
+        self._headroom = 0
+        self._times = {}
+        self._lock = Lock()
+
+    def configure(self, levels: tuple, budget: float,
+                  n_images_factor: float):
+        self.levels = tuple(levels)
+        self.budget = budget
+        self.n_images_factor = n_images_factor
+        self.level = min(self.level, len(self.levels))
+
+    def record(self, stage: str, seconds: float, budget: float = None):
+        with self._lock:
+            self._times[stage] = (seconds, budget)
+
+    def load(self) -> float:
+        with self._lock:
+            times = list(self._times.values())
+        return max((seconds / (self.budget if budget is None else budget)
+                    for seconds, budget in times), default=0.0)
+
+    def update(self, lateness: float = 0.0) -> int:
+        load = self.load()
+        level = self.level
+        if load > self.high_load or \
+                lateness > self.late_tolerance * self.budget:
+            self._headroom = 0
+            level = min(level + 1, len(self.levels))
+        elif load < self.low_load:
+            self._headroom += 1
+            if self._headroom >= self.recover_samples and level > 0:
+                self._headroom = 0
+                level -= 1
+        else:
+            self._headroom = 0
+        if level != self.level:
+            print(f'qos level {self.level} -> {level} '
+                  f'{shed_actions(self.levels, level)} (load {load:.2f}, '
+                  f'late {lateness:.3f} s)')
+            self.level = level
+        return level
+
+    def shed(self, action: str) -> bool:
+        return action in shed_actions(self.levels, self.level)
+
+    def n_images(self, n_images: int) -> int:
+        if not self.shed('n_images'):
+            return n_images
+        return max(1, int(n_images * self.n_images_factor + 0.5))
@@ -0,0 +1,172 @@
+from datetime import datetime
+from time import monotonic
+from threading import Thread
+import os
+import struct
+import traceback
+import zlib
+import numpy as np
+from pixpy import metrics
+from pixpy.pipeline import StageQueue
+
+# (position 0-1, r, g, b) control points, interpolated into a lookup table
+PALETTES = {
+    'iron': ((0.0, 0, 0, 0), (0.15, 32, 0, 140), (0.35, 145, 0, 155),
+             (0.55, 225, 50, 50), (0.75, 250, 145, 0), (0.9, 255, 220, 40),
+             (1.0, 255, 255, 255)),
+    'rainbow': ((0.0, 0, 0, 130), (0.2, 0, 60, 255), (0.4, 0, 220, 220),
+                (0.6, 60, 230, 0), (0.8, 255, 200, 0), (1.0, 230, 0, 0)),
+    'grey': ((0.0, 0, 0, 0), (1.0, 255, 255, 255)),
+}
+QUICKLOOK_FORMATS = ('png', 'jpeg')
+
+_QUICKLOOK_TIME = metrics.histogram(
+    'pixpy_quicklook_seconds', 'Time to colour, encode and write a quicklook')
+
+
+def make_lut(palette: str = 'iron', n: int = 256) -> np.ndarray:
+    """(n, 3) uint8 colours of a palette, from cold to hot."""
+    if palette not in PALETTES:
+        raise ValueError(f'Unknown palette {palette}')
+    points = np.array(PALETTES[palette], dtype=float)
+    x = np.linspace(0, 1, n)
+    return np.stack([np.interp(x, points[:, 0], points[:, k])
+                     for k in (1, 2, 3)], axis=1).round().astype(np.uint8)
+
+
+def contrast_limits(raw: np.ndarray, percentiles: tuple = (1, 99)):
+    """(low, high) raw values at the percentiles of the computed pixels."""
+    valid = raw[raw != 0]
+    if valid.size == 0:
+        return None
+    low, high = np.percentile(valid, percentiles)
+    return low, max(high, low + 1)
+
+
+def colourise(raw: np.ndarray, lut: np.ndarray, limits: tuple = None,
+              percentiles: tuple = (1, 99), downsample: int = 1):
+    """(height, width, 3) uint8 colour image of a raw thermal array.
+
+    Every downsample'th pixel is kept in each direction. raw values between
+    the limits (default: contrast_limits() at percentiles) are spread over
+    the lookup table, those outside are clipped and 0 (not computed) is
+    black.
+    """
+    if downsample > 1:
+        raw = raw[::downsample, ::downsample]
+    if limits is None:
+        limits = contrast_limits(raw, percentiles)
+        if limits is None:
+            return np.zeros(raw.shape + (3,), dtype=np.uint8)
+    low, high = limits
+    scale = (lut.shape[0] - 1) / (high - low)
+    index = np.subtract(raw, low, dtype=np.float32)
+    index *= scale
+    np.clip(index, 0, lut.shape[0] - 1, out=index)
+    rgb = lut[index.astype(np.uint8)]
+    rgb[raw == 0] = 0
+    return rgb
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + \
+        struct.pack('>I', zlib.crc32(kind + data))
+
+
+def encode_png(rgb: np.ndarray, level: int = 6) -> bytes:
+    """8 bit RGB PNG, every row with the Sub filter (difference to the pixel
+    on the left), which suits smooth thermal scenes."""
+    height, width, _ = rgb.shape
+    rows = np.empty((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 0] = 1
+    flat = rgb.reshape(height, 3 * width)
+    rows[:, 1:4] = flat[:, :3]
+    np.subtract(flat[:, 3:], flat[:, :-3], out=rows[:, 4:])
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) + \
+        _png_chunk(b'IDAT', zlib.compress(rows.tobytes(), level)) + \
+        _png_chunk(b'IEND', b'')
+
+
+def encode_jpeg(rgb: np.ndarray, quality: int = 85) -> bytes:
+    from io import BytesIO
+    from PIL import Image
+    buffer = BytesIO()
+    Image.fromarray(rgb).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def encode_quicklook(rgb: np.ndarray, fmt: str = 'png') -> bytes:
+    if fmt == 'png':
+        return encode_png(rgb)
+    if fmt == 'jpeg':
+        return encode_jpeg(rgb)
+    raise ValueError(f'Unknown quicklook format {fmt}')
+
+
+_STOP = object()
+
+
+class QuicklookWorker:
+    """Writes a colour quicklook of each sample on a background thread.
+
+    submit() only queues the image, replacing one that is still waiting, so
+    it never blocks the caller. Each quicklook is written to
+    <output_directory>/<serial>_<sample time>.<fmt> and copied to
+    <serial>_latest.<fmt>, both replaced atomically.
+    """
+
+    def __init__(self, output_directory: str, fmt: str = 'png',
+                 downsample: int = 1, palette: str = 'iron',
+                 percentiles: tuple = (1, 99)):
+        if fmt not in QUICKLOOK_FORMATS:
+            raise ValueError(f'Unknown quicklook format {fmt}')
+        self.output_directory = output_directory
+        self.fmt = fmt
+        self.downsample = downsample
+        self.lut = make_lut(palette)
+        self.percentiles = percentiles
+        self.queue = StageQueue('quicklook', 1, 'drop_oldest')
+        self._thread = Thread(target=self._run, name='pixpy-quicklook',
+                              daemon=True)
+
+    def start(self):
+        os.makedirs(self.output_directory, exist_ok=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.queue.put(_STOP, droppable=False)
+        self._thread.join()
+
+    def submit(self, serial: int, sample_time: datetime, raw: np.ndarray):
+        self.queue.put((serial, sample_time, raw))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            try:
+                self.write(*item)
+            except Exception:
+                traceback.print_exc()
+
+    def _replace(self, file_path, data):
+        with open(f'{file_path}.part', 'wb') as file:
+            file.write(data)
+        os.replace(f'{file_path}.part', file_path)
+
+    def write(self, serial: int, sample_time: datetime, raw: np.ndarray):
+        start = monotonic()
+        rgb = colourise(raw, self.lut, percentiles=self.percentiles,
+                        downsample=self.downsample)
+        data = encode_quicklook(rgb, self.fmt)
+        file_path = os.path.join(
+            self.output_directory,
+            f'{serial}_{sample_time:%Y%m%d%H%M%S}.{self.fmt}')
+        self._replace(file_path, data)
+        self._replace(os.path.join(self.output_directory,
+                                   f'{serial}_latest.{self.fmt}'), data)
+        _QUICKLOOK_TIME.observe(monotonic() - start)
+        return file_path
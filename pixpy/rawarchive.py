@@ -0,0 +1,181 @@
+import os
+import zlib
+import numpy as np
+from pixpy.pixpy import FRAME_METADATA_DTYPE
+
+RAW_MAGIC = 0x77617270  # 'praw'
+RAW_VERSION = 1
+RAW_CODECS = ('zstd', 'lz4', 'zlib')
+
+# one record per burst: this header, the burst's frame metadata, then the
+# compressed frames
+RECORD_HEADER_DTYPE = np.dtype([
+    ('magic', '<u4'),
+    ('version', '<u2'),
+    ('codec', '<u2'),
+    ('sample', '<u4'),
+    ('n_frames', '<u4'),
+    ('height', '<u2'),
+    ('width', '<u2'),
+    ('payload_nbytes', '<u4'),
+    ('crc32', '<u4'),
+])
+
+
+def _zstd():
+    import zstandard
+    return (zstandard.ZstdCompressor(level=1).compress,
+            zstandard.ZstdDecompressor().decompress)
+
+
+def _lz4():
+    import lz4.frame
+    return lz4.frame.compress, lz4.frame.decompress
+
+
+def _zlib():
+    return (lambda data: zlib.compress(data, 1)), zlib.decompress
+
+
+_CODEC_FUNCTIONS = {'zstd': _zstd, 'lz4': _lz4, 'zlib': _zlib}
+
+
+def available_codecs() -> list:
+    codecs = []
+    for codec in RAW_CODECS:
+        try:
+            _CODEC_FUNCTIONS[codec]()
+        except ImportError:
+            continue
+        codecs.append(codec)
+    return codecs
+
+
+def codec_functions(codec: str = 'auto'):
+    """(codec, compress, decompress); 'auto' is the fastest one installed."""
+    if codec == 'auto':
+        codec = available_codecs()[0]
+    if codec not in _CODEC_FUNCTIONS:
+        raise ValueError(f'Unknown raw archive codec {codec}')
+    return (codec, *_CODEC_FUNCTIONS[codec]())
+
+
+def delta_shuffle(frames: np.ndarray) -> bytes:
+    """Frame-to-frame differences of a uint16 burst, zigzagged, shuffled.
+
+    Differences wrap around in uint16 so the transform is lossless; zigzag
+    maps small positive and negative differences to small values so their
+    high bytes are zero, and the byte shuffle puts all low bytes before all
+    high bytes for the codec.
+    """
+    delta = np.empty(frames.shape, dtype=np.uint16)
+    delta[0] = frames[0]
+    np.subtract(frames[1:], frames[:-1], out=delta[1:])
+    signed = delta.view(np.int16)
+    zigzag = (delta << 1) ^ (signed >> 15).view(np.uint16)
+    return zigzag.view(np.uint8).reshape(-1, 2).T.tobytes()
+
+
+def unshuffle_delta(data: bytes, shape: tuple) -> np.ndarray:
+    n = int(np.prod(shape))
+    zigzag = np.empty((n, 2), dtype=np.uint8)
+    zigzag.T[...] = np.frombuffer(data, dtype=np.uint8).reshape(2, n)
+    zigzag = zigzag.view(np.uint16).reshape(shape)
+    delta = (zigzag >> 1) ^ (-(zigzag & 1)).astype(np.uint16)
+    return np.cumsum(delta, axis=0, dtype=np.uint16)
+
+
+class RawArchiveWriter:
+    """Appends every frame of every burst of a file interval, losslessly.
+
+    <base_path>_raw.pxr holds one record per burst (RECORD_HEADER_DTYPE,
+    the FRAME_METADATA_DTYPE rows, then the delta_shuffle()d frames
+    compressed with codec), with a .part suffix until closed like
+    NetCDFWriter. A .part file left by a crash is appended to after its
+    last complete record.
+    """
+    extension = '.pxr'
+
+    def __init__(self, base_path: str, codec: str = 'auto'):
+        self.codec, self._compress, _ = codec_functions(codec)
+        self._codec_id = RAW_CODECS.index(self.codec)
+        self.file_path = f'{base_path}_raw{self.extension}'
+        self.part_path = f'{self.file_path}.part'
+        mode = 'wb'
+        if os.path.exists(self.part_path):
+            end = sum(_record_nbytes(h) for h, _ in
+                      _read_headers(self.part_path))
+            os.truncate(self.part_path, end)
+            mode = 'ab'
+        self._file = open(self.part_path, mode)
+        self.nbytes = 0
+
+    def append(self, sample: int, frames: np.ndarray, meta: np.ndarray):
+        n_frames, height, width = frames.shape
+        payload = self._compress(delta_shuffle(frames))
+        header = np.zeros((), dtype=RECORD_HEADER_DTYPE)
+        header[()] = (RAW_MAGIC, RAW_VERSION, self._codec_id, sample,
+                      n_frames, height, width, len(payload),
+                      zlib.crc32(payload))
+        record = header.tobytes() + \
+            np.ascontiguousarray(meta[:n_frames]).tobytes() + payload
+        self._file.write(record)
+        self._file.flush()
+        self.nbytes += len(record)
+
+    def close(self, rename: bool = True):
+        self._file.close()
+        if rename:
+            os.replace(self.part_path, self.file_path)
+
+
+def _record_nbytes(header) -> int:
+    return RECORD_HEADER_DTYPE.itemsize + \
+        int(header['n_frames']) * FRAME_METADATA_DTYPE.itemsize + \
+        int(header['payload_nbytes'])
+
+
+def _read_headers(file_path: str):
+    # (header, offset) of each complete record; stops at a truncated one
+    size = os.path.getsize(file_path)
+    offset = 0
+    with open(file_path, 'rb') as file:
+        while offset + RECORD_HEADER_DTYPE.itemsize <= size:
+            file.seek(offset)
+            header = np.frombuffer(
+                file.read(RECORD_HEADER_DTYPE.itemsize),
+                dtype=RECORD_HEADER_DTYPE)[0]
+            if header['magic'] != RAW_MAGIC or \
+                    header['version'] != RAW_VERSION:
+                raise ValueError(f'{file_path}: bad record at {offset}')
+            if offset + _record_nbytes(header) > size:
+                return
+            yield header, offset
+            offset += _record_nbytes(header)
+
+
+def read_raw_archive(file_path: str):
+    """Yields (sample, frames, meta) for each burst in a raw archive file.
+
+    frames is (n_frames, height, width) uint16 as read from the camera and
+    meta the FRAME_METADATA_DTYPE rows. Works on .part files too.
+    """
+    decompressors = {}
+    for header, offset in _read_headers(file_path):
+        codec = RAW_CODECS[header['codec']]
+        if codec not in decompressors:
+            decompressors[codec] = codec_functions(codec)[2]
+        n_frames = int(header['n_frames'])
+        with open(file_path, 'rb') as file:
+            file.seek(offset + RECORD_HEADER_DTYPE.itemsize)
+            meta = np.frombuffer(
+                file.read(n_frames * FRAME_METADATA_DTYPE.itemsize),
+                dtype=FRAME_METADATA_DTYPE)
+            payload = file.read(int(header['payload_nbytes']))
+        if zlib.crc32(payload) != header['crc32']:
+            raise ValueError(f'{file_path}: corrupt record of sample '
+                             f'{header["sample"]}')
+        frames = unshuffle_delta(
+            decompressors[codec](payload),
+            (n_frames, int(header['height']), int(header['width'])))
+        yield int(header['sample']), frames, meta
@@ -0,0 +1,111 @@
+from time import monotonic, sleep
+from pixpy import metrics
+from pixpy.pixpy import get_serial, set_shutter_mode, terminate, usb_init
+
+# evo_irimager_* return codes
+SDK_OK = 0
+SDK_ERROR = -1  # this call failed, e.g. no frame in time
+SDK_FATAL = -2  # the connection to the camera is gone
+
+_READ_ERRORS = metrics.counter(
+    'pixpy_read_errors_total', 'Frame reads that returned an error')
+_READ_RETRIES = metrics.counter(
+    'pixpy_read_retries_total', 'Frame reads retried in place')
+_REINITS = metrics.counter(
+    'pixpy_reinits_total', 'Camera reinitialisations after read errors')
+_RECOVERY_FAILURES = metrics.counter(
+    'pixpy_recovery_failures_total',
+    'Read errors the camera did not recover from')
+_RECOVERY_TIME = metrics.histogram(
+    'pixpy_recovery_seconds', 'First failed read to the next good read',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0))
+
+
+def classify_return_code(code: int) -> str:
+    """'ok', 'retry' (read again) or 'reinit' (start the camera again)."""
+    if code == SDK_OK:
+        return 'ok'
+    if code == SDK_ERROR:
+        return 'retry'
+    # SDK_FATAL and anything undocumented
+    return 'reinit'
+
+
+def backoff_delay(attempt: int, base: float, limit: float) -> float:
+    return min(base * 2 ** attempt, limit)
+
+
+class FrameRecovery:
+    """Gets frame reads going again after the SDK returns an error.
+
+    A read that fails with SDK_ERROR is retried in place up to n_retries
+    times, waiting retry_backoff, 2 * retry_backoff, ... in between. A
+    fatal error, or one that persists, escalates to reinitialising the
+    camera (terminate, usb_init, the serial checked and the shutter mode
+    restored) up to n_reinits times with backoff from reinit_backoff up to
+    max_backoff. The caller's buffers, grabber and file interval are left
+    as they are, so a brief USB glitch costs the time it lasted rather than
+    a restart of the capture. RuntimeError if the camera does not come back.
+    """
+
+    def __init__(self, config_file: str, serial: int, shutter_mode: int = 0,
+                 n_retries: int = 3, retry_backoff: float = 0.002,
+                 n_reinits: int = 6, reinit_backoff: float = 0.1,
+                 max_backoff: float = 5.0):
+        self.config_file = config_file
+        self.serial = serial
+        self.shutter_mode = shutter_mode
+        self.n_retries = n_retries
+        self.retry_backoff = retry_backoff
+        self.n_reinits = n_reinits
+        self.reinit_backoff = reinit_backoff
+        self.max_backoff = max_backoff
+        self.state = 'reading'
+        self.n_errors = 0
+
+    def recover(self, code: int, read, frame_address: int,
+                meta_address: int) -> int:
+        """Read again until read(frame_address, meta_address) succeeds."""
+        start = monotonic()
+        self.n_errors += 1
+        _READ_ERRORS.inc()
+        if classify_return_code(code) == 'retry':
+            self.state = 'retry'
+            for attempt in range(self.n_retries):
+                sleep(backoff_delay(attempt, self.retry_backoff,
+                                    self.max_backoff))
+                _READ_RETRIES.inc()
+                code = read(frame_address, meta_address)
+                if code == SDK_OK:
+                    return self._recovered(start)
+                if classify_return_code(code) == 'reinit':
+                    break
+        self.state = 'reinit'
+        for attempt in range(self.n_reinits):
+            _REINITS.inc()
+            if self.reinit():
+                code = read(frame_address, meta_address)
+                if code == SDK_OK:
+                    return self._recovered(start)
+            sleep(backoff_delay(attempt, self.reinit_backoff,
+                                self.max_backoff))
+        self.state = 'failed'
+        _RECOVERY_FAILURES.inc()
+        raise RuntimeError(f'camera did not recover from read error {code} '
+                           f'in {monotonic() - start:.1f} s')
+
+    def _recovered(self, start: float) -> int:
+        seconds = monotonic() - start
+        _RECOVERY_TIME.observe(seconds)
+        print(f'recovered from {self.state} in {seconds * 1000:.1f} ms')
+        self.state = 'reading'
+        return SDK_OK
+
+    def reinit(self) -> bool:
+        terminate()
+        if usb_init(self.config_file) != SDK_OK:
+            return False
+        if get_serial() != self.serial:
+            return False
+        set_shutter_mode(self.shutter_mode)
+        return True
@@ -0,0 +1,192 @@
+from multiprocessing import shared_memory
+from time import monotonic, sleep
+import numpy as np
+from pixpy.pixpy import FRAME_METADATA_DTYPE
+
+RING_MAGIC = 0x70697870  # 'pixp'
+RING_VERSION = 1
+
+# header: fixed fields, then the number of frames published so far
+_HEADER_DTYPE = np.dtype([
+    ('magic', np.uint32),
+    ('version', np.uint32),
+    ('n_slots', np.uint32),
+    ('height', np.uint32),
+    ('width', np.uint32),
+    ('meta_itemsize', np.uint32),
+    ('published', np.uint64),
+])
+_HEADER_NBYTES = 64
+
+
+def ring_name(serial: int) -> str:
+    return f'pixpy_{serial}'
+
+
+def _slot_dtype(height: int, width: int) -> np.dtype:
+    # seq is odd while the slot is being written and 2 * (frame number + 1)
+    # once frame number is complete
+    return np.dtype([
+        ('seq', np.uint64),
+        ('meta', FRAME_METADATA_DTYPE),
+        ('frame', np.uint16, (height, width)),
+    ], align=True)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # before python 3.13 every attached process registers the segment with
+    # its resource tracker, which unlinks it when that process exits
+    from multiprocessing import resource_tracker
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        resource_tracker.register = register
+
+
+class _Ring:
+    def _map(self, shm):
+        self._shm = shm
+        self.header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=shm.buf)
+        if self.header['magic'] != RING_MAGIC or \
+                self.header['version'] != RING_VERSION:
+            raise ValueError(f'{shm.name} is not a pixpy frame ring')
+        self.n_slots = int(self.header['n_slots'])
+        self.height = int(self.header['height'])
+        self.width = int(self.header['width'])
+        self.slots = np.ndarray(
+            (self.n_slots,), dtype=_slot_dtype(self.height, self.width),
+            buffer=shm.buf, offset=_HEADER_NBYTES)
+        self.seq = self.slots['seq']
+        self.frames = self.slots['frame']
+        self.meta = self.slots['meta']
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def published(self) -> int:
+        return int(self.header['published'])
+
+
+class FrameRing(_Ring):
+    """Single-producer shared-memory ring of the latest frames + metadata.
+
+    Slot k holds frame k % n_slots. Each slot has a seqlock-style sequence
+    number: it is odd while the frame is being copied in and even when it
+    is complete, so readers never block the producer; they check that the
+    sequence was the same before and after their read instead. Created by
+    the capture process and unlinked by close().
+    """
+
+    def __init__(self, name: str, height: int, width: int,
+                 n_slots: int = 64):
+        nbytes = _HEADER_NBYTES + \
+            n_slots * _slot_dtype(height, width).itemsize
+        try:
+            shm = shared_memory.SharedMemory(name, create=True, size=nbytes)
+        except FileExistsError:
+            # left behind by a capture that was killed
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name, create=True, size=nbytes)
+        header = np.ndarray((), dtype=_HEADER_DTYPE, buffer=shm.buf)
+        header[()] = (RING_MAGIC, RING_VERSION, n_slots, height, width,
+                      FRAME_METADATA_DTYPE.itemsize, 0)
+        self._map(shm)
+        self.seq[:] = 0
+
+    def publish(self, frame: np.ndarray, meta):
+        n = self.published()
+        slot = n % self.n_slots
+        self.seq[slot] = 2 * n + 1
+        self.frames[slot] = frame
+        self.meta[slot] = meta
+        self.seq[slot] = 2 * n + 2
+        self.header['published'] = n + 1
+
+    def close(self):
+        del self.header, self.slots, self.seq, self.frames, self.meta
+        self._shm.close()
+        self._shm.unlink()
+
+
+class RingReader(_Ring):
+    """Reads frames from a FrameRing in another process.
+
+    read() copies frame number n out of the ring and returns its metadata,
+    or None if the frame has already been overwritten (or is not there
+    yet). view() is the zero-copy version: use the returned array, then
+    check valid(n) - if it is False the producer overwrote the slot while
+    it was in use. Iterating yields (n, frame, meta) copies of every frame
+    from the newest one on, skipping frames the reader fell too far
+    behind for (counted in overruns).
+    """
+
+    def __init__(self, name: str):
+        self._map(_attach(name))
+        self.overruns = 0
+        self._frame = np.empty((self.height, self.width), dtype=np.uint16)
+
+    def valid(self, n: int) -> bool:
+        return int(self.seq[n % self.n_slots]) == 2 * n + 2
+
+    def view(self, n: int) -> np.ndarray:
+        return self.frames[n % self.n_slots]
+
+    def read(self, n: int, out: np.ndarray = None):
+        if out is None:
+            out = self._frame
+        slot = n % self.n_slots
+        if int(self.seq[slot]) != 2 * n + 2:
+            return None
+        np.copyto(out, self.frames[slot])
+        meta = self.meta[slot].copy()
+        if int(self.seq[slot]) != 2 * n + 2:
+            return None
+        return meta
+
+    def latest(self, out: np.ndarray = None):
+        """(n, meta) of the newest complete frame, copied into out."""
+        n = self.published() - 1
+        while n >= 0:
+            meta = self.read(n, out)
+            if meta is not None:
+                return n, meta
+            n = self.published() - 1
+        return None
+
+    def frames_from(self, n: int, poll: float = 0.005,
+                    timeout: float = None):
+        last_frame = monotonic()
+        while True:
+            published = self.published()
+            if n >= published:
+                if timeout is not None and \
+                        monotonic() - last_frame > timeout:
+                    return
+                sleep(poll)
+                continue
+            if published - n > self.n_slots:
+                self.overruns += published - n - self.n_slots + 1
+                n = published - self.n_slots + 1
+            meta = self.read(n)
+            if meta is None:
+                self.overruns += 1
+            else:
+                last_frame = monotonic()
+                yield n, self._frame, meta
+            n += 1
+
+    def __iter__(self):
+        return self.frames_from(max(self.published() - 1, 0))
+
+    def close(self):
+        del self.header, self.slots, self.seq, self.frames, self.meta
+        self._shm.close()
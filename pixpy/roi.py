@@ -0,0 +1,134 @@
+import re
+from dataclasses import dataclass
+import numpy as np
+
+ROI_STATISTICS = ('mean', 'min', 'max')
+_PERCENTILE = re.compile(r'p(\d+(?:\.\d+)?)$')
+
+
+@dataclass(frozen=True)
+class Roi:
+    name: str
+    index: np.ndarray  # flat pixel indices into a (height, width) frame
+
+
+def _coordinate_range(text: str, n: int) -> np.ndarray:
+    # "a:b" (inclusive) or a single value, in output coordinates 0..n-1
+    start, _, stop = text.partition(':')
+    start = int(start)
+    stop = int(stop) if stop else start
+    if not 0 <= start <= stop < n:
+        raise ValueError(f'ROI range {text} is outside 0:{n - 1}')
+    return np.arange(start, stop + 1)
+
+
+def make_roi(spec: dict, height: int, width: int) -> Roi:
+    """An Roi from a schedule config <roi> element's attributes.
+
+    name and either x and y ranges ("10:40", inclusive, in the x/y
+    coordinates of the output files, where y = 0 is the bottom row) or mask,
+    an .npy boolean array of shape (height, width) laid out like the stored
+    images.
+    """
+    name = spec.get('name')
+    if not name or not re.match(r'\w+$', name):
+        raise ValueError(f'Invalid ROI name {name}')
+    if 'mask' in spec:
+        mask = np.load(spec['mask'])
+        if mask.shape != (height, width):
+            raise ValueError(f'ROI {name} mask is not {height}x{width}')
+        index = np.flatnonzero(mask)
+    else:
+        x = _coordinate_range(spec['x'], width)
+        rows = height - 1 - _coordinate_range(spec['y'], height)
+        index = (rows[:, np.newaxis] * width + x).reshape(-1)
+    if index.size == 0:
+        raise ValueError(f'ROI {name} is empty')
+    return Roi(name, np.sort(index))
+
+
+def parse_roi_statistics(text: str) -> tuple:
+    names = tuple((text or '').replace(',', ' ').split())
+    for name in names:
+        if name not in ROI_STATISTICS and not _PERCENTILE.match(name):
+            raise ValueError(f'Unknown ROI statistic {name}')
+    if not names:
+        raise ValueError('No ROI statistics')
+    return names
+
+
+def roi_row_dtype(statistics: tuple) -> np.dtype:
+    return np.dtype(
+        [('time', float), ('flag_state', np.uint16), ('counterHW', np.uint32)]
+        + [(name, np.float32) for name in statistics])
+
+
+class RoiSeries:
+    """Per-ROI statistics of every frame, reduced block_size frames at a time.
+
+    add() only copies the ROI pixels of a frame into the current block;
+    full blocks are reduced for all ROIs at once with reduceat (mean, min,
+    max) and per-ROI percentiles along the pixel axis. Statistics are in
+    celsius. flush() returns the rows reduced so far as {roi name: rows of
+    roi_row_dtype(statistics)}, or None if there are none. time is in ms
+    since dt_epoch, like the sample files.
+    """
+
+    def __init__(self, rois: list, statistics: tuple = ROI_STATISTICS,
+                 block_size: int = 32, dt_epoch_timestamp: float = 0.0):
+        self.rois = rois
+        self.statistics = statistics
+        self.dt_epoch_timestamp = dt_epoch_timestamp
+        self._index = np.concatenate([roi.index for roi in rois])
+        sizes = np.array([roi.index.size for roi in rois])
+        self._sizes = sizes
+        self._starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        self._values = np.empty((block_size, self._index.size),
+                                dtype=np.uint16)
+        self._row_dtype = roi_row_dtype(statistics)
+        self._rows = np.empty((block_size, len(rois)), dtype=self._row_dtype)
+        self._k = 0
+        self._pending = []
+
+    def add(self, frame: np.ndarray, meta, timestamp: float):
+        k = self._k
+        np.take(frame.reshape(-1), self._index, out=self._values[k])
+        self._rows['time'][k] = \
+            (timestamp - self.dt_epoch_timestamp) * 1000
+        self._rows['flag_state'][k] = meta['flagState']
+        self._rows['counterHW'][k] = meta['counterHW']
+        self._k += 1
+        if self._k == self._values.shape[0]:
+            self._reduce()
+
+    def _reduce(self):
+        k = self._k
+        if k == 0:
+            return
+        values = self._values[:k]
+        rows = self._rows[:k]
+        for name in self.statistics:
+            if name == 'mean':
+                raw = np.add.reduceat(values, self._starts, axis=1,
+                                      dtype=np.int64) / self._sizes
+            elif name == 'min':
+                raw = np.minimum.reduceat(values, self._starts, axis=1)
+            elif name == 'max':
+                raw = np.maximum.reduceat(values, self._starts, axis=1)
+            else:
+                q = float(name[1:])
+                raw = np.stack([
+                    np.percentile(values[:, start:start + size], q, axis=1)
+                    for start, size in zip(self._starts, self._sizes)],
+                    axis=1)
+            rows[name] = (raw - 1000) / 10
+        self._pending.append(rows.copy())
+        self._k = 0
+
+    def flush(self):
+        self._reduce()
+        if not self._pending:
+            return None
+        rows = np.concatenate(self._pending)
+        self._pending = []
+        return {roi.name: rows[:, j] for j, roi in enumerate(self.rois)}
@@ -0,0 +1,201 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from math import inf
+from time import monotonic, sleep
+import os
+import xml.etree.ElementTree as ET
+from pixpy import config
+from pixpy.aggregate import parse_statistics
+from pixpy.pixpy import _EPOCH, SnapshotSchedule
+from pixpy.qos import parse_qos_levels
+from pixpy.quicklook import QUICKLOOK_FORMATS
+from pixpy.rawarchive import RAW_CODECS
+from pixpy.roi import make_roi, parse_roi_statistics
+from pixpy.writer import STORAGE_BACKENDS
+
+
+@dataclass(frozen=True)
+class SampleDeadline:
+    index: int
+    start: datetime
+    end: datetime
+    trigger_monotonic: float
+    start_monotonic: float
+    end_monotonic: float
+
+
+def ceil_datetime(t: datetime, interval: timedelta) -> datetime:
+    # first multiple of interval since the epoch at or after t
+    step = interval // timedelta(microseconds=1)
+    q = -(-((t - _EPOCH) // timedelta(microseconds=1)) // step)
+    return _EPOCH + timedelta(microseconds=q * step)
+
+
+def sleep_until(deadline: float, spin: float = 0.0) -> float:
+    """Sleep until a monotonic deadline, spinning for the last spin seconds.
+
+    Returns the lateness in seconds (negative if woken early).
+    """
+    remaining = deadline - monotonic() - spin
+    if remaining > 0:
+        sleep(remaining)
+    if spin > 0:
+        while monotonic() < deadline:
+            pass
+    return monotonic() - deadline
+
+
+class SampleTimeline:
+    """Every sample deadline of one file interval, planned once.
+
+    Sample k starts at first_start + k * sample_repetition, where the first
+    start is the first SnapshotSchedule.current_sample_start() at least lead
+    away; the shutter is triggered lead before each start. The timeline
+    covers the file interval that the first sample ends in, up to file_end.
+    Wall-clock times are mapped onto the monotonic clock when the timeline
+    is built, so sleeping to each deadline does not drift.
+    """
+
+    def __init__(self, ssched, lead: timedelta = timedelta(0)):
+        wall_now = datetime.utcnow()
+        monotonic_now = monotonic()
+        start = ssched.current_sample_start()
+        while start - wall_now < lead:
+            start += ssched.sample_repetition
+        self.file_end = ceil_datetime(
+            start + ssched.sample_interval, ssched.file_interval)
+        self.deadlines = []
+        while start + ssched.sample_interval <= self.file_end:
+            start_monotonic = monotonic_now + \
+                (start - wall_now).total_seconds()
+            self.deadlines.append(SampleDeadline(
+                index=len(self.deadlines),
+                start=start,
+                end=start + ssched.sample_interval,
+                trigger_monotonic=start_monotonic - lead.total_seconds(),
+                start_monotonic=start_monotonic,
+                end_monotonic=start_monotonic +
+                ssched.sample_interval.total_seconds(),
+            ))
+            start += ssched.sample_repetition
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __iter__(self):
+        return iter(self.deadlines)
+
+
+def snapshot_schedule(schedule_config: dict) -> SnapshotSchedule:
+    return SnapshotSchedule(
+        file_interval=timedelta(seconds=schedule_config['file_interval']),
+        sample_interval=timedelta(seconds=schedule_config['sample_interval']),
+        sample_repetition=timedelta(
+            seconds=schedule_config['sample_repetition']),
+    )
+
+
+class ScheduleWatcher:
+    """The parsed schedule config file, only parsed again when it changes.
+
+    get() costs one stat() while the file's mtime and size stay the same.
+    A changed file is checked by building its SnapshotSchedule (the
+    __post_init__ rules) and everything else image_capture reads from it:
+    storage backend, statistics, ROIs (against image_size(), which returns
+    (width, height) like get_thermal_image_size, if given), qos levels,
+    raw archive codec and quicklook format. If that fails the previous
+    config is kept, so a half-edited file never stops the capture.
+    image_capture calls get() once per file interval, so a change applies
+    from the next file.
+    """
+
+    def __init__(self, config_file: str, image_size=None):
+        self.config_file = config_file
+        self.image_size = image_size
+        self.schedule_config = None
+        self.ssched = None
+        self.version = 0
+        self._stamp = None
+
+    def _read(self):
+        schedule_config = config.read_schedule_config(self.config_file)
+        ssched = snapshot_schedule(schedule_config)
+        if schedule_config['storage_backend'] not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown storage backend "
+                             f"{schedule_config['storage_backend']}")
+        parse_statistics(schedule_config['statistics'])
+        if schedule_config['rois']:
+            parse_roi_statistics(schedule_config['roi_statistics'])
+            if self.image_size is not None:
+                width, height = self.image_size()
+                for spec in schedule_config['rois']:
+                    make_roi(spec, height, width)
+        parse_qos_levels(schedule_config['qos_levels'])
+        if schedule_config['raw_archive'] and \
+                schedule_config['raw_archive_codec'] not in RAW_CODECS:
+            raise ValueError(f"Unknown raw archive codec "
+                             f"{schedule_config['raw_archive_codec']}")
+        if schedule_config['quicklook'] and \
+                schedule_config['quicklook_format'] not in QUICKLOOK_FORMATS:
+            raise ValueError(f"Unknown quicklook format "
+                             f"{schedule_config['quicklook_format']}")
+        return schedule_config, ssched
+
+    def get(self):
+        """(schedule config dict, SnapshotSchedule) of the last valid file."""
+        try:
+            stat = os.stat(self.config_file)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError as e:
+            if self.schedule_config is None:
+                raise ValueError(f'{self.config_file}: {e}') from e
+            return self.schedule_config, self.ssched
+        if stamp == self._stamp:
+            return self.schedule_config, self.ssched
+        self._stamp = stamp
+        try:
+            schedule_config, ssched = self._read()
+        except (OSError, ValueError, KeyError, AttributeError,
+                ET.ParseError) as e:
+            if self.schedule_config is None:
+                raise ValueError(f'{self.config_file}: {e}') from e
+            print(f'keeping the previous schedule config, '
+                  f'{self.config_file} is not valid: {e}')
+            return self.schedule_config, self.ssched
+        if self.schedule_config is not None:
+            changes = [f'{k} {self.schedule_config.get(k)!r} -> {v!r}'
+                       for k, v in schedule_config.items()
+                       if self.schedule_config.get(k) != v]
+            if changes:
+                print('schedule config changed from the next file: ' +
+                      ', '.join(changes))
+        self.schedule_config = schedule_config
+        self.ssched = ssched
+        self.version += 1
+        return schedule_config, ssched
+
+
+class LatencyHistogram:
+    """Counts of achieved minus planned times in fixed buckets (s)."""
+    BOUNDS = (0.0, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+              1.0, inf)
+
+    def __init__(self, bounds: tuple = BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.n = 0
+        self.max = -inf
+
+    def add(self, value: float):
+        for k, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[k] += 1
+                break
+        self.n += 1
+        self.max = max(self.max, value)
+
+    def __repr__(self):
+        buckets = ', '.join(
+            f'<={bound * 1000:g}ms: {count}'
+            for bound, count in zip(self.bounds, self.counts) if count)
+        return f'n={self.n} max={self.max * 1000:.1f}ms [{buckets}]'
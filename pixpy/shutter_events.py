@@ -0,0 +1,67 @@
+from datetime import datetime
+from time import monotonic
+import os
+import socket
+
+SHUTTER_OPEN = 'shutter_open'  # servo -> capture: open and settled
+BURST_DONE = 'burst_done'  # capture -> servo: the shutter may close
+SHUTTER_EVENT_SIDES = ('capture', 'servo')
+
+
+class ShutterEvents:
+    """One end of the event channel between pixpy_app and the servo shutter.
+
+    Each side binds a Unix datagram socket, <base_path>.capture or
+    <base_path>.servo, and sends to the other one. An event names the
+    sample it is about by its scheduled start, so an event left over from
+    an earlier sample is never taken for the current one. send() does not
+    block; an event sent while the other side is not running is lost.
+    """
+
+    def __init__(self, base_path: str, side: str):
+        if side not in SHUTTER_EVENT_SIDES:
+            raise ValueError(f'side must be one of {SHUTTER_EVENT_SIDES}')
+        peer = SHUTTER_EVENT_SIDES[1 - SHUTTER_EVENT_SIDES.index(side)]
+        self.path = f'{base_path}.{side}'
+        self.peer_path = f'{base_path}.{peer}'
+        if os.path.exists(self.path):
+            # left by a process that did not close
+            os.remove(self.path)
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self.path)
+
+    @staticmethod
+    def _message(event: str, sample_start: datetime) -> bytes:
+        return f'{event} {sample_start.isoformat()}'.encode()
+
+    def send(self, event: str, sample_start: datetime) -> bool:
+        try:
+            self._socket.sendto(self._message(event, sample_start),
+                                socket.MSG_DONTWAIT, self.peer_path)
+        except OSError:
+            return False
+        return True
+
+    def wait(self, event: str, sample_start: datetime,
+             timeout: float) -> bool:
+        """Whether event for sample_start arrived within timeout seconds."""
+        expected = self._message(event, sample_start)
+        deadline = monotonic() + timeout
+        while True:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+            self._socket.settimeout(remaining)
+            try:
+                message = self._socket.recv(256)
+            except socket.timeout:
+                return False
+            if message == expected:
+                return True
+
+    def close(self):
+        self._socket.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
@@ -0,0 +1,203 @@
+from datetime import datetime
+from glob import glob
+import json
+import os
+import re
+import shutil
+from threading import Thread
+import traceback
+import numpy as np
+from pixpy.pipeline import StageQueue
+from pixpy.writer import NpySpoolWriter, open_writer
+
+SPOOL_PART_SUFFIX = f'{NpySpoolWriter.extension}.part'
+# in a closed spool that is waiting to be converted (compression deferred by
+# qos); a closed spool without it is finished npy output
+DEFERRED_MARKER = 'deferred'
+
+
+# an output file still being written: sample, ROI and raw archive files
+PART_FILE_NAME = re.compile(
+    r'\d+_\d{14}(_roi_.+\.nc|_raw\.pxr|\.nc|\.h5)\.part$')
+_FILE_TIME_END = re.compile(r'\d+_(\d{14})')
+
+
+def file_time_end(file_path: str) -> datetime:
+    # file names start with {serial}_{file end time} (see app.get_file_name)
+    match = _FILE_TIME_END.match(os.path.basename(file_path))
+    if match is None:
+        raise ValueError(f'{file_path} is not a pixpy output file')
+    return datetime.strptime(match[1], '%Y%m%d%H%M%S')
+
+
+def spool_base_path(spool_path: str) -> str:
+    for suffix in (SPOOL_PART_SUFFIX, NpySpoolWriter.extension):
+        if spool_path.endswith(suffix):
+            return spool_path[:-len(suffix)]
+    raise ValueError(f'{spool_path} is not a spool')
+
+
+def mark_deferred(spool_path: str):
+    open(os.path.join(spool_path, DEFERRED_MARKER), 'w').close()
+
+
+def is_deferred(spool_path: str) -> bool:
+    return os.path.exists(os.path.join(spool_path, DEFERRED_MARKER))
+
+
+def spool_settings(spool_path: str, storage_backend: str = 'netcdf',
+                   compression: str = 'zlib',
+                   compression_level: int = 5) -> tuple:
+    """(storage_backend, compression, compression_level) a spool was meant
+    to be converted with, from its attrs.json; the given ones for spools
+    written before these were kept."""
+    with open(os.path.join(spool_path, 'attrs.json')) as file:
+        header = json.load(file)
+    return (header.get('storage_backend', storage_backend),
+            header.get('compression', compression),
+            header.get('compression_level', compression_level))
+
+
+def convert_spool(spool_path: str, storage_backend: str = 'netcdf',
+                  compression: str = 'zlib', compression_level: int = 5,
+                  remove: bool = True) -> str:
+    """Write the filled rows of an NpySpoolWriter directory to a normal file.
+
+    Returns the path of the new file. The spool is removed afterwards unless
+    remove is False. For the npy backend the spool already is the output
+    file: an unfinished one is only renamed and nothing is rewritten.
+    """
+    if storage_backend == 'npy':
+        file_path = spool_base_path(spool_path) + NpySpoolWriter.extension
+        if spool_path != file_path:
+            if os.path.exists(file_path):
+                shutil.rmtree(file_path)
+            os.replace(spool_path, file_path)
+        if is_deferred(file_path):
+            os.remove(os.path.join(file_path, DEFERRED_MARKER))
+        return file_path
+    with open(os.path.join(spool_path, 'attrs.json')) as file:
+        header = json.load(file)
+    images = np.load(os.path.join(spool_path, 'images.npy'), mmap_mode='r')
+    meta = np.load(os.path.join(spool_path, 'meta.npy'), mmap_mode='r')
+    filled = np.flatnonzero(np.isfinite(meta['time']))
+    writer = open_writer(
+        storage_backend, spool_base_path(spool_path), header['height'],
+        header['width'], max(filled.size, 1),
+        datetime.fromisoformat(header['dt_epoch']), meta.dtype,
+        header['attrs'], compression=compression,
+        compression_level=compression_level, image_dtype=images.dtype)
+    for j in filled:
+        writer.append(images[j], meta[j])
+    writer.close()
+    del images, meta
+    if remove:
+        shutil.rmtree(spool_path)
+    return writer.file_path
+
+
+_STOP = object()
+
+
+class SpoolConverter:
+    """Converts closed spools (see convert_spool) on a background thread.
+
+    submit() only queues the spool, so closing a spooled or deferred file
+    never holds up capture. Conversions are never dropped: stop() waits
+    for the queued ones to finish. A spool whose conversion is cut short
+    is left for recover_spools. on_converted, if given, is called with
+    the path of each new file.
+    """
+
+    def __init__(self, on_converted=None):
+        self.on_converted = on_converted
+        self.queue = StageQueue('conversions', 1, 'block')
+        self._thread = Thread(target=self._run, name='pixpy-convert',
+                              daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.queue.put(_STOP, droppable=False)
+        self._thread.join()
+
+    def submit(self, spool_path: str, storage_backend: str = 'netcdf',
+               compression: str = 'zlib', compression_level: int = 5):
+        self.queue.put((spool_path, storage_backend, compression,
+                        compression_level), droppable=False)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            try:
+                file_path = convert_spool(*item)
+                if self.on_converted is not None:
+                    self.on_converted(file_path)
+            except Exception:
+                traceback.print_exc()
+
+
+def find_unfinished_spools(output_directory: str) -> list:
+    return sorted(glob(os.path.join(output_directory,
+                                    f'*{SPOOL_PART_SUFFIX}')))
+
+
+def find_finished_spools(output_directory: str) -> list:
+    # closed but not yet converted: compression deferred by qos
+    return sorted(p for p in glob(os.path.join(
+        output_directory, f'*{NpySpoolWriter.extension}')) if is_deferred(p))
+
+
+def recover_spools(output_directory: str, storage_backend: str = 'netcdf',
+                   compression: str = 'zlib', compression_level: int = 5,
+                   now: datetime = None) -> list:
+    """Convert spools left behind by a killed capture into normal files.
+
+    Spools whose file interval has not ended yet are left alone so that
+    capture can resume them. Closed spools whose deferred conversion never
+    happened are converted too. Each is converted with the storage backend
+    and compression kept in it (see spool_settings), so a schedule config
+    change in the meantime does not matter. For the npy backend, whose
+    output files are spools, unfinished spools are only renamed (see
+    convert_spool).
+    """
+    if now is None:
+        now = datetime.utcnow()
+    recovered = []
+    for spool_path in find_unfinished_spools(output_directory) + \
+            find_finished_spools(output_directory):
+        if spool_path.endswith(SPOOL_PART_SUFFIX) and \
+                file_time_end(spool_path) > now:
+            continue
+        recovered.append(convert_spool(spool_path, *spool_settings(
+            spool_path, storage_backend, compression, compression_level)))
+    return recovered
+
+
+def finalise_part_files(output_directory: str, now: datetime = None) -> list:
+    """Rename the .part output files of file intervals that have ended.
+
+    A capture that was stopped or killed part way through a file interval
+    leaves its files with a .part suffix so that a restart in the same
+    interval can resume them. Once the interval is over nothing will, so
+    they are given their final names for the archive, compaction and other
+    readers. Returns the new paths.
+    """
+    if now is None:
+        now = datetime.utcnow()
+    finalised = []
+    for part_path in sorted(glob(os.path.join(output_directory, '*.part'))):
+        if not PART_FILE_NAME.search(os.path.basename(part_path)) or \
+                file_time_end(part_path) > now:
+            continue
+        file_path = part_path[:-len('.part')]
+        if os.path.exists(file_path):
+            print(f'not finalising {part_path}: {file_path} exists')
+            continue
+        os.replace(part_path, file_path)
+        finalised.append(file_path)
+    return finalised
@@ -0,0 +1,383 @@
+import json
+import os
+import signal
+import multiprocessing
+from argparse import ArgumentParser
+from datetime import datetime
+from queue import Full
+from dataclasses import dataclass, field, asdict
+from threading import Lock, Thread
+from time import monotonic, sleep, time
+import pixpy
+from pixpy import config, metrics
+
+
+def parse_args(argv=None):
+    parser = ArgumentParser(
+        description='Run one pixpy capture process per camera. Arguments not '
+                    'listed here are passed on to every capture process '
+                    '(see pixpy_app --help).')
+
+    parser.add_argument(
+        '--imager_config_file',
+        type=str,
+        nargs='+',
+        help='One libirimager configuration file (.xml) per camera',
+        required=True,
+        )
+    parser.add_argument(
+        '--schedule_config_file',
+        type=str,
+        help='The image capture schedule file (.xml), common to all cameras',
+        required=True,
+        )
+    parser.add_argument(
+        '--cores',
+        type=int,
+        nargs='+',
+        help='CPU core to pin each capture process to (default: one core '
+             'each, leaving the first core to the supervisor and writer '
+             'when there are enough)',
+        default=None,
+        )
+    parser.add_argument(
+        '--restart_delay',
+        type=float,
+        help='Wait before restarting a capture process that exited (s), '
+             'doubled for each consecutive failure',
+        default=5.0,
+        )
+    parser.add_argument(
+        '--max_restart_delay',
+        type=float,
+        help='Upper bound of the restart wait (s)',
+        default=300.0,
+        )
+    parser.add_argument(
+        '--healthy_runtime',
+        type=float,
+        help='A capture process that ran this long before exiting is '
+             'restarted after restart_delay again (s)',
+        default=600.0,
+        )
+    parser.add_argument(
+        '--queue_size',
+        type=int,
+        help='Samples and other writes queued from the capture processes to '
+             'the writer; a capture process waits while it is full',
+        default=64,
+        )
+    parser.add_argument(
+        '--metrics_port',
+        type=int,
+        help='Serve the metrics of the supervisor and all capture processes '
+             'on http://localhost:<port>/metrics; 0 to disable',
+        default=9464,
+        )
+    parser.add_argument(
+        '--metrics_push_interval',
+        type=float,
+        help='How often each capture process sends its metrics to the '
+             'supervisor (s)',
+        default=5.0,
+        )
+    parser.add_argument(
+        '--status_interval',
+        type=float,
+        help='How often camera status is printed and written to '
+             'pixpy_supervisor.json in the output directory (s)',
+        default=60.0,
+        )
+    return parser.parse_known_args(argv)
+
+
+def default_cores(n_cameras: int) -> list:
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) > n_cameras:
+        cores = cores[1:]
+    return [cores[k % len(cores)] for k in range(n_cameras)]
+
+
+class QueueWriter:
+    """Stand-in for app.SampleWriter that hands writes to the supervisor.
+
+    Writes wait while the supervisor's queue is full; metrics are dropped
+    instead, the next push replaces them anyway. With qos, each write also
+    records the supervisor's write time for the latest sample of all
+    cameras (write_seconds, see WriteTime), which its single writer thread
+    has to fit into one sample repetition.
+    """
+
+    def __init__(self, queue, camera: int, qos=None, write_seconds=None):
+        self.queue = queue
+        self.camera = camera
+        self.qos = qos
+        self.write_seconds = write_seconds
+
+    def __call__(self, item):
+        self.queue.put((self.camera, item))
+        if self.qos is not None and self.write_seconds is not None:
+            self.qos.record('write', sum(self.write_seconds[:]))
+
+    def push_metrics(self, families, snapshot):
+        try:
+            self.queue.put_nowait((self.camera,
+                                   ('metrics', families, snapshot)))
+        except Full:
+            pass
+
+    def close_all(self, now=None):
+        # the supervisor's writers close when it stops
+        pass
+
+
+class WriteTime:
+    """Stand-in for a QosController in the supervisor's SampleWriters.
+
+    Keeps the write time of a camera's latest sample in its slot of a
+    shared array, from which the capture processes' QosControllers read.
+    """
+
+    def __init__(self, write_seconds, camera: int):
+        self.write_seconds = write_seconds
+        self.camera = camera
+
+    def record(self, stage: str, seconds: float, budget: float = None):
+        self.write_seconds[self.camera] = seconds
+
+
+def capture_process(camera: int, core: int, argv: list, queue,
+                    write_seconds=None, metrics_push_interval: float = 5.0):
+    # runs in its own (spawned) process, so the SDK singleton is per camera
+    from pixpy import app
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if core is not None:
+        os.sched_setaffinity(0, {core})
+    app.configure(argv)
+    app.exit_on_sigterm()
+    qos = pixpy.QosController()
+    writer = QueueWriter(queue, camera, qos, write_seconds)
+    push = metrics.MetricsPush(
+        writer.push_metrics, metrics_push_interval).start()
+    try:
+        app.capture_loop(writer, qos)
+    finally:
+        push.stop()
+
+
+@dataclass
+class CameraStatus:
+    imager_config_file: str
+    core: int
+    pid: int = None
+    state: str = 'starting'
+    starts: int = 0
+    failures: int = 0
+    last_exit_code: int = None
+    samples: int = 0
+    files: int = 0
+    last_sample_time: float = None
+    write_errors: int = 0
+    started_monotonic: float = field(default=None, repr=False)
+    restart_monotonic: float = field(default=0.0, repr=False)
+
+
+class Supervisor:
+    """Starts, watches and restarts one capture process per camera.
+
+    Every process runs pixpy.app's capture loop with the common schedule
+    config, so samples of all cameras fall on the same SnapshotSchedule
+    grid. Finished samples are queued back to a single writer thread here,
+    which keeps one app.SampleWriter per camera and shares its write times
+    with the processes for their qos. The processes push their
+    metrics over the same queue, so the supervisor serves the metrics of
+    all cameras and of the writer on one port. A process that exits is
+    restarted on its own backoff: restart_delay doubled for each
+    consecutive failure, up to max_restart_delay.
+    """
+
+    def __init__(self, imager_config_files: list, schedule_config_file: str,
+                 cores: list = None, capture_argv: list = (),
+                 restart_delay: float = 5.0, max_restart_delay: float = 300.0,
+                 healthy_runtime: float = 600.0, queue_size: int = 64,
+                 metrics_port: int = 0, metrics_push_interval: float = 5.0):
+        if cores is None:
+            cores = default_cores(len(imager_config_files))
+        if len(cores) != len(imager_config_files):
+            raise ValueError('Need one core per imager config file')
+        self.schedule_config_file = schedule_config_file
+        self.capture_argv = list(capture_argv)
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.healthy_runtime = healthy_runtime
+        self.cameras = [CameraStatus(f, core)
+                        for f, core in zip(imager_config_files, cores)]
+        self._context = multiprocessing.get_context('spawn')
+        self._queue = self._context.Queue(queue_size)
+        self._write_seconds = self._context.Array('d', len(self.cameras))
+        self.metrics_port = metrics_port
+        self.metrics_push_interval = metrics_push_interval
+        self.metrics = metrics.CombinedMetrics()
+        self._metrics_server = None
+        self._processes = [None] * len(self.cameras)
+        self._writer_thread = None
+        self._lock = Lock()
+
+    def argv(self, camera: int) -> list:
+        return ['--imager_config_file',
+                self.cameras[camera].imager_config_file,
+                '--schedule_config_file', self.schedule_config_file,
+                *self.capture_argv,
+                # served by the supervisor
+                '--metrics_port', '0']
+
+    def start_capture(self, camera: int):
+        status = self.cameras[camera]
+        process = self._context.Process(
+            target=capture_process,
+            args=(camera, status.core, self.argv(camera), self._queue,
+                  self._write_seconds, self.metrics_push_interval),
+            name=f'pixpy-camera-{camera}', daemon=True)
+        process.start()
+        self._processes[camera] = process
+        with self._lock:
+            status.pid = process.pid
+            status.state = 'running'
+            status.starts += 1
+            status.started_monotonic = monotonic()
+        print(f'started {status.imager_config_file} on core {status.core} '
+              f'(pid {process.pid})')
+
+    def check_capture(self, camera: int):
+        status = self.cameras[camera]
+        process = self._processes[camera]
+        now = monotonic()
+        if process is not None and process.is_alive():
+            return
+        if process is not None:
+            process.join()
+            self._processes[camera] = None
+            with self._lock:
+                if now - status.started_monotonic > self.healthy_runtime:
+                    status.failures = 0
+                status.failures += 1
+                status.last_exit_code = process.exitcode
+                status.state = 'waiting'
+                status.pid = None
+                delay = min(
+                    self.restart_delay * 2 ** (status.failures - 1),
+                    self.max_restart_delay)
+                status.restart_monotonic = now + delay
+            print(f'{status.imager_config_file} exited with code '
+                  f'{process.exitcode}, restarting in {delay:.0f} s')
+        if now >= status.restart_monotonic:
+            self.start_capture(camera)
+
+    def _write_worker(self):
+        from pixpy import app
+        writers = {}
+        while True:
+            message = self._queue.get()
+            if message is None:
+                break
+            camera, item = message
+            if item[0] == 'metrics':
+                self.metrics.update(camera, *item[1:])
+                continue
+            status = self.cameras[camera]
+            if camera not in writers:
+                writers[camera] = app.SampleWriter(
+                    WriteTime(self._write_seconds, camera))
+            try:
+                writers[camera](item)
+            except Exception as e:
+                print(f'{status.imager_config_file}: write failed: {e}')
+                with self._lock:
+                    status.write_errors += 1
+                continue
+            with self._lock:
+                if item[0] == 'append':
+                    status.samples += 1
+                    status.last_sample_time = time()
+                elif item[0] == 'close':
+                    status.files += 1
+        for writer in writers.values():
+            writer.close_all(datetime.utcnow())
+
+    def status(self) -> list:
+        with self._lock:
+            return [{k: v for k, v in asdict(status).items()
+                     if not k.endswith('_monotonic')}
+                    for status in self.cameras]
+
+    def write_status(self, output_directory: str):
+        status_path = os.path.join(output_directory, 'pixpy_supervisor.json')
+        with open(f'{status_path}.part', 'w') as file:
+            json.dump({'time': time(), 'cameras': self.status()}, file,
+                      indent=1)
+        os.replace(f'{status_path}.part', status_path)
+
+    def run(self, status_interval: float = 60.0):
+        from pixpy import app
+        schedule_config = config.read_schedule_config(
+            self.schedule_config_file)
+        os.makedirs(schedule_config['output_directory'], exist_ok=True)
+        app.recover(self.schedule_config_file)
+        if self.metrics_port:
+            metrics.METRICS.labels['process'] = 'supervisor'
+            try:
+                self._metrics_server = metrics.MetricsServer(
+                    self.metrics_port, registry=self.metrics).start()
+                print(f'serving metrics on '
+                      f'http://localhost:{self.metrics_port}/metrics')
+            except OSError as e:
+                print(f'could not serve metrics: {e}')
+        self._writer_thread = Thread(
+            target=self._write_worker, name='pixpy-write')
+        self._writer_thread.start()
+        next_status = monotonic()
+        try:
+            while True:
+                for camera in range(len(self.cameras)):
+                    self.check_capture(camera)
+                if monotonic() >= next_status:
+                    for status in self.status():
+                        print(status)
+                    self.write_status(schedule_config['output_directory'])
+                    next_status += status_interval
+                sleep(0.5)
+        finally:
+            self.stop()
+
+    def stop(self):
+        for process in self._processes:
+            if process is not None:
+                process.terminate()
+                process.join()
+        self._processes = [None] * len(self.cameras)
+        if self._writer_thread is not None:
+            self._queue.put(None)
+            self._writer_thread.join()
+            self._writer_thread = None
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
+            self._metrics_server = None
+
+
+def supervisor(argv=None):
+    from pixpy import app
+    args, capture_argv = parse_args(argv)
+    app.exit_on_sigterm()
+    try:
+        Supervisor(
+            args.imager_config_file, args.schedule_config_file,
+            cores=args.cores, capture_argv=capture_argv,
+            restart_delay=args.restart_delay,
+            max_restart_delay=args.max_restart_delay,
+            healthy_runtime=args.healthy_runtime,
+            queue_size=args.queue_size,
+            metrics_port=args.metrics_port,
+            metrics_push_interval=args.metrics_push_interval,
+        ).run(args.status_interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,478 @@
+from datetime import timedelta
+import json
+import os
+import shutil
+import numpy as np
+
+# output variable name: (field in the image/meta sample record, attributes)
+IMAGE_VARIABLES = {
+    't_b_median': ('median', {
+        "units": "celsius",
+        "long_name": "brightness_temperature_median"}),
+    't_b_min': ('min', {
+        "units": "celsius",
+        "long_name": "brightness_temperature_min"}),
+    't_b_max': ('max', {
+        "units": "celsius",
+        "long_name": "brightness_temperature_max"}),
+    't_b_std': ('std', {
+        "units": "celsius",
+        "long_name": "brightness_temperature_standard_deviation"}),
+    't_b_snapshot': ('snapshot', {
+        "units": "celsius",
+        "long_name": "brightness_temperature_snapshot"}),
+}
+# written when requested in the schedule config statistics
+OPTIONAL_IMAGE_VARIABLES = {
+    't_b_mean': ('mean', {
+        "units": "celsius",
+        "long_name": "brightness_temperature_mean"}),
+    't_b_iqr': ('iqr', {
+        "units": "celsius",
+        "long_name": "brightness_temperature_interquartile_range"}),
+}
+
+
+def image_variables(fields: tuple = None) -> dict:
+    """Output image variables for the given image record fields."""
+    if fields is None:
+        return IMAGE_VARIABLES
+    known = {field: (name, attrs) for name, (field, attrs) in
+             {**IMAGE_VARIABLES, **OPTIONAL_IMAGE_VARIABLES}.items()}
+    variables = {}
+    for field in fields:
+        if field in known:
+            name, attrs = known[field]
+        elif field.startswith('p'):
+            name, attrs = f't_b_{field}', {
+                "units": "celsius",
+                "long_name": f"brightness_temperature_percentile_{field[1:]}"}
+        else:
+            name, attrs = f't_b_{field}', {
+                "units": "celsius",
+                "long_name": f"brightness_temperature_{field}"}
+        variables[name] = (field, attrs)
+    return variables
+
+META_VARIABLES = {
+    't_box': ('tbox', {
+        "units": "celsius",
+        "long_name": "temperature_camera_body"}),
+    't_chip': ('tchip', {
+        "units": "celsius",
+        "long_name": "temperature_focal_plane_array_chip"}),
+    'flag_state': ('flag_state', {
+        "long_name": "flag_status"}),
+    'counter': ('counter', {
+        "long_name": "image_counter_from_software"}),
+    'counterHW': ('counterHW', {
+        "long_name": "image_counter_from_hardware"}),
+    'frames': ('fps', {
+        "units": "s-1",
+        "long_name": "frames_per_second"}),
+    'n_images': ('n_images', {
+        "long_name": "number_of_images_in_interval"}),
+    't_cpu': ('tpi', {
+        "long_name": "temperature_raspberry_pi_cpu"}),
+}
+for _var, _field, _long_name in (
+        ('chip', 'tchip', 'temperature_focal_plane_array_chip'),
+        ('box', 'tbox', 'temperature_camera_body'),
+        ('flag', 'tflag', 'temperature_flag')):
+    for _stat in ('min', 'mean', 'max'):
+        META_VARIABLES[f't_{_var}_{_stat}'] = (f'{_field}_{_stat}', {
+            "units": "celsius",
+            "long_name": f"{_long_name}_{_stat}"})
+META_VARIABLES.update({
+    'frames_hw': ('fps_hw', {
+        "units": "s-1",
+        "long_name": "frames_per_second_from_camera_timestamps"}),
+    'dropped_frames': ('dropped_frames', {
+        "long_name": "number_of_frames_skipped_in_counterHW"}),
+    'duplicate_frames': ('duplicate_frames', {
+        "long_name": "number_of_repeated_counterHW_frames"}),
+    'flag_frames': ('flag_frames', {
+        "long_name": "number_of_frames_with_flag_not_open"}),
+    'flag_dropped_frames': ('flag_dropped_frames', {
+        "long_name":
+            "number_of_frames_left_out_with_flag_not_open_and_settled"}),
+    'flag_wait': ('flag_wait', {
+        "units": "ms",
+        "long_name": "shutter_trigger_to_flag_open_and_settled"}),
+    'servo_wait': ('servo_wait', {
+        "units": "ms",
+        "long_name": "scheduled_start_to_servo_shutter_open_and_settled"}),
+    'read_errors': ('read_errors', {
+        "long_name": "frame_reads_that_failed_and_were_recovered"}),
+    'start_lateness': ('start_lateness', {
+        "units": "ms",
+        "long_name": "sample_start_minus_scheduled_start"}),
+    'end_lateness': ('end_lateness', {
+        "units": "ms",
+        "long_name": "sample_end_minus_scheduled_end"}),
+    'qos_level': ('qos_level', {
+        "long_name": "quality_of_service_level"}),
+})
+
+TIME_FILL_VALUE = -999
+
+
+def time_units(dt_epoch) -> str:
+    return dt_epoch.strftime('milliseconds since %Y-%m-%d')
+
+
+def netcdf_compression(compression: str, level: int) -> dict:
+    if compression in (None, 'none'):
+        return {'zlib': False}
+    if compression == 'zlib':
+        return {'zlib': True, 'complevel': level}
+    # other codecs need netCDF4 >= 1.6
+    return {'compression': compression, 'complevel': level}
+
+
+def set_aside_part(part_path: str, base_path: str, extension: str,
+                   dt_epoch, time_ms: np.ndarray) -> str:
+    """Set aside a .part file of this file interval that cannot be resumed.
+
+    Its statistics or image size differ from the current ones, e.g. the
+    schedule config changed before a restart, so the new samples go to a
+    new file. The old one is renamed as a file ending just after its last
+    sample (time_ms since dt_epoch), so that the new file keeps the
+    interval's name, or removed if it has no samples. Returns the new path.
+    """
+    time_ms = time_ms[np.isfinite(time_ms) & (time_ms != TIME_FILL_VALUE)]
+    if time_ms.size == 0:
+        if os.path.isdir(part_path):
+            shutil.rmtree(part_path)
+        else:
+            os.remove(part_path)
+        return None
+    end = dt_epoch + timedelta(milliseconds=float(time_ms.max()))
+    end = end.replace(microsecond=0) + timedelta(seconds=1)
+    serial = os.path.basename(base_path).split('_')[0]
+    file_path = os.path.join(os.path.dirname(base_path),
+                             f'{serial}_{end:%Y%m%d%H%M%S}{extension}')
+    os.replace(part_path, file_path)
+    print(f'{part_path} does not match the current statistics or image '
+          f'size, finished as {file_path}')
+    return file_path
+
+
+class NetCDFWriter:
+    """Appends one aggregated sample at a time to a NetCDF file.
+
+    The file is created as <base_path>.nc.part with an unlimited time
+    dimension and synced after every sample, so a crash leaves a readable
+    partial file (which is resumed if the same file interval is opened
+    again). close() renames it to <base_path>.nc.
+    """
+    extension = '.nc'
+
+    def __init__(self, base_path: str, height: int, width: int,
+                 n_samples: int, dt_epoch, meta_dtype: np.dtype,
+                 attrs: dict, compression: str = 'zlib',
+                 compression_level: int = 5,
+                 image_dtype: np.dtype = None):
+        import netCDF4
+        self.file_path = f'{base_path}{self.extension}'
+        self.part_path = f'{self.file_path}.part'
+        self.image_variables = image_variables(
+            None if image_dtype is None else image_dtype.names)
+        if os.path.exists(self.part_path):
+            ds = netCDF4.Dataset(self.part_path, 'a')
+            images = {name for name, var in ds.variables.items()
+                      if var.dimensions == ('time', 'y', 'x')}
+            if images == set(self.image_variables) and \
+                    set(META_VARIABLES) <= set(ds.variables) and \
+                    (len(ds.dimensions['y']), len(ds.dimensions['x'])) == \
+                    (height, width):
+                self._ds = ds
+                self.n = len(ds.dimensions['time'])
+                return
+            time_ms = np.ma.filled(ds['time'][:], np.nan)
+            ds.close()
+            set_aside_part(self.part_path, base_path, self.extension,
+                           dt_epoch, time_ms)
+        codec = netcdf_compression(compression, compression_level)
+        ds = netCDF4.Dataset(self.part_path, 'w', format='NETCDF4')
+        ds.createDimension('time', None)
+        ds.createDimension('y', height)
+        ds.createDimension('x', width)
+        x = ds.createVariable('x', 'i8', ('x',))
+        x[:] = np.arange(0, width)
+        x.long_name = 'pixels_along_x_axis'
+        y = ds.createVariable('y', 'i8', ('y',))
+        y[:] = np.flip(np.arange(0, height))
+        y.long_name = 'pixels_along_y_axis'
+        time = ds.createVariable(
+            'time', 'f8', ('time',), fill_value=TIME_FILL_VALUE, **codec)
+        time.units = time_units(dt_epoch)
+        time.long_name = 'time'
+        time.standard_name = 'time'
+        for name, (_, var_attrs) in self.image_variables.items():
+            var = ds.createVariable(
+                name, 'u2', ('time', 'y', 'x'), shuffle=True,
+                chunksizes=(1, height, width), **codec)
+            var.setncatts(var_attrs)
+        for name, (field, var_attrs) in META_VARIABLES.items():
+            var = ds.createVariable(name, meta_dtype[field], ('time',))
+            var.setncatts(var_attrs)
+        ds.setncatts(attrs)
+        self._ds = ds
+        self.n = 0
+
+    def append(self, image_row: np.ndarray, meta_row: np.ndarray):
+        ds = self._ds
+        ds['time'][self.n] = meta_row['time']
+        for name, (field, _) in self.image_variables.items():
+            ds[name][self.n, :, :] = image_row[field]
+        for name, (field, _) in META_VARIABLES.items():
+            ds[name][self.n] = meta_row[field]
+        self.n += 1
+        ds.sync()
+
+    def close(self, rename: bool = True):
+        self._ds.close()
+        if rename:
+            os.replace(self.part_path, self.file_path)
+
+
+class H5pyWriter:
+    """Appends samples to an HDF5 file with h5py, bypassing netCDF4.
+
+    Image variables are stored with one (1, height, width) chunk per
+    sample, the shuffle filter and a gzip (zlib) or lzf codec. Variable
+    names and attributes match the NetCDF output.
+    """
+    extension = '.h5'
+    codecs = {'zlib': 'gzip', 'gzip': 'gzip', 'lzf': 'lzf'}
+
+    def __init__(self, base_path: str, height: int, width: int,
+                 n_samples: int, dt_epoch, meta_dtype: np.dtype,
+                 attrs: dict, compression: str = 'zlib',
+                 compression_level: int = 5,
+                 image_dtype: np.dtype = None):
+        import h5py
+        self.file_path = f'{base_path}{self.extension}'
+        self.part_path = f'{self.file_path}.part'
+        self.image_variables = image_variables(
+            None if image_dtype is None else image_dtype.names)
+        if os.path.exists(self.part_path):
+            f = h5py.File(self.part_path, 'a')
+            images = {name for name, var in f.items() if var.ndim == 3}
+            if images == set(self.image_variables) and \
+                    set(META_VARIABLES) <= set(f) and \
+                    all(f[name].shape[1:] == (height, width)
+                        for name in images):
+                self._f = f
+                self.n = f['time'].shape[0]
+                return
+            time_ms = f['time'][:]
+            f.close()
+            set_aside_part(self.part_path, base_path, self.extension,
+                           dt_epoch, time_ms)
+        if compression in (None, 'none'):
+            codec = {}
+        elif compression not in self.codecs:
+            raise ValueError(f'Unsupported h5py compression {compression}')
+        else:
+            codec = {'compression': self.codecs[compression], 'shuffle': True}
+            if codec['compression'] == 'gzip':
+                codec['compression_opts'] = compression_level
+        f = h5py.File(self.part_path, 'w')
+        f['x'] = np.arange(0, width)
+        f['x'].attrs['long_name'] = 'pixels_along_x_axis'
+        f['y'] = np.flip(np.arange(0, height))
+        f['y'].attrs['long_name'] = 'pixels_along_y_axis'
+        time = f.create_dataset('time', shape=(0,), maxshape=(None,),
+                                dtype='f8', chunks=(max(n_samples, 1),))
+        time.attrs['units'] = time_units(dt_epoch)
+        time.attrs['long_name'] = 'time'
+        time.attrs['standard_name'] = 'time'
+        for name, (_, var_attrs) in self.image_variables.items():
+            var = f.create_dataset(
+                name, shape=(0, height, width), maxshape=(None, height, width),
+                dtype='u2', chunks=(1, height, width), **codec)
+            var.attrs.update(var_attrs)
+        for name, (field, var_attrs) in META_VARIABLES.items():
+            var = f.create_dataset(
+                name, shape=(0,), maxshape=(None,), dtype=meta_dtype[field],
+                chunks=(max(n_samples, 1),))
+            var.attrs.update(var_attrs)
+        f.attrs.update(attrs)
+        self._f = f
+        self.n = 0
+
+    def append(self, image_row: np.ndarray, meta_row: np.ndarray):
+        f = self._f
+        f['time'].resize((self.n + 1,))
+        f['time'][self.n] = meta_row['time']
+        for name, (field, _) in self.image_variables.items():
+            f[name].resize(self.n + 1, axis=0)
+            f[name][self.n] = image_row[field]
+        for name, (field, _) in META_VARIABLES.items():
+            f[name].resize((self.n + 1,))
+            f[name][self.n] = meta_row[field]
+        self.n += 1
+        f.flush()
+
+    def close(self, rename: bool = True):
+        self._f.close()
+        if rename:
+            os.replace(self.part_path, self.file_path)
+
+
+class NpySpoolWriter:
+    """Writes samples uncompressed into preallocated memory-mapped .npy files.
+
+    <base_path>.spool.part/ holds images.npy and meta.npy, sized for
+    n_samples, plus attrs.json. Rows not yet written have a NaN time. The
+    directory is renamed to <base_path>.spool on close. attrs.json also
+    keeps the storage backend the spool is to be converted to (convert_to)
+    and its compression, so that recovery converts it as it was meant to.
+    """
+    extension = '.spool'
+
+    def __init__(self, base_path: str, height: int, width: int,
+                 n_samples: int, dt_epoch, meta_dtype: np.dtype,
+                 attrs: dict, compression: str = None,
+                 compression_level: int = 0,
+                 image_dtype: np.dtype = None, convert_to: str = 'npy'):
+        self.file_path = f'{base_path}{self.extension}'
+        self.part_path = f'{self.file_path}.part'
+        images_path = os.path.join(self.part_path, 'images.npy')
+        meta_path = os.path.join(self.part_path, 'meta.npy')
+        if image_dtype is None:
+            image_dtype = np.dtype(
+                [(field, np.uint16) for field, _ in IMAGE_VARIABLES.values()])
+        if os.path.exists(self.part_path):
+            self.images = np.load(images_path, mmap_mode='r+')
+            self.meta = np.load(meta_path, mmap_mode='r+')
+            if self.images.dtype == image_dtype and \
+                    self.meta.dtype == meta_dtype and \
+                    self.images.shape[1:] == (height, width):
+                self.n = int(np.count_nonzero(
+                    np.isfinite(self.meta['time'])))
+                return
+            time_ms = np.array(self.meta['time'])
+            del self.images, self.meta
+            # left unfinished under its new name for recover_spools
+            set_aside_part(self.part_path, base_path,
+                           f'{self.extension}.part', dt_epoch, time_ms)
+        os.makedirs(self.part_path)
+        with open(os.path.join(self.part_path, 'attrs.json'), 'w') as file:
+            json.dump({
+                'attrs': attrs,
+                'time_units': time_units(dt_epoch),
+                'dt_epoch': dt_epoch.isoformat(),
+                'height': height,
+                'width': width,
+                'storage_backend': convert_to,
+                'compression': compression,
+                'compression_level': compression_level,
+            }, file, default=str)
+        self.images = np.lib.format.open_memmap(
+            images_path, mode='w+', dtype=image_dtype,
+            shape=(n_samples, height, width))
+        self.meta = np.lib.format.open_memmap(
+            meta_path, mode='w+', dtype=meta_dtype, shape=(n_samples,))
+        self.meta['time'] = np.nan
+        self.n = 0
+
+    def append(self, image_row: np.ndarray, meta_row: np.ndarray):
+        if self.n == self.images.shape[0]:
+            raise ValueError(f'{self.file_path} is full')
+        for field in self.images.dtype.names:
+            self.images[field][self.n] = image_row[field]
+        self.meta[self.n] = meta_row
+        self.n += 1
+
+    def close(self, rename: bool = True):
+        self.images.flush()
+        self.meta.flush()
+        del self.images, self.meta
+        if not rename:
+            return
+        if os.path.exists(self.file_path):
+            shutil.rmtree(self.file_path)
+        os.replace(self.part_path, self.file_path)
+
+
+# roi row field: output variable, where not t_b_<statistic>
+ROI_VARIABLES = {
+    'time': 'time',
+    'flag_state': 'flag_state',
+    'counterHW': 'counterHW',
+}
+
+
+class RoiWriter:
+    """Appends blocks of per-frame ROI statistics to a NetCDF time series.
+
+    One file per ROI and file interval, <base_path>_roi_<name>.nc, with a
+    .part suffix until closed like NetCDFWriter.
+    """
+    extension = '.nc'
+
+    def __init__(self, base_path: str, name: str, row_dtype: np.dtype,
+                 dt_epoch, attrs: dict, compression: str = 'zlib',
+                 compression_level: int = 5):
+        import netCDF4
+        self.file_path = f'{base_path}_roi_{name}{self.extension}'
+        self.part_path = f'{self.file_path}.part'
+        if os.path.exists(self.part_path):
+            self._ds = netCDF4.Dataset(self.part_path, 'a')
+            self.n = len(self._ds.dimensions['time'])
+            return
+        codec = netcdf_compression(compression, compression_level)
+        ds = netCDF4.Dataset(self.part_path, 'w', format='NETCDF4')
+        ds.createDimension('time', None)
+        time = ds.createVariable(
+            'time', 'f8', ('time',), fill_value=TIME_FILL_VALUE, **codec)
+        time.units = time_units(dt_epoch)
+        time.long_name = 'time'
+        time.standard_name = 'time'
+        for field in row_dtype.names:
+            if field == 'time':
+                continue
+            var = ds.createVariable(
+                ROI_VARIABLES.get(field, f't_b_{field}'), row_dtype[field],
+                ('time',), **codec)
+            if field in ROI_VARIABLES:
+                var.long_name = META_VARIABLES[ROI_VARIABLES[field]][1][
+                    'long_name']
+            else:
+                var.units = 'celsius'
+                var.long_name = f'roi_brightness_temperature_{field}'
+        ds.setncatts({**attrs, 'roi': name})
+        self._ds = ds
+        self.n = 0
+
+    def append(self, rows: np.ndarray):
+        ds = self._ds
+        n = self.n + rows.shape[0]
+        for field in rows.dtype.names:
+            ds[ROI_VARIABLES.get(field, f't_b_{field}')][self.n:n] = \
+                rows[field]
+        self.n = n
+        ds.sync()
+
+    def close(self, rename: bool = True):
+        self._ds.close()
+        if rename:
+            os.replace(self.part_path, self.file_path)
+
+
+STORAGE_BACKENDS = {
+    'netcdf': NetCDFWriter,
+    'h5py': H5pyWriter,
+    'npy': NpySpoolWriter,
+}
+
+
+def open_writer(storage_backend: str, *args, **kwargs):
+    try:
+        writer_class = STORAGE_BACKENDS[storage_backend]
+    except KeyError:
+        raise ValueError(f'Unknown storage backend {storage_backend}')
+    return writer_class(*args, **kwargs)
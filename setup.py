@@ -10,7 +10,6 @@ setup(
     ],
     install_requires=[
         'numpy',
-        'pandas',
         'xarray',
         'netCDF4',
         'gpiozero',
@@ -20,6 +19,8 @@ setup(
     entry_points={
         'console_scripts': [
             'pixpy_app=pixpy.app:app',
+            'pixpy_supervisor=pixpy.supervisor:supervisor',
+            'pixpy_compact=pixpy.compact:compact',
         ]
     },
     license='MIT',
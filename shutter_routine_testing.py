@@ -4,14 +4,13 @@ Created on Sun Jul 17 12:55:27 2022
 
 @author: willm
 """
-from pixpy import SnapshotSchedule
-import config
+from pixpy import (SnapshotSchedule, SampleTimeline, ShutterEvents,
+                   SHUTTER_OPEN, BURST_DONE, sleep_until, config)
 from datetime import timedelta, datetime as dt
 from time import sleep
 from dataclasses import dataclass
 from argparse import ArgumentParser
 from gpiozero import Servo
-from gpiozero.pins.pigpio import PiGPIOFactory
 
 
 def app_config():
@@ -25,11 +24,24 @@ def app_config():
         default=1,
     )
     parser.add_argument(
-        '--grace_time',
+        '--socket',
+        type=str,
+        help='Base path of the event sockets shared with pixpy_app '
+             '(pixpy_app --servo_socket)',
+        default='/tmp/pixpy_shutter',
+    )
+    parser.add_argument(
+        '--burst_timeout',
         type=float,
-        help='Extra delays to give the schedule, to account for any inconsistencies in time syncing',
-        required=False,
-        default=1,
+        help='Close the shutter if pixpy_app has not reported the burst '
+             'done this long after the sample end (s)',
+        default=2,
+    )
+    parser.add_argument(
+        '--mock_pins',
+        action='store_true',
+        help='Use gpiozero mock pins instead of pigpio, to test without a '
+             'servo',
     )
     parser.add_argument(
         '--schedule_config_file',
@@ -62,7 +74,12 @@ def app_config():
         default=20,
     )
     args = parser.parse_args()
-    factory = PiGPIOFactory()
+    if args.mock_pins:
+        from gpiozero.pins.mock import MockFactory, MockPWMPin
+        factory = MockFactory(pin_class=MockPWMPin)
+    else:
+        from gpiozero.pins.pigpio import PiGPIOFactory
+        factory = PiGPIOFactory()
     servo = Servo(args.servo_pin, pin_factory=factory,
                   min_pulse_width=args.min_pulse_width / 1000,
                   max_pulse_width=args.max_pulse_width / 1000,
@@ -74,16 +91,15 @@ def app_config():
 @dataclass(frozen=True)  # todo: docstr
 class ShutterSnapshotSchedule(SnapshotSchedule):
     servo_move_time: timedelta = timedelta(seconds=1)
-    grace_time: timedelta = timedelta(seconds=1)
-
-    def total_grace_time(self):
-        return self.servo_move_time + self.grace_time
 
     def __post_init__(self):
-        if (self.total_grace_time() * 2) >= self.sample_repetition:
+        super().__post_init__()
+        # the shutter closes after each burst and opens before the next
+        if (self.servo_move_time * 2) >= \
+                self.sample_repetition - self.sample_interval:
             raise ValueError(
-                'Servo takes longer to move than the sample repetition. \
-                    Slow the sample repetition or reduce the servo grace time')
+                'Servo takes longer to close and open than the time between '
+                'samples. Slow the sample repetition')
 
 
 def shutter_open():
@@ -96,26 +112,23 @@ def shutter_close():
     servo.mid()
 
 
-def activate_shutter(ssched):
-    time_now = dt.utcnow()
-    next_sample = ssched.current_sample_start()
-    time_until_next_sample = (next_sample - time_now).total_seconds() - \
-        ssched.total_grace_time().total_seconds()
-    if time_until_next_sample < 0:
-        sleep(0.5)
-        return None
-    sleep(time_until_next_sample)
-    print(
-        f"Doing interval {ssched.current_sample_start()} -\ {ssched.current_sample_end()}")
+def activate_shutter(ssched, deadline, events, burst_timeout):
+    # open servo_move_time before the sample start, tell pixpy_app once the
+    # shutter has moved and close as soon as the burst is done
+    sleep_until(deadline.trigger_monotonic)
+    print(f"Doing interval {deadline.start} - {deadline.end}")
     shutter_open()
-    time_until_sample_finished = ssched.sample_interval.total_seconds() +\
-        ssched.total_grace_time().total_seconds() +\
-        ssched.grace_time.total_seconds()
-    sleep(time_until_sample_finished)
+    sleep(ssched.servo_move_time.total_seconds())
+    events.send(SHUTTER_OPEN, deadline.start)
+    if not events.wait(BURST_DONE, deadline.start,
+                       ssched.servo_move_time.total_seconds() +
+                       ssched.sample_interval.total_seconds() +
+                       burst_timeout):
+        print(f"No burst done from pixpy_app for {deadline.start}")
     shutter_close()
 
 
-def external_shutter_app(args, servo):
+def external_shutter_app(args, servo, events):
     schedule_config = config.read_schedule_config(args.schedule_config_file)
     ssched = ShutterSnapshotSchedule(
         file_interval=timedelta(seconds=schedule_config['file_interval']),
@@ -123,21 +136,19 @@ def external_shutter_app(args, servo):
         sample_repetition=timedelta(
             seconds=schedule_config['sample_repetition']),
         servo_move_time=timedelta(seconds=args.servo_move_time),
-        grace_time=timedelta(seconds=args.grace_time),
     )
-    sample_timesteps_remaining = ssched.sample_timesteps_remaining()
-    if sample_timesteps_remaining < 0:
-        print("No timesteps")
-        return None
-    for i in range(0, sample_timesteps_remaining):
-        activate_shutter(ssched)
+    timeline = SampleTimeline(ssched, lead=ssched.servo_move_time)
+    for deadline in timeline:
+        activate_shutter(ssched, deadline, events, args.burst_timeout)
 
 
 if __name__ == "__main__":
     args, servo = app_config()
+    events = ShutterEvents(args.socket, 'servo')
+    print(f"Shutter events on {events.path}")
     while True:
         try:
-            external_shutter_app(args, servo)
+            external_shutter_app(args, servo, events)
         except ValueError as e:
             print(e)
             sleep(5)
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta
+import os
+import numpy as np
+import pytest
+from pixpy.app import preallocate_image_timeseries, preallocate_meta_timeseries
+
+DAY = datetime(2020, 1, 1)
+
+
+@pytest.fixture
+def write_sample_file():
+    """Writes a finished NetCDF output file like pixpy_app's, with samples
+    at the given seconds after DAY; returns its path."""
+    pytest.importorskip('netCDF4')
+    from pixpy.writer import NetCDFWriter
+
+    def write(directory, seconds, serial=123, file_end=None, height=6,
+              width=8, counter_start=0):
+        if file_end is None:
+            file_end = DAY + timedelta(seconds=max(seconds) + 1)
+        base_path = os.path.join(str(directory),
+                                 f'{serial}_{file_end:%Y%m%d%H%M%S}')
+        images = preallocate_image_timeseries(height, width, len(seconds))
+        meta = preallocate_meta_timeseries(len(seconds))
+        meta[:] = 0
+        meta['time'] = np.asarray(seconds, dtype=float) * 1000
+        meta['counter'] = counter_start + np.arange(len(seconds))
+        writer = NetCDFWriter(base_path, height, width, len(seconds), DAY,
+                              meta.dtype, {'serial': serial})
+        for j, (image_row, meta_row) in enumerate(zip(images, meta)):
+            for field in images.dtype.names:
+                image_row[field] = 1000 + 10 * seconds[j]
+            writer.append(image_row, meta_row)
+        writer.close()
+        return writer.file_path
+    return write
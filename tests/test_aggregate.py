@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+from pixpy.aggregate import StreamingAggregator
+
+
+def aggregate(frames, **kwargs):
+    aggregator = StreamingAggregator(*frames.shape[1:], **kwargs)
+    aggregator.reset()
+    for frame in frames:
+        aggregator.update(frame)
+    return aggregator
+
+
+def trim_mean(frames, proportion):
+    cut = int(proportion * frames.shape[0])
+    return np.sort(frames, axis=0)[cut:frames.shape[0] - cut].mean(axis=0)
+
+
+def scene_frames(n=31, height=12, width=16, noise=5.0, seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    scene = 1200 + 40 * np.sin(xx / 3) * np.cos(yy / 4)
+    return (scene + rng.normal(0, noise, (n, height, width))).astype(
+        np.uint16)
+
+
+@pytest.mark.parametrize('n', [1, 2, 31, 32])
+def test_median_matches_numpy(n):
+    frames = scene_frames(n)
+    aggregator = aggregate(frames)
+    assert aggregator.clamped_pixels == 0
+    np.testing.assert_array_equal(aggregator.median(),
+                                  np.median(frames, axis=0))
+
+
+@pytest.mark.parametrize('q', [0, 10, 25, 75, 90, 100])
+def test_percentile_matches_numpy(q):
+    frames = scene_frames(20)
+    np.testing.assert_allclose(aggregate(frames).percentile(q),
+                               np.percentile(frames, q, axis=0))
+
+
+def test_outlier_first_frame():
+    # taken with the flag closing: far from the scene in every pixel
+    frames = scene_frames(31)
+    frames[0] = 2500
+    aggregator = aggregate(frames)
+    assert aggregator.clamped_pixels == frames[0].size
+    # the window moved to the scene: only the first frame is kept aside
+    assert aggregator.outside_count == frames[0].size
+    np.testing.assert_array_equal(aggregator.median(),
+                                  np.median(frames, axis=0))
+    np.testing.assert_allclose(aggregator.percentile(90),
+                               np.percentile(frames, 90, axis=0))
+    np.testing.assert_allclose(aggregator.trimmed_mean(0.1),
+                               trim_mean(frames, 0.1))
+
+
+@pytest.mark.parametrize('bin_width', [2, 3])
+def test_outlier_first_frame_wide_bins(bin_width):
+    frames = scene_frames(31)
+    frames[0] = 2500
+    aggregator = aggregate(frames, median_bin_width=bin_width)
+    assert aggregator.outside_count == frames[0].size
+    np.testing.assert_allclose(aggregator.median(),
+                               np.median(frames, axis=0), atol=bin_width)
+
+
+def test_spread_pixels_are_not_recentred_every_frame(monkeypatch):
+    # pixels that swing further than the window in every frame
+    frames = scene_frames(64)
+    frames[::2] -= 1000
+    calls = []
+    recentre = StreamingAggregator._recentre
+    monkeypatch.setattr(StreamingAggregator, '_recentre',
+                        lambda self: calls.append(recentre(self)))
+    aggregator = aggregate(frames)
+    assert 0 < len(calls) <= 6
+    np.testing.assert_array_equal(aggregator.median(),
+                                  np.median(frames, axis=0))
+
+
+def test_outliers_in_some_pixels():
+    frames = scene_frames(16)
+    frames[5, 2, 3] = 0
+    frames[9, 7, 1] = 65535
+    frames[10:, 4, 4] += 1000
+    aggregator = aggregate(frames)
+    assert aggregator.clamped_pixels == 3
+    np.testing.assert_array_equal(aggregator.median(),
+                                  np.median(frames, axis=0))
+
+
+def test_trimmed_mean_with_outliers():
+    frames = scene_frames(20)
+    frames[0, :6] = 3000
+    np.testing.assert_allclose(aggregate(frames).trimmed_mean(0.1),
+                               trim_mean(frames, 0.1))
+
+
+def test_reset_forgets_outliers():
+    aggregator = StreamingAggregator(12, 16)
+    outlier = scene_frames(8)
+    outlier[0] = 2500
+    for frames in (outlier, scene_frames(8, seed=1)):
+        aggregator.reset()
+        for frame in frames:
+            aggregator.update(frame)
+        np.testing.assert_array_equal(aggregator.median(),
+                                      np.median(frames, axis=0))
+    assert aggregator.clamped_pixels == 0
+
+
+def test_exact_statistics():
+    frames = scene_frames(10)
+    aggregator = aggregate(frames)
+    np.testing.assert_array_equal(aggregator.min(), frames.min(axis=0))
+    np.testing.assert_array_equal(aggregator.max(), frames.max(axis=0))
+    np.testing.assert_allclose(aggregator.mean(), frames.mean(axis=0))
+    np.testing.assert_allclose(aggregator.std(), frames.std(axis=0))
+    np.testing.assert_array_equal(aggregator.snapshot(), frames[-1])
@@ -0,0 +1,62 @@
+from datetime import timedelta
+import numpy as np
+import pytest
+from conftest import DAY
+from pixpy.archive import ArchiveIndex, open_archive, parse_file_name
+from pixpy.compact import compact_day, daily_file_name
+
+
+def five_minute_files(directory, write_sample_file):
+    # two files of 5 samples each, 2 s apart
+    return [write_sample_file(directory, list(range(start, start + 10, 2)),
+                              counter_start=start)
+            for start in (0, 10)]
+
+
+def test_parse_file_name():
+    assert parse_file_name('/d/123_20200101000500.nc') == \
+        (123, DAY + timedelta(minutes=5))
+    assert parse_file_name('123_20200101.nc') == (123, DAY + timedelta(1))
+    assert parse_file_name('123_20200101000500_roi_wall.nc') is None
+
+
+def test_select_window_and_decode(tmp_path, write_sample_file):
+    five_minute_files(tmp_path, write_sample_file)
+    selection = open_archive(str(tmp_path), 123,
+                             start=DAY + timedelta(seconds=4),
+                             end=DAY + timedelta(seconds=14),
+                             x=(1, 3), y=(0, 1))
+    expected_s = np.arange(4, 15, 2)
+    np.testing.assert_array_equal(
+        selection.time, np.datetime64('2020-01-01') +
+        expected_s.astype('timedelta64[s]'))
+    median = selection['t_b_median']
+    assert median.shape == (expected_s.size, 2, 3)
+    # raw 1000 + 10 * s is s degrees celsius
+    np.testing.assert_array_equal(median[:, 0, 0], expected_s)
+    np.testing.assert_array_equal(np.asarray(median)[2:4],
+                                  median[2:4])
+
+
+def test_index_is_cached(tmp_path, write_sample_file):
+    five_minute_files(tmp_path, write_sample_file)
+    assert ArchiveIndex(str(tmp_path)).refresh() == 0
+    index = ArchiveIndex(str(tmp_path), refresh=False)
+    assert len(index.files) == 2 and index.serials() == [123]
+    with pytest.raises(ValueError):
+        index.select(456)
+
+
+def test_compacted_files_replace_their_sources(tmp_path, write_sample_file):
+    file_paths = five_minute_files(tmp_path, write_sample_file)
+    # a third file that was not compacted, overlapping the second
+    write_sample_file(tmp_path, [18, 20, 22], counter_start=18,
+                      file_end=DAY + timedelta(seconds=30))
+    daily = tmp_path / 'daily'
+    daily.mkdir()
+    compact_day(file_paths, str(daily / daily_file_name(123, DAY.date())))
+    selection = open_archive(str(tmp_path), 123)
+    seconds = (selection.time - np.datetime64('2020-01-01')) / \
+        np.timedelta64(1, 's')
+    np.testing.assert_array_equal(seconds, np.arange(0, 23, 2))
+    np.testing.assert_array_equal(selection['t_b_median'][:, 0, 0], seconds)
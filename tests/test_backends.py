@@ -0,0 +1,173 @@
+from time import sleep
+import numpy as np
+import pytest
+from pixpy.backends import ReplayBackend, SyntheticBackend, make_backend
+from pixpy.pixpy import (FRAME_METADATA_DTYPE, FlagState, SDKBackend,
+                         ShutterMode)
+
+IMAGER_CONFIG = '''<?xml version="1.0" encoding="UTF-8"?>
+<imager><serial>12080103</serial><framerate>16.0</framerate></imager>
+'''
+
+
+class Reader:
+    """Reads frames from a backend into numpy arrays."""
+
+    def __init__(self, backend):
+        self.read = backend.frame_reader(backend.width, backend.height)
+        self.frame = np.empty((backend.height, backend.width), np.uint16)
+        self.meta = np.zeros(1, dtype=FRAME_METADATA_DTYPE)
+
+    def __call__(self):
+        code = self.read(self.frame.ctypes.data, self.meta.ctypes.data)
+        return code, self.frame.copy(), self.meta[0].copy()
+
+
+def test_synthetic_reads_the_imager_config(tmp_path):
+    (tmp_path / 'imager.xml').write_text(IMAGER_CONFIG)
+    backend = SyntheticBackend(width=8, height=6)
+    assert backend.get_serial() == 0
+    backend.usb_init(str(tmp_path / 'imager.xml'))
+    assert (backend.get_serial(), backend.fps) == (12080103, 16.0)
+    assert backend.get_thermal_image_size() == (8, 6)
+    backend.terminate()
+    assert backend.get_serial() == 0
+    assert Reader(backend)()[0] == -1
+
+
+def test_synthetic_frames():
+    backend = SyntheticBackend(width=8, height=6, fps=0, serial=1,
+                               scene_temperature=25.0)
+    backend.usb_init('')
+    read = Reader(backend)
+    codes, frames, meta = zip(*[read() for _ in range(4)])
+    assert codes == (0, 0, 0, 0)
+    # raw celsius * 10 + 1000 around the scene temperature
+    assert all(abs(frame.mean() - 1250) < 60 for frame in frames)
+    assert [m['counter'] for m in meta] == [1, 2, 3, 4]
+    assert [m['counterHW'] for m in meta] == [0, 1, 2, 3]
+    assert all(m['flagState'] == FlagState.OPEN.value for m in meta)
+    with pytest.raises(ValueError):
+        backend.frame_reader(6, 8)
+
+
+def test_synthetic_clock_skips_frames_for_a_slow_reader():
+    backend = SyntheticBackend(width=8, height=6, fps=100, serial=1)
+    backend.usb_init('')
+    read = Reader(backend)
+    first = read()[2]['counterHW']
+    sleep(0.1)
+    # the camera kept running: about 10 frames were missed
+    assert read()[2]['counterHW'] - first >= 5
+
+
+def test_synthetic_flag_cycle():
+    backend = SyntheticBackend(width=8, height=6, fps=0, serial=1,
+                               scene_temperature=25.0, flag_duration=0.3)
+    backend.usb_init('')
+    read = Reader(backend)
+    backend.trigger_shutter_flag()
+    _, frame, meta = read()
+    assert meta['flagState'] != FlagState.OPEN.value
+    # frames taken with the flag closed show the flag temperature
+    assert abs(frame.mean() - (1000 + 10 * meta['tempFlag'])) < 10
+    sleep(0.35)
+    assert read()[2]['flagState'] == FlagState.OPEN.value
+
+
+def test_synthetic_auto_flag():
+    backend = SyntheticBackend(width=8, height=6, fps=1000, serial=1,
+                               flag_interval=0.05, flag_duration=0.01)
+    backend.usb_init('')
+    backend.set_shutter_mode(ShutterMode.AUTO.value)
+    read = Reader(backend)
+    states = {int(read()[2]['flagState']) for _ in range(200)}
+    assert FlagState.OPEN.value in states and len(states) > 1
+
+
+def test_synthetic_glitches():
+    backend = SyntheticBackend(width=8, height=6, fps=0, serial=1,
+                               glitch_interval=0.05, glitch_frames=2)
+    backend.usb_init('')
+    read = Reader(backend)
+    assert read()[0] == 0
+    sleep(0.06)
+    assert [read()[0] for _ in range(3)] == [-1, -1, 0]
+
+
+def test_replay(tmp_path, write_sample_file):
+    file_paths = [write_sample_file(tmp_path, [0, 2, 4]),
+                  write_sample_file(tmp_path, [6, 8], counter_start=3)]
+    backend = ReplayBackend(file_paths[::-1], speed=0, loop=False)
+    assert (backend.serial, backend.fps) == (123, 32.0)
+    backend.usb_init('')
+    read = Reader(backend)
+    frames = []
+    while True:
+        code, frame, meta = read()
+        if code != 0:
+            break
+        frames.append(frame)
+        assert meta['counter'] == len(frames)
+    # in name order, i.e. time order
+    assert [int(frame[0, 0]) for frame in frames] == \
+        [1000 + 10 * s for s in (0, 2, 4, 6, 8)]
+
+
+def test_replay_loops_and_cycles_the_flag(tmp_path, write_sample_file):
+    file_path = write_sample_file(tmp_path, [0, 2])
+    backend = ReplayBackend(file_path, speed=0, flag_duration=0.2)
+    backend.usb_init('')
+    read = Reader(backend)
+    values = [int(read()[1][0, 0]) for _ in range(5)]
+    assert values == [1000, 1020, 1000, 1020, 1000]
+    backend.trigger_shutter_flag()
+    assert read()[2]['flagState'] != FlagState.OPEN.value
+    sleep(0.25)
+    assert read()[2]['flagState'] == FlagState.OPEN.value
+
+
+def test_make_backend():
+    backend = make_backend('synthetic', width=8, height=6)
+    assert isinstance(backend, SyntheticBackend)
+    with pytest.raises(ValueError):
+        make_backend('gige')
+    with pytest.raises(ValueError):
+        ReplayBackend([])
+
+
+def test_palette_images(tmp_path, write_sample_file):
+    synthetic = SyntheticBackend(width=8, height=6, fps=0, serial=1)
+    replay = ReplayBackend(write_sample_file(tmp_path, [0, 2]), speed=0)
+    for backend in (synthetic, replay):
+        backend.usb_init('')
+        assert backend.get_palette_image_size() == (8, 6)
+        before = backend.get_palette_image(8, 6)
+        assert before.shape == (6, 8, 3) and before.dtype == np.uint8
+        Reader(backend)()
+        assert backend.get_palette_image(8, 6).shape == (6, 8, 3)
+        with pytest.raises(ValueError):
+            backend.get_palette_image(6, 8)
+
+
+class PaletteLibrary:
+    """Fails evo_irimager_get_palette_image until the n_fails+1th call."""
+
+    def __init__(self, n_fails):
+        self.n_fails = n_fails
+        self.calls = 0
+
+    def evo_irimager_get_palette_image(self, w, h, data):
+        self.calls += 1
+        return -1 if self.calls <= self.n_fails else 0
+
+
+def test_sdk_palette_image_retries_then_gives_up():
+    backend = SDKBackend.__new__(SDKBackend)
+    backend.lib = PaletteLibrary(2)
+    image = backend.get_palette_image(8, 6, retry_time=0)
+    assert image.shape == (6, 8, 3) and backend.lib.calls == 3
+    backend.lib = PaletteLibrary(100)
+    with pytest.raises(RuntimeError):
+        backend.get_palette_image(8, 6, n_retries=3, retry_time=0)
+    assert backend.lib.calls == 4
@@ -0,0 +1,90 @@
+from datetime import timedelta
+import os
+import numpy as np
+import pytest
+from conftest import DAY
+from pixpy.compact import (check_samples, compact, compact_day,
+                           daily_file_name, find_days)
+
+
+def test_check_samples():
+    time_ms = np.array([0, 2000, 2000, 4000, 6000, 12000, 14000], float)
+    # a capture restart resets the counter, so only neighbours are compared
+    counter = np.array([0, 1, 1, 2, 2, 0, 1])
+    index, n_duplicates, gaps = check_samples(time_ms, counter)
+    np.testing.assert_array_equal(index, [0, 1, 3, 5, 6])
+    assert n_duplicates == 2
+    assert gaps == [(4000.0, 8000.0)]
+
+
+def test_check_samples_sorts_by_time():
+    time_ms = np.array([4000, 0, 2000], float)
+    index, n_duplicates, gaps = check_samples(time_ms, np.array([2, 0, 1]))
+    np.testing.assert_array_equal(index, [1, 2, 0])
+    assert n_duplicates == 0 and gaps == []
+
+
+def test_find_days(tmp_path, write_sample_file):
+    before_midnight = write_sample_file(
+        tmp_path, [0, 2], file_end=DAY + timedelta(1))
+    after_midnight = write_sample_file(
+        tmp_path, [4], file_end=DAY + timedelta(1, 5))
+    (tmp_path / daily_file_name(123, DAY)).write_bytes(b'')
+    days = find_days(str(tmp_path))
+    # files are named by their end time: one ending at midnight belongs to
+    # the day before
+    assert days == {(123, DAY.date()): [before_midnight],
+                    (123, (DAY + timedelta(1)).date()): [after_midnight]}
+
+
+def resumed_files(directory, write_sample_file):
+    # the second file repeats the last sample of the first, like an
+    # interval that was resumed and written twice
+    return [write_sample_file(directory, [0, 2, 4, 6, 8]),
+            write_sample_file(directory, [8, 10, 12], counter_start=4)]
+
+
+def test_compact_drops_duplicates(tmp_path, write_sample_file):
+    netCDF4 = pytest.importorskip('netCDF4')
+    file_paths = resumed_files(tmp_path, write_sample_file)
+    output_path = str(tmp_path / 'out' / daily_file_name(123, DAY))
+    os.makedirs(os.path.dirname(output_path))
+    result = compact_day(file_paths, output_path, chunk_time=4)
+    assert (result.n_files, result.n_samples, result.n_duplicates,
+            result.n_gaps) == (2, 7, 1, 0)
+    with netCDF4.Dataset(output_path) as ds:
+        seconds = np.arange(0, 13, 2)
+        np.testing.assert_array_equal(ds['time'][:], seconds * 1000)
+        np.testing.assert_array_equal(ds['counter'][:], np.arange(7))
+        # copied raw, 1000 + 10 * s
+        np.testing.assert_array_equal(ds['t_b_median'][:, 0, 0],
+                                      1000 + 10 * seconds)
+        assert ds['t_b_median'].chunking() == [4, 6, 8]
+        assert ds.compacted_duplicates == 1
+
+
+def test_compact_is_idempotent(tmp_path, write_sample_file):
+    pytest.importorskip('netCDF4')
+    file_paths = resumed_files(tmp_path, write_sample_file)
+    output_path = str(tmp_path / daily_file_name(123, DAY))
+    compact_day(file_paths, output_path)
+    modified = os.path.getmtime(output_path)
+    again = compact_day(file_paths, output_path)
+    assert again.skipped and os.path.getmtime(output_path) == modified
+    assert not compact_day(file_paths, output_path, force=True).skipped
+    # a source file that changed since is compacted again
+    file_paths.append(write_sample_file(tmp_path, [20, 22],
+                                        counter_start=8))
+    result = compact_day(file_paths, output_path)
+    assert not result.skipped and result.n_samples == 9
+    assert not os.path.exists(f'{output_path}.part')
+
+
+def test_compact_command(tmp_path, write_sample_file):
+    pytest.importorskip('netCDF4')
+    os.makedirs(tmp_path / 'in')
+    resumed_files(tmp_path / 'in', write_sample_file)
+    argv = [str(tmp_path / 'in'), str(tmp_path / 'out'), '--workers', '1']
+    compact(argv)
+    assert os.listdir(tmp_path / 'out') == [daily_file_name(123, DAY)]
+    compact(argv)
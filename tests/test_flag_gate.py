@@ -0,0 +1,42 @@
+from pixpy.pixpy import FlagGate, FlagState
+
+OPEN = FlagState.OPEN.value
+CLOSED = FlagState.CLOSED.value
+OPENING = FlagState.OPENING.value
+
+
+def updates(gate, states):
+    return [gate.update(state) for state in states]
+
+
+def test_open_flag_is_usable():
+    gate = FlagGate(settle_frames=2)
+    assert gate.settled
+    assert updates(gate, [OPEN] * 3) == [True] * 3
+    assert gate.dropped == 0
+
+
+def test_settles_after_a_cycle():
+    gate = FlagGate(settle_frames=2)
+    gate.expect_cycle()
+    # frames from before the flag closes are not taken as settled
+    assert updates(gate, [OPEN] * 3) == [False] * 3
+    assert not gate.settled
+    assert updates(gate, [CLOSED, OPENING, OPEN, OPEN, OPEN]) == \
+        [False, False, False, False, True]
+    assert gate.settled
+    assert gate.dropped == 7
+
+
+def test_not_open_resets_the_run():
+    gate = FlagGate(settle_frames=2)
+    assert updates(gate, [OPEN, CLOSED, OPEN, OPEN, OPEN]) == \
+        [True, False, False, False, True]
+    assert gate.dropped == 3
+
+
+def test_force_settled():
+    gate = FlagGate(settle_frames=3)
+    gate.expect_cycle()
+    gate.force_settled()
+    assert gate.update(OPEN)
@@ -0,0 +1,47 @@
+from pixpy.metrics import CombinedMetrics, MetricsPush, MetricsRegistry
+
+
+def camera_registry(serial, samples):
+    registry = MetricsRegistry()
+    registry.labels['serial'] = serial
+    registry.counter('pixpy_samples_total', 'Samples').inc(samples)
+    registry.histogram('pixpy_write_seconds', 'Write', buckets=(0.1,))
+    return registry
+
+
+def test_combined_metrics_list_each_metric_once():
+    supervisor = MetricsRegistry()
+    supervisor.labels['process'] = 'supervisor'
+    supervisor.histogram('pixpy_write_seconds', 'Write',
+                         buckets=(0.1,)).observe(0.05)
+    combined = CombinedMetrics(supervisor)
+    for camera, serial in enumerate((101, 102)):
+        registry = camera_registry(serial, camera + 1)
+        combined.update(camera, registry.families(), registry.snapshot())
+    lines = combined.prometheus_text().splitlines()
+    assert lines.count('# TYPE pixpy_write_seconds histogram') == 1
+    assert lines.count('# TYPE pixpy_samples_total counter') == 1
+    assert 'pixpy_samples_total{serial="101"} 1.0' in lines
+    assert 'pixpy_samples_total{serial="102"} 2.0' in lines
+    assert 'pixpy_write_seconds_count{process="supervisor"} 1' in lines
+    assert 'pixpy_write_seconds_count{serial="102"} 0' in lines
+    # a family's samples are together
+    samples = [line for line in lines if line.startswith('pixpy_samples')]
+    start = lines.index(samples[0])
+    assert lines[start:start + 2] == samples
+    snapshot = combined.snapshot()
+    assert snapshot['process'] == 'supervisor'
+    assert snapshot['processes']['1']['pixpy_samples_total'] == 2.0
+
+
+def test_later_push_replaces_earlier():
+    combined = CombinedMetrics(MetricsRegistry())
+    registry = camera_registry(101, 1)
+    MetricsPush(lambda *pushed: combined.update(0, *pushed), 60,
+                registry).push()
+    registry.counter('pixpy_samples_total').inc(2)
+    push = MetricsPush(lambda *pushed: combined.update(0, *pushed), 60,
+                       registry).start()
+    push.stop()
+    assert 'pixpy_samples_total{serial="101"} 3.0' in \
+        combined.prometheus_text().splitlines()
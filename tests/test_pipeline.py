@@ -0,0 +1,93 @@
+from threading import Thread
+from time import sleep
+import pytest
+from pixpy import metrics
+from pixpy.pipeline import CapturePipeline, StageQueue
+
+
+def drain(queue):
+    return [queue.get() for _ in range(queue.depth())]
+
+
+def test_drop_newest():
+    queue = StageQueue('q', 2, 'drop_newest')
+    assert [queue.put(k) for k in range(4)] == [True, True, False, False]
+    assert drain(queue) == [0, 1]
+    assert queue.drop_count == 2
+
+
+def test_drop_oldest():
+    queue = StageQueue('q', 2, 'drop_oldest')
+    assert all(queue.put(k) for k in range(4))
+    assert drain(queue) == [2, 3]
+    assert queue.drop_count == 2
+
+
+def test_control_items_are_never_dropped():
+    queue = StageQueue('q', 1, 'drop_oldest')
+    queue.put('close', droppable=False)
+    queue.put(1)
+    queue.put(2)
+    queue.put('stop', droppable=False)
+    assert drain(queue) == ['close', 2, 'stop']
+    queue = StageQueue('q', 1, 'drop_newest')
+    queue.put(1)
+    assert queue.put('close', droppable=False)
+    assert drain(queue) == [1, 'close']
+
+
+def test_block_waits_for_space():
+    queue = StageQueue('q', 1, 'block')
+    queue.put(0)
+    thread = Thread(target=queue.put, args=(1,))
+    thread.start()
+    sleep(0.05)
+    assert thread.is_alive() and queue.depth() == 1
+    assert queue.get() == 0
+    thread.join(1)
+    assert not thread.is_alive()
+    assert queue.get() == 1
+    assert queue.drop_count == 0 and queue.blocked_s > 0
+
+
+def test_queue_metrics():
+    queue = StageQueue('metered', 2, 'drop_oldest')
+    depth = metrics.gauge('pixpy_metered_queue_depth')
+    dropped = metrics.counter('pixpy_metered_queue_dropped_total')
+    dropped_before = dropped.value
+    for k in range(5):
+        queue.put(k)
+    assert depth.value == 2
+    assert dropped.value - dropped_before == 3
+    queue.get()
+    assert depth.value == 1
+
+
+def test_pipeline_blocks_on_full_write_queue_by_default():
+    pipeline = CapturePipeline(lambda item: None, lambda item: None)
+    assert pipeline.writes.policy == 'block'
+    assert pipeline.frames.policy == 'drop_newest'
+    pipeline.stop()
+
+
+def test_invalid_queue():
+    with pytest.raises(ValueError):
+        StageQueue('q', 1, 'drop_random')
+    with pytest.raises(ValueError):
+        StageQueue('q', 0)
+
+
+def test_pipeline_stop_drains_in_order():
+    written = []
+
+    def aggregate(message):
+        return ('close',) if message == 'end' else ('append', message * 2)
+
+    pipeline = CapturePipeline(aggregate, written.append,
+                               frame_queue_policy='block',
+                               write_queue_policy='block').start()
+    for k in range(100):
+        pipeline.submit_frame(k)
+    pipeline.submit_control('end')
+    pipeline.stop()
+    assert written == [('append', 2 * k) for k in range(100)] + [('close',)]
@@ -0,0 +1,85 @@
+import sys
+from threading import Event, Thread, get_ident
+from time import monotonic, sleep
+from pixpy.profiling import StackSampler, _qualname
+from pixpy.scheduler import sleep_until
+
+
+def sample_thread(target):
+    stop = Event()
+    ready = Event()
+    thread_id = []
+
+    def run():
+        thread_id.append(get_ident())
+        ready.set()
+        while not stop.is_set():
+            target()
+
+    thread = Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait()
+    sampler = StackSampler({thread_id[0]}, interval=0.002).start()
+    sleep(0.2)
+    sampler.stop()
+    stop.set()
+    thread.join()
+    return sampler
+
+
+def busy():
+    end = monotonic() + 0.01
+    while monotonic() < end:
+        pass
+
+
+def test_busy_thread_is_sampled():
+    sampler = sample_thread(busy)
+    assert sum(sampler.stacks['capture'].values()) > 10
+
+
+def test_sleeping_in_the_scheduler_is_idle():
+    sampler = sample_thread(lambda: sleep_until(monotonic() + 0.01))
+    assert sampler.n > 10
+    # at most the odd sample between sleeps
+    assert sum(sampler.stacks.get('capture', {}).values()) < sampler.n / 10
+
+
+def image_capture():
+    # named like the closure in pixpy.app.image_capture
+    def wait_until(deadline):
+        busy()
+        sleep(max(deadline - monotonic(), 0))
+    return wait_until
+
+
+def test_wait_until_is_idle_only_when_innermost():
+    wait_until = image_capture()
+    sampler = sample_thread(lambda: wait_until(monotonic() + 0.02))
+    # the time in busy() is capture work; the sleep is not sampled
+    stacks = sampler.stacks['capture']
+    n_busy = sum(n for stack, n in stacks.items()
+                 if stack.endswith(':busy'))
+    assert n_busy > 0.8 * sum(stacks.values())
+    assert not any(stack.endswith(':image_capture.<locals>.wait_until')
+                   for stack in stacks)
+    assert sum(stacks.values()) < 0.8 * sampler.n
+
+
+class Stage:
+    def __call__(self):
+        return sys._getframe()
+
+
+class SubStage(Stage):
+    def run(self):
+        def wait():
+            return sys._getframe()
+        return wait()
+
+
+def test_qualname_without_co_qualname():
+    # the fallback for python < 3.11 names frames like co_qualname
+    assert _qualname(SubStage()()) == 'Stage.__call__'
+    assert _qualname(SubStage().run()) == 'SubStage.run.<locals>.wait'
+    assert _qualname(sys._getframe()) == 'test_qualname_without_co_qualname'
@@ -0,0 +1,47 @@
+from pixpy.qos import QosController, shed_actions
+
+
+def controller(**kwargs):
+    return QosController(levels=('median', 'compression', 'n_images'),
+                         budget=2.0, **kwargs)
+
+
+def test_load_uses_each_stage_budget():
+    qos = controller()
+    qos.record('write', 1.0)
+    qos.record('capture', 0.1, budget=0.15)
+    assert abs(qos.load() - 0.1 / 0.15) < 1e-12
+    qos.record('capture', 0.01, budget=0.15)
+    assert qos.load() == 0.5
+
+
+def test_long_burst_is_not_load():
+    # a 1.85 s burst every 2 s with little work after it
+    qos = controller()
+    for _ in range(5):
+        qos.record('capture', 0.02, budget=2.0 - 1.85)
+        assert qos.update() == 0
+
+
+def test_levels_up_and_recovers():
+    qos = controller(recover_samples=2)
+    qos.record('capture', 0.2, budget=0.15)
+    assert qos.update() == 1
+    assert qos.update() == 2
+    assert qos.shed('compression') and not qos.shed('n_images')
+    qos.record('capture', 0.01, budget=0.15)
+    assert [qos.update() for _ in range(4)] == [2, 1, 1, 0]
+
+
+def test_lateness_levels_up():
+    qos = controller()
+    assert qos.update(lateness=0.3) == 1
+    assert shed_actions(qos.levels, qos.level) == ('median',)
+
+
+def test_n_images():
+    qos = controller(n_images_factor=0.5)
+    assert qos.n_images(31) == 31
+    qos.level = 3
+    assert qos.n_images(31) == 16
+    assert qos.n_images(1) == 1
@@ -0,0 +1,93 @@
+from datetime import datetime
+import os
+import struct
+import zlib
+import numpy as np
+import pytest
+from pixpy.quicklook import (QuicklookWorker, colourise, encode_png,
+                             make_lut)
+
+
+def decode_png(data):
+    # just enough of a PNG reader for encode_png's output: checks the
+    # signature and every chunk's CRC and undoes the row filters
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    offset, chunks = 8, []
+    while offset < len(data):
+        length, = struct.unpack('>I', data[offset:offset + 4])
+        kind = data[offset + 4:offset + 8]
+        body = data[offset + 8:offset + 8 + length]
+        crc, = struct.unpack('>I', data[offset + 8 + length:
+                                        offset + 12 + length])
+        assert crc == zlib.crc32(kind + body)
+        chunks.append((kind, body))
+        offset += 12 + length
+    assert [kind for kind, _ in chunks] == [b'IHDR', b'IDAT', b'IEND']
+    width, height, depth, colour, _, _, interlace = struct.unpack(
+        '>IIBBBBB', chunks[0][1])
+    assert (depth, colour, interlace) == (8, 2, 0)
+    rows = np.frombuffer(zlib.decompress(chunks[1][1]), dtype=np.uint8)
+    rows = rows.reshape(height, 1 + 3 * width)
+    rgb = np.empty((height, 3 * width), dtype=np.uint8)
+    for y, row in enumerate(rows):
+        if row[0] == 0:
+            rgb[y] = row[1:]
+            continue
+        assert row[0] == 1
+        line = row[1:].astype(np.int64)
+        for k in range(3):
+            line[k::3] = np.cumsum(line[k::3]) % 256
+        rgb[y] = line
+    return rgb.reshape(height, width, 3)
+
+
+def scene(height=12, width=16):
+    yy, xx = np.mgrid[0:height, 0:width]
+    return (1200 + 5 * xx + 3 * yy).astype(np.uint16)
+
+
+def test_png_decodes_to_the_image():
+    rgb = colourise(scene(), make_lut('rainbow'))
+    np.testing.assert_array_equal(decode_png(encode_png(rgb)), rgb)
+
+
+def test_png_opens_with_pillow(tmp_path):
+    Image = pytest.importorskip('PIL.Image')
+    rgb = colourise(scene(), make_lut())
+    (tmp_path / 'q.png').write_bytes(encode_png(rgb))
+    with Image.open(tmp_path / 'q.png') as image:
+        np.testing.assert_array_equal(np.asarray(image), rgb)
+
+
+def test_colourise():
+    lut = make_lut('grey')
+    raw = scene()
+    raw[0, 0] = 0
+    rgb = colourise(raw, lut, limits=(1210, 1250))
+    assert rgb.shape == raw.shape + (3,) and rgb.dtype == np.uint8
+    # not computed is black, values outside the limits are clipped
+    assert (rgb[0, 0] == 0).all()
+    assert (rgb[raw <= 1210] == 0).all()
+    assert (rgb[raw >= 1250] == 255).all()
+    assert colourise(raw, lut, downsample=4).shape == (3, 4, 3)
+    blank = colourise(np.zeros((4, 4), np.uint16), lut)
+    assert not blank.any()
+
+
+def test_unknown_palette_and_format(tmp_path):
+    with pytest.raises(ValueError):
+        make_lut('viridis')
+    with pytest.raises(ValueError):
+        QuicklookWorker(str(tmp_path), 'gif')
+
+
+def test_worker_writes_sample_and_latest(tmp_path):
+    worker = QuicklookWorker(str(tmp_path / 'quicklook'), downsample=2)
+    worker.start()
+    worker.submit(123, datetime(2020, 1, 1, 0, 0, 2), scene())
+    worker.stop()
+    names = sorted(os.listdir(tmp_path / 'quicklook'))
+    assert names == ['123_20200101000002.png', '123_latest.png']
+    for name in names:
+        rgb = decode_png((tmp_path / 'quicklook' / name).read_bytes())
+        assert rgb.shape == (6, 8, 3)
@@ -0,0 +1,70 @@
+import os
+import numpy as np
+import pytest
+from pixpy.pixpy import FRAME_METADATA_DTYPE
+from pixpy.rawarchive import (RawArchiveWriter, available_codecs,
+                              read_raw_archive)
+
+
+def burst(n_frames=5, height=6, width=8, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = rng.integers(1100, 1300, (n_frames, height, width),
+                          dtype=np.uint16)
+    # differences that wrap around in uint16
+    frames[1, 0, 0] = 0
+    frames[2, 0, 0] = 65535
+    meta = np.zeros(n_frames + 2, dtype=FRAME_METADATA_DTYPE)
+    meta['counter'] = np.arange(meta.size) + 100 * seed
+    return frames, meta
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_round_trip(tmp_path, codec):
+    base_path = str(tmp_path / '123_20200101000500')
+    bursts = [burst(seed=k) for k in range(3)]
+    writer = RawArchiveWriter(base_path, codec)
+    for sample, (frames, meta) in enumerate(bursts):
+        writer.append(sample, frames, meta)
+    writer.close()
+    assert writer.nbytes == os.path.getsize(writer.file_path)
+    records = list(read_raw_archive(writer.file_path))
+    assert [sample for sample, _, _ in records] == [0, 1, 2]
+    for (_, frames, meta), (expected, expected_meta) in zip(records, bursts):
+        np.testing.assert_array_equal(frames, expected)
+        # only the rows of the burst's frames are kept
+        np.testing.assert_array_equal(meta, expected_meta[:len(expected)])
+
+
+def test_resume_after_truncated_record(tmp_path):
+    base_path = str(tmp_path / '123_20200101000500')
+    writer = RawArchiveWriter(base_path, 'zlib')
+    writer.append(0, *burst(seed=0))
+    writer.append(1, *burst(seed=1))
+    writer.close(rename=False)
+    # killed part way through writing the second record
+    os.truncate(writer.part_path, os.path.getsize(writer.part_path) - 10)
+    assert [s for s, _, _ in read_raw_archive(writer.part_path)] == [0]
+    writer = RawArchiveWriter(base_path, 'zlib')
+    writer.append(2, *burst(seed=2))
+    writer.close()
+    records = list(read_raw_archive(writer.file_path))
+    assert [sample for sample, _, _ in records] == [0, 2]
+    np.testing.assert_array_equal(records[1][1], burst(seed=2)[0])
+
+
+def test_corrupt_record(tmp_path):
+    writer = RawArchiveWriter(str(tmp_path / '123_20200101000500'), 'zlib')
+    writer.append(0, *burst())
+    writer.close()
+    with open(writer.file_path, 'r+b') as file:
+        file.seek(-1, os.SEEK_END)
+        last = file.read(1)
+        file.seek(-1, os.SEEK_END)
+        file.write(bytes([last[0] ^ 0xff]))
+    with pytest.raises(ValueError):
+        list(read_raw_archive(writer.file_path))
+
+
+def test_unknown_codec(tmp_path):
+    with pytest.raises(ValueError):
+        RawArchiveWriter(str(tmp_path / '123_20200101000500'), 'snappy')
@@ -0,0 +1,92 @@
+from time import sleep
+import numpy as np
+import pytest
+import pixpy.pixpy
+from pixpy.backends import SyntheticBackend
+from pixpy.recovery import (SDK_ERROR, SDK_FATAL, SDK_OK, FrameRecovery,
+                            backoff_delay, classify_return_code)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = SyntheticBackend(width=8, height=6, fps=0, serial=123)
+    monkeypatch.setattr(pixpy.pixpy, '_backend', backend)
+    backend.usb_init('')
+    return backend
+
+
+def fast_recovery(**kwargs):
+    return FrameRecovery('', 123, retry_backoff=0, reinit_backoff=0,
+                         **kwargs)
+
+
+class Reads:
+    """A read that returns the given codes, then SDK_OK."""
+
+    def __init__(self, *codes):
+        self.codes = list(codes)
+        self.n = 0
+
+    def __call__(self, frame_address, meta_address):
+        self.n += 1
+        return self.codes.pop(0) if self.codes else SDK_OK
+
+
+def test_classify_return_code():
+    assert classify_return_code(SDK_OK) == 'ok'
+    assert classify_return_code(SDK_ERROR) == 'retry'
+    assert classify_return_code(SDK_FATAL) == 'reinit'
+    assert classify_return_code(-7) == 'reinit'
+
+
+def test_backoff_delay():
+    assert [backoff_delay(k, 0.1, 0.5) for k in range(5)] == \
+        [0.1, 0.2, 0.4, 0.5, 0.5]
+
+
+def test_retry_in_place(backend):
+    recovery = fast_recovery(n_retries=3)
+    read = Reads(SDK_ERROR)
+    assert recovery.recover(SDK_ERROR, read, 0, 0) == SDK_OK
+    assert read.n == 2
+    assert recovery.state == 'reading'
+    assert recovery.n_errors == 1
+
+
+def test_persistent_error_reinits(backend):
+    recovery = fast_recovery(n_retries=2)
+    read = Reads(SDK_ERROR, SDK_ERROR)
+    backend.terminate()
+    assert recovery.recover(SDK_ERROR, read, 0, 0) == SDK_OK
+    # two retries, then one read after the reinit
+    assert read.n == 3
+    assert backend.get_serial() == 123
+
+
+def test_fatal_error_skips_retries(backend):
+    recovery = fast_recovery(n_retries=3)
+    read = Reads()
+    assert recovery.recover(SDK_FATAL, read, 0, 0) == SDK_OK
+    assert read.n == 1
+
+
+def test_wrong_camera_after_reinit(backend):
+    recovery = FrameRecovery('', 456, n_retries=1, n_reinits=2,
+                             retry_backoff=0, reinit_backoff=0)
+    with pytest.raises(RuntimeError):
+        recovery.recover(SDK_FATAL, Reads(), 0, 0)
+    assert recovery.state == 'failed'
+
+
+def test_burst_survives_a_glitch(backend):
+    backend.glitch_interval = 0.05
+    backend.glitch_frames = 2
+    backend.usb_init('')
+    sleep(0.06)
+    recovery = fast_recovery(n_retries=3)
+    grabber = pixpy.pixpy.FrameGrabber(8, 6, recovery)
+    frames = np.zeros((5, 6, 8), dtype=np.uint16)
+    meta = np.zeros(5, dtype=pixpy.pixpy.FRAME_METADATA_DTYPE)
+    pixpy.pixpy.capture_burst(5, frames, meta, grabber=grabber)
+    assert recovery.n_errors == 1
+    assert (frames > 0).all()
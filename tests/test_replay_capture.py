@@ -0,0 +1,81 @@
+from datetime import timedelta
+from glob import glob
+import numpy as np
+import pytest
+import pixpy.pixpy
+from pixpy import app
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+SERIAL = 12080103
+IMAGER_CONFIG = f'''<?xml version="1.0" encoding="UTF-8"?>
+<imager><serial>{SERIAL}</serial><framerate>32</framerate></imager>
+'''
+SCHEDULE = '''<?xml version="1.0" encoding="UTF-8"?>
+<schedule_config>
+	<file_interval>2</file_interval>
+	<sample_interval>0.2</sample_interval>
+	<sample_repetition>0.5</sample_repetition>
+	<output_directory>{}</output_directory>
+	<statistics>mean</statistics>
+</schedule_config>
+'''
+
+
+def write_replay_file(file_path, n=64, height=6, width=8):
+    with netCDF4.Dataset(file_path, 'w') as ds:
+        ds.serial = SERIAL
+        ds.imager_config_file_contents = IMAGER_CONFIG
+        ds.createDimension('time', n)
+        ds.createDimension('y', height)
+        ds.createDimension('x', width)
+        images = ds.createVariable('t_b_snapshot', 'u2', ('time', 'y', 'x'))
+        images[:] = 1200 + np.arange(n)[:, None, None] % 7
+        ds.createVariable('flag_state', 'u1', ('time',))[:] = 0
+
+
+def capture_one_file(tmp_path, flag_duration):
+    replay_path = str(tmp_path / 'replay.nc')
+    write_replay_file(replay_path)
+    (tmp_path / 'imager.xml').write_text(IMAGER_CONFIG)
+    output = tmp_path / 'out'
+    (tmp_path / 'schedule.xml').write_text(SCHEDULE.format(output))
+    app.configure([
+        '--imager_config_file', str(tmp_path / 'imager.xml'),
+        '--schedule_config_file', str(tmp_path / 'schedule.xml'),
+        '--camera_backend', 'replay', '--replay_files', replay_path,
+        '--flag_timeout', '0.5', '--metrics_port', '0'])
+    pixpy.pixpy.get_backend().flag_duration = flag_duration
+    config_vars, shutter = app.app_setup()
+    # trigger before every sample
+    shutter.min_trigger_interval = timedelta(0)
+    writer = app.SampleWriter()
+    start_lateness, flag_wait = [], []
+    try:
+        # capture starts part way through a file interval, so the first
+        # file may only have one sample
+        while len(start_lateness) < 3:
+            app.image_capture(config_vars, shutter, writer=writer)
+            writer.close_all()
+            file_path = sorted(glob(str(output / '*.nc')))[-1]
+            with netCDF4.Dataset(file_path) as ds:
+                start_lateness.extend(ds['start_lateness'][:])
+                flag_wait.extend(ds['flag_wait'][:])
+    finally:
+        pixpy.pixpy.terminate()
+        pixpy.pixpy.set_backend(None)
+    return shutter, np.array(start_lateness), np.array(flag_wait)
+
+
+def test_replay_cycles_the_flag(tmp_path):
+    shutter, start_lateness, flag_wait = capture_one_file(tmp_path, 0.1)
+    assert shutter.flag_visible
+    assert np.all(start_lateness < 100)  # ms
+    assert np.all(flag_wait >= 100)
+
+
+def test_no_flag_cycle_falls_back_to_the_delay(tmp_path):
+    shutter, start_lateness, _ = capture_one_file(tmp_path, 0)
+    assert not shutter.flag_visible
+    # only the first sample waits for --flag_timeout
+    assert np.all(start_lateness[1:] < 100)
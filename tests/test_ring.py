@@ -0,0 +1,107 @@
+import os
+from threading import Thread
+import numpy as np
+import pytest
+from pixpy.pixpy import FRAME_METADATA_DTYPE
+from pixpy.ring import FrameRing, RingReader
+
+HEIGHT, WIDTH = 24, 32
+
+
+@pytest.fixture
+def ring(request):
+    ring = FrameRing(f'pixpy_test_{os.getpid()}_{request.node.name}'[:30],
+                     HEIGHT, WIDTH, n_slots=4)
+    yield ring
+    ring.close()
+
+
+def publish(ring, n):
+    meta = np.zeros((), dtype=FRAME_METADATA_DTYPE)
+    meta['counter'] = n
+    ring.publish(np.full((HEIGHT, WIDTH), n, dtype=np.uint16), meta)
+
+
+def test_read_published_frames(ring):
+    reader = RingReader(ring.name)
+    assert reader.latest() is None
+    for n in range(3):
+        publish(ring, n)
+    n, meta = reader.latest()
+    assert n == 2 and meta['counter'] == 2
+    frame = np.empty((HEIGHT, WIDTH), dtype=np.uint16)
+    assert reader.read(1, frame)['counter'] == 1
+    assert (frame == 1).all()
+    # not published yet
+    assert reader.read(3) is None
+    reader.close()
+
+
+def test_overwritten_frames_are_not_read(ring):
+    reader = RingReader(ring.name)
+    for n in range(6):
+        publish(ring, n)
+    assert reader.read(1) is None
+    assert reader.read(2)['counter'] == 2
+    view = reader.view(2)
+    assert reader.valid(2)
+    publish(ring, 6)
+    # the slot of frame 2 now holds frame 6
+    assert not reader.valid(2) and (view == 6).all()
+    reader.close()
+
+
+def test_frame_being_written_is_not_read(ring):
+    reader = RingReader(ring.name)
+    publish(ring, 0)
+    # what a reader sees half way through publish() of frame 4
+    ring.seq[0] = 2 * 4 + 1
+    assert reader.read(0) is None
+    assert reader.read(4) is None
+    reader.close()
+
+
+def test_frames_from_counts_overruns(ring):
+    reader = RingReader(ring.name)
+    for n in range(10):
+        publish(ring, n)
+    numbers = [n for n, _, _ in reader.frames_from(0, timeout=0)]
+    assert numbers == [7, 8, 9]
+    assert reader.overruns == 7
+    reader.close()
+
+
+def test_no_torn_frames_while_publishing(ring):
+    reader = RingReader(ring.name)
+    n_frames = 2000
+
+    def produce():
+        for n in range(n_frames):
+            publish(ring, n)
+
+    producer = Thread(target=produce)
+    producer.start()
+    n_read = 0
+    for n, frame, meta in reader.frames_from(0, poll=0, timeout=0.5):
+        # every frame is filled with its number: a frame copied while the
+        # producer overwrote it would mix two numbers
+        assert meta['counter'] == n
+        assert (frame == n % 65536).all()
+        n_read += 1
+        if n == n_frames - 1:
+            break
+    producer.join()
+    assert n_read + reader.overruns >= n_frames
+    reader.close()
+
+
+def test_stale_ring_is_replaced():
+    name = f'pixpy_test_{os.getpid()}_stale'
+    stale = FrameRing(name, HEIGHT, WIDTH)
+    publish(stale, 0)
+    # a killed capture never unlinks its ring
+    ring = FrameRing(name, HEIGHT, WIDTH, n_slots=8)
+    reader = RingReader(name)
+    assert reader.n_slots == 8 and reader.published() == 0
+    reader.close()
+    ring.close()
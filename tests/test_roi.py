@@ -0,0 +1,105 @@
+from datetime import datetime
+import numpy as np
+import pytest
+from pixpy.pixpy import FRAME_METADATA_DTYPE
+from pixpy.roi import RoiSeries, make_roi, parse_roi_statistics
+
+HEIGHT, WIDTH = 6, 8
+
+
+def frames(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(1000, 1500, (n, HEIGHT, WIDTH), dtype=np.uint16)
+
+
+def test_make_roi_ranges_count_y_from_the_bottom():
+    roi = make_roi({'name': 'wall', 'x': '1:2', 'y': '0'}, HEIGHT, WIDTH)
+    bottom = (HEIGHT - 1) * WIDTH
+    np.testing.assert_array_equal(roi.index, [bottom + 1, bottom + 2])
+
+
+def test_make_roi_mask(tmp_path):
+    mask = np.zeros((HEIGHT, WIDTH), dtype=bool)
+    mask[2, 3] = mask[0, 0] = True
+    np.save(tmp_path / 'mask.npy', mask)
+    roi = make_roi({'name': 'spot', 'mask': str(tmp_path / 'mask.npy')},
+                   HEIGHT, WIDTH)
+    np.testing.assert_array_equal(roi.index, [0, 2 * WIDTH + 3])
+
+
+@pytest.mark.parametrize('spec', [
+    {'name': 'bad name', 'x': '0', 'y': '0'},
+    {'name': 'wall', 'x': '0:8', 'y': '0'},
+    {'name': 'wall', 'x': '3:2', 'y': '0'},
+])
+def test_invalid_roi(spec):
+    with pytest.raises(ValueError):
+        make_roi(spec, HEIGHT, WIDTH)
+
+
+def test_parse_roi_statistics():
+    assert parse_roi_statistics('mean, p95 max') == ('mean', 'p95', 'max')
+    for text in ('', 'median'):
+        with pytest.raises(ValueError):
+            parse_roi_statistics(text)
+
+
+def test_roi_series_matches_numpy():
+    rois = [make_roi({'name': 'wall', 'x': '0:3', 'y': '1:4'},
+                     HEIGHT, WIDTH),
+            make_roi({'name': 'pixel', 'x': '7', 'y': '5'}, HEIGHT, WIDTH)]
+    statistics = ('mean', 'min', 'max', 'p90')
+    # 10 frames in blocks of 4: two full blocks and a partial one
+    series = RoiSeries(rois, statistics, block_size=4,
+                       dt_epoch_timestamp=100.0)
+    images = frames(10)
+    meta = np.zeros(10, dtype=FRAME_METADATA_DTYPE)
+    meta['counterHW'] = np.arange(10) + 50
+    meta['flagState'][3] = 1
+    for k, (frame, row) in enumerate(zip(images, meta)):
+        series.add(frame, row, 100.0 + k * 0.25)
+    rows = series.flush()
+    assert series.flush() is None
+    assert list(rows) == ['wall', 'pixel']
+    for roi in rois:
+        values = images.reshape(10, -1)[:, roi.index]
+        celsius = (values.astype(float) - 1000) / 10
+        roi_rows = rows[roi.name]
+        np.testing.assert_allclose(roi_rows['time'], np.arange(10) * 250.0)
+        np.testing.assert_array_equal(roi_rows['counterHW'], meta['counterHW'])
+        np.testing.assert_array_equal(roi_rows['flag_state'],
+                                      meta['flagState'])
+        np.testing.assert_allclose(roi_rows['mean'], celsius.mean(axis=1),
+                                   rtol=1e-6)
+        np.testing.assert_allclose(roi_rows['min'], celsius.min(axis=1))
+        np.testing.assert_allclose(roi_rows['max'], celsius.max(axis=1))
+        np.testing.assert_allclose(roi_rows['p90'],
+                                   np.percentile(celsius, 90, axis=1),
+                                   rtol=1e-6)
+
+
+def test_roi_writer_appends_across_reopen(tmp_path):
+    netCDF4 = pytest.importorskip('netCDF4')
+    from pixpy.writer import RoiWriter
+    roi = make_roi({'name': 'wall', 'x': '0:3', 'y': '0:1'}, HEIGHT, WIDTH)
+    series = RoiSeries([roi], ('mean', 'max'), block_size=4)
+    meta = np.zeros((), dtype=FRAME_METADATA_DTYPE)
+    base_path = str(tmp_path / '123_20200101000500')
+    for k, frame in enumerate(frames(6)):
+        series.add(frame, meta, k * 0.5)
+    blocks = series.flush()['wall']
+    row_dtype = blocks.dtype
+    writer = RoiWriter(base_path, 'wall', row_dtype, datetime(2020, 1, 1),
+                       {'serial': 123})
+    writer.append(blocks[:4])
+    # a restarted capture resumes the .part file
+    writer.close(rename=False)
+    writer = RoiWriter(base_path, 'wall', row_dtype, datetime(2020, 1, 1),
+                       {'serial': 123})
+    writer.append(blocks[4:])
+    writer.close()
+    with netCDF4.Dataset(writer.file_path) as ds:
+        assert ds.roi == 'wall'
+        np.testing.assert_allclose(ds['time'][:], blocks['time'])
+        np.testing.assert_allclose(ds['t_b_mean'][:], blocks['mean'])
+        np.testing.assert_allclose(ds['t_b_max'][:], blocks['max'])
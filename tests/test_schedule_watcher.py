@@ -0,0 +1,67 @@
+import os
+import pytest
+from pixpy.scheduler import ScheduleWatcher
+
+SCHEDULE = '''<?xml version="1.0" encoding="UTF-8"?>
+<schedule_config>
+	<file_interval>6</file_interval>
+	<sample_interval>1</sample_interval>
+	<sample_repetition>2</sample_repetition>
+	<output_directory>{directory}</output_directory>
+	{extra}
+</schedule_config>
+'''
+ROI = '<rois><roi name="a" x="0:3" y="0:3"/></rois>'
+
+
+def write_schedule(config_file, extra=''):
+    with open(config_file, 'w') as file:
+        file.write(SCHEDULE.format(directory=os.path.dirname(config_file),
+                                   extra=extra))
+    # a new mtime even within the file system's timestamp resolution
+    stat = os.stat(config_file)
+    os.utime(config_file, ns=(stat.st_atime_ns,
+                              stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    config_file = str(tmp_path / 'schedule.xml')
+    write_schedule(config_file, ROI)
+    return config_file
+
+
+def test_reads_once_until_changed(config_file):
+    watcher = ScheduleWatcher(config_file, lambda: (8, 6))
+    schedule_config, ssched = watcher.get()
+    assert schedule_config['rois'][0]['name'] == 'a'
+    assert watcher.get()[1] is ssched
+    assert watcher.version == 1
+    write_schedule(config_file, ROI + '<statistics>median</statistics>')
+    assert watcher.get()[0]['statistics'] == 'median'
+    assert watcher.version == 2
+
+
+@pytest.mark.parametrize('extra', [
+    '<storage_backend>zarr</storage_backend>',
+    '<statistics>mode</statistics>',
+    '<rois><roi name="a" x="0:30" y="0:3"/></rois>',
+    '<rois><roi name="a" x="0:3"/></rois>',
+    ROI + '<roi_statistics>mode</roi_statistics>',
+    '<qos_levels>bogus</qos_levels>',
+    '<raw_archive>1</raw_archive><raw_archive_codec>gzip</raw_archive_codec>',
+    '<quicklook>1</quicklook><quicklook_format>gif</quicklook_format>',
+    '<sample_interval>',
+])
+def test_invalid_change_keeps_previous_config(config_file, extra):
+    watcher = ScheduleWatcher(config_file, lambda: (8, 6))
+    previous = watcher.get()
+    write_schedule(config_file, extra)
+    assert watcher.get() == previous
+    assert watcher.version == 1
+
+
+def test_invalid_first_read(config_file):
+    write_schedule(config_file, '<storage_backend>zarr</storage_backend>')
+    with pytest.raises(ValueError):
+        ScheduleWatcher(config_file).get()
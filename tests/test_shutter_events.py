@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+from importlib.util import module_from_spec, spec_from_file_location
+from threading import Thread
+from time import monotonic
+from types import SimpleNamespace
+import os
+import pytest
+from pixpy.shutter_events import BURST_DONE, SHUTTER_OPEN, ShutterEvents
+
+START = datetime(2020, 1, 1, 0, 0, 10)
+
+
+@pytest.fixture
+def events(tmp_path):
+    base_path = str(tmp_path / 'shutter')
+    capture = ShutterEvents(base_path, 'capture')
+    servo = ShutterEvents(base_path, 'servo')
+    yield capture, servo
+    capture.close()
+    servo.close()
+
+
+def test_send_and_wait(events):
+    capture, servo = events
+    assert servo.send(SHUTTER_OPEN, START)
+    assert capture.wait(SHUTTER_OPEN, START, 1.0)
+
+
+def test_events_for_other_samples_are_ignored(events):
+    capture, servo = events
+    servo.send(SHUTTER_OPEN, START - timedelta(seconds=2))
+    servo.send(BURST_DONE, START)
+    start = monotonic()
+    assert not capture.wait(SHUTTER_OPEN, START, 0.1)
+    assert monotonic() - start >= 0.1
+    servo.send(SHUTTER_OPEN, START)
+    assert capture.wait(SHUTTER_OPEN, START, 1.0)
+
+
+def test_send_without_peer(tmp_path):
+    capture = ShutterEvents(str(tmp_path / 'shutter'), 'capture')
+    assert not capture.send(BURST_DONE, START)
+    capture.close()
+    assert not os.path.exists(capture.path)
+
+
+def test_invalid_side(tmp_path):
+    with pytest.raises(ValueError):
+        ShutterEvents(str(tmp_path / 'shutter'), 'camera')
+
+
+@pytest.fixture
+def routine():
+    # the servo shutter script, with gpiozero's mock pins in place of pigpio
+    gpiozero = pytest.importorskip('gpiozero')
+    from gpiozero.pins.mock import MockFactory, MockPWMPin
+    spec = spec_from_file_location(
+        'shutter_routine_testing',
+        os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                     'shutter_routine_testing.py'))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.servo = gpiozero.Servo(
+        18, pin_factory=MockFactory(pin_class=MockPWMPin))
+    yield module
+    module.servo.close()
+
+
+def shutter_schedule(routine):
+    return routine.ShutterSnapshotSchedule(
+        file_interval=timedelta(seconds=60),
+        sample_interval=timedelta(seconds=0.1),
+        sample_repetition=timedelta(seconds=1),
+        servo_move_time=timedelta(seconds=0.05))
+
+
+def test_servo_waits_for_burst_done(routine, events):
+    capture, servo = events
+    ssched = shutter_schedule(routine)
+    deadline = SimpleNamespace(trigger_monotonic=monotonic(), start=START,
+                               end=START + ssched.sample_interval)
+    seen = {}
+
+    def pixpy_app():
+        seen['open'] = capture.wait(SHUTTER_OPEN, START, 1.0)
+        seen['value'] = routine.servo.value
+        capture.send(BURST_DONE, START)
+
+    thread = Thread(target=pixpy_app)
+    thread.start()
+    start = monotonic()
+    routine.activate_shutter(ssched, deadline, servo, burst_timeout=5.0)
+    thread.join()
+    assert seen == {'open': True, 'value': 1}
+    assert routine.servo.value == 0
+    # closed on the event, not the timeout
+    assert monotonic() - start < 1.0
+
+
+def test_servo_closes_without_burst_done(routine, events):
+    _, servo = events
+    ssched = shutter_schedule(routine)
+    deadline = SimpleNamespace(trigger_monotonic=monotonic(), start=START,
+                               end=START + ssched.sample_interval)
+    start = monotonic()
+    routine.activate_shutter(ssched, deadline, servo, burst_timeout=0.1)
+    # move, then wait move + sample interval + burst_timeout
+    assert monotonic() - start >= 0.3
+    assert routine.servo.value == 0
+
+
+def test_servo_schedule_must_fit(routine):
+    with pytest.raises(ValueError):
+        routine.ShutterSnapshotSchedule(
+            file_interval=timedelta(seconds=60),
+            sample_interval=timedelta(seconds=0.5),
+            sample_repetition=timedelta(seconds=1),
+            servo_move_time=timedelta(seconds=0.3))
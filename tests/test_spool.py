@@ -0,0 +1,132 @@
+from datetime import datetime
+import json
+import os
+from threading import Event
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import pixpy.spool
+from pixpy.app import (SampleWriter, preallocate_image_timeseries,
+                       preallocate_meta_timeseries)
+from pixpy.spool import (finalise_part_files, mark_deferred, recover_spools,
+                         file_time_end)
+from pixpy.writer import NpySpoolWriter
+
+NOW = datetime(2020, 1, 1, 0, 7)
+ENDED = '123_20200101000500'
+OPEN = '123_20200101001000'
+
+
+def write_spool(directory, name, n_written=2, close=False,
+                convert_to='netcdf', compression='zlib'):
+    images = preallocate_image_timeseries(6, 8, n_written)
+    for field in images.dtype.names:
+        images[field] = 1200
+    meta = preallocate_meta_timeseries(n_written)
+    meta[:] = 0
+    meta['time'] = np.arange(n_written) * 1000.0
+    writer = NpySpoolWriter(
+        os.path.join(directory, name), 6, 8, 4, datetime(2020, 1, 1),
+        meta.dtype, {'serial': 123}, compression=compression,
+        compression_level=5, image_dtype=images.dtype, convert_to=convert_to)
+    for image_row, meta_row in zip(images, meta):
+        writer.append(image_row, meta_row)
+    writer.close(rename=close)
+    return writer.file_path if close else writer.part_path
+
+
+def test_file_time_end():
+    assert file_time_end(f'/data/{ENDED}_roi_wall.nc.part') == \
+        datetime(2020, 1, 1, 0, 5)
+    with pytest.raises(ValueError):
+        file_time_end('/data/pixpy_metrics_123.jsonl')
+
+
+def test_unfinished_spools(tmp_path):
+    pytest.importorskip('netCDF4')
+    write_spool(tmp_path, ENDED)
+    write_spool(tmp_path, OPEN)
+    recovered = recover_spools(str(tmp_path), 'netcdf', now=NOW)
+    assert recovered == [str(tmp_path / f'{ENDED}.nc')]
+    # the open interval is left for the capture to resume
+    assert sorted(os.listdir(tmp_path)) == \
+        [f'{ENDED}.nc', f'{OPEN}.spool.part']
+
+
+def test_only_deferred_spools_are_converted(tmp_path):
+    pytest.importorskip('netCDF4')
+    mark_deferred(write_spool(tmp_path, ENDED, close=True))
+    write_spool(tmp_path, OPEN, close=True)
+    recovered = recover_spools(str(tmp_path), 'netcdf', now=NOW)
+    assert recovered == [str(tmp_path / f'{ENDED}.nc')]
+    assert sorted(os.listdir(tmp_path)) == \
+        [f'{ENDED}.nc', f'{OPEN}.spool']
+
+
+def test_npy_spools_are_only_renamed(tmp_path):
+    write_spool(tmp_path, ENDED, convert_to='npy')
+    finished = write_spool(tmp_path, OPEN, n_written=3, close=True,
+                           convert_to='npy')
+    assert recover_spools(str(tmp_path), 'netcdf',
+                          now=datetime(2020, 1, 1, 1)) == \
+        [str(tmp_path / f'{ENDED}.spool')]
+    assert sorted(os.listdir(tmp_path)) == \
+        [f'{ENDED}.spool', f'{OPEN}.spool']
+    meta = np.load(os.path.join(finished, 'meta.npy'))
+    assert np.isfinite(meta['time']).sum() == 3
+
+
+def test_spools_are_recovered_with_their_own_settings(tmp_path):
+    pytest.importorskip('h5py')
+    # written while the schedule config said h5py, uncompressed
+    write_spool(tmp_path, ENDED, convert_to='h5py', compression='none')
+    old = write_spool(tmp_path, '123_20200101000000')
+    with open(os.path.join(old, 'attrs.json')) as file:
+        header = json.load(file)
+    for key in ('storage_backend', 'compression', 'compression_level'):
+        del header[key]
+    with open(os.path.join(old, 'attrs.json'), 'w') as file:
+        json.dump(header, file)
+    recovered = recover_spools(str(tmp_path), 'npy', now=NOW)
+    # a spool from before the settings were kept gets the given ones
+    assert recovered == [str(tmp_path / '123_20200101000000.spool'),
+                         str(tmp_path / f'{ENDED}.h5')]
+    import h5py
+    with h5py.File(recovered[1]) as f:
+        assert f['t_b_median'].compression is None
+        assert f['time'].shape == (2,)
+
+
+def test_finalise_part_files(tmp_path):
+    names = [f'{ENDED}.nc', f'{ENDED}_roi_wall.nc', f'{ENDED}_raw.pxr',
+             f'{OPEN}.nc', 'notes.txt']
+    for name in names:
+        (tmp_path / f'{name}.part').write_bytes(b'')
+    finalised = finalise_part_files(str(tmp_path), now=NOW)
+    assert sorted(finalised) == sorted(str(tmp_path / name)
+                                       for name in names[:3])
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        names[:3] + [f'{OPEN}.nc.part', 'notes.txt.part'])
+
+
+def test_conversion_does_not_block_the_writer(tmp_path, monkeypatch):
+    spool_path = write_spool(tmp_path, ENDED, close=True)
+    mark_deferred(spool_path)
+    release = Event()
+    convert_spool = pixpy.spool.convert_spool
+
+    def slow_convert_spool(*args, **kwargs):
+        release.wait(10)
+        return convert_spool(*args, **kwargs)
+
+    monkeypatch.setattr(pixpy.spool, 'convert_spool', slow_convert_spool)
+    writer = SampleWriter()
+    interval = SimpleNamespace(storage_backend='npy', compression='zlib',
+                               compression_level=5)
+    writer.deferred.append((spool_path, interval))
+    writer.convert_deferred()
+    # returned with the conversion still waiting on the background thread
+    assert os.path.exists(os.path.join(spool_path, 'deferred'))
+    release.set()
+    writer.close_all()
+    assert not os.path.exists(os.path.join(spool_path, 'deferred'))
@@ -0,0 +1,22 @@
+from queue import Queue
+from pixpy.qos import QosController
+from pixpy.supervisor import QueueWriter, WriteTime
+
+
+def test_write_times_reach_the_capture_qos():
+    # the shared array of the supervisor, one slot per camera
+    write_seconds = [0.0, 0.0]
+    WriteTime(write_seconds, 0).record('write', 0.25)
+    WriteTime(write_seconds, 1).record('write', 0.5)
+    assert write_seconds == [0.25, 0.5]
+    qos = QosController(budget=1.0)
+    queue = Queue()
+    writer = QueueWriter(queue, 1, qos, write_seconds)
+    writer(('close', None))
+    assert queue.get_nowait() == (1, ('close', None))
+    # one writer thread writes the samples of both cameras
+    assert qos.load() == 0.75
+    assert qos.update() == 0
+    WriteTime(write_seconds, 0).record('write', 0.5)
+    writer(('close', None))
+    assert qos.update() == 1
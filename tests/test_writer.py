@@ -0,0 +1,80 @@
+from datetime import datetime
+import os
+import numpy as np
+import pytest
+from pixpy.app import preallocate_image_timeseries, preallocate_meta_timeseries
+from pixpy.writer import NpySpoolWriter, open_writer
+
+EPOCH = datetime(2020, 1, 1)
+NAME = '123_20200101000500'
+
+
+def write(directory, storage_backend, seconds, statistics=None, height=6,
+          width=8, close=False):
+    images = preallocate_image_timeseries(height, width, len(seconds),
+                                          statistics)
+    for field in images.dtype.names:
+        images[field] = 1200
+    meta = preallocate_meta_timeseries(len(seconds))
+    meta[:] = 0
+    meta['time'] = np.asarray(seconds, dtype=float) * 1000
+    writer = open_writer(storage_backend, os.path.join(directory, NAME),
+                         height, width, 4, EPOCH, meta.dtype, {'serial': 123},
+                         image_dtype=images.dtype)
+    for image_row, meta_row in zip(images, meta):
+        writer.append(image_row, meta_row)
+    writer.close(rename=close)
+    return writer
+
+
+def stored_times(storage_backend, file_path):
+    if storage_backend == 'netcdf':
+        import netCDF4
+        with netCDF4.Dataset(file_path) as ds:
+            return list(ds['time'][:])
+    if storage_backend == 'h5py':
+        import h5py
+        with h5py.File(file_path) as f:
+            return list(f['time'][:])
+    meta = np.load(os.path.join(file_path, 'meta.npy'))
+    return list(meta['time'][np.isfinite(meta['time'])])
+
+
+@pytest.fixture(params=['netcdf', 'h5py', 'npy'])
+def storage_backend(request):
+    if request.param != 'npy':
+        pytest.importorskip({'netcdf': 'netCDF4'}.get(request.param,
+                                                      request.param))
+    return request.param
+
+
+def test_resume(tmp_path, storage_backend):
+    write(tmp_path, storage_backend, [0, 2])
+    writer = write(tmp_path, storage_backend, [4], close=True)
+    assert stored_times(storage_backend, writer.file_path) == \
+        [0, 2000, 4000]
+    assert os.listdir(tmp_path) == [os.path.basename(writer.file_path)]
+
+
+@pytest.mark.parametrize('change', ['statistics', 'size'])
+def test_mismatched_part_is_set_aside(tmp_path, storage_backend, change):
+    write(tmp_path, storage_backend, [0, 2.5])
+    if change == 'statistics':
+        writer = write(tmp_path, storage_backend, [4], ('mean', 'max'),
+                       close=True)
+    else:
+        writer = write(tmp_path, storage_backend, [4], height=4, close=True)
+    assert stored_times(storage_backend, writer.file_path) == [4000]
+    # the old samples end as a file ending just after its last one
+    extension = NpySpoolWriter.extension + '.part' \
+        if storage_backend == 'npy' else os.path.splitext(writer.file_path)[1]
+    set_aside = str(tmp_path / f'123_20200101000003{extension}')
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        [os.path.basename(writer.file_path), os.path.basename(set_aside)])
+    assert stored_times(storage_backend, set_aside) == [0, 2500]
+
+
+def test_empty_mismatched_part_is_removed(tmp_path, storage_backend):
+    write(tmp_path, storage_backend, [])
+    writer = write(tmp_path, storage_backend, [4], ('mean',), close=True)
+    assert os.listdir(tmp_path) == [os.path.basename(writer.file_path)]